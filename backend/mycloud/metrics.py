@@ -0,0 +1,391 @@
+"""
+Метрики запросов в формате Prometheus (text exposition 0.0.4).
+
+Счетчики копятся в памяти процесса. Под gunicorn с несколькими воркерами
+задайте METRICS_DIR: каждый процесс периодически сбрасывает туда снимок
+своих счетчиков (<pid>_<метка запуска>.json), а эндпоинт /api/metrics/
+складывает снимки всех процессов. Снимки завершившихся процессов переносятся
+в dead.json и удаляются — так файлы не копятся, а счетчики не уменьшаются
+после перезапуска воркеров и при повторном использовании PID.
+
+Запросы к БД считаются обертками execute_wrappers, которые ставятся на
+каждое соединение один раз и пишут в статистику текущего запроса через
+contextvar — поэтому учитываются и запросы из sync_to_async асинхронных views.
+"""
+import atexit
+import contextvars
+import fcntl
+import hmac
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger('mycloud')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограммы длительности запросов, секунды
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (имя, тип, описание)
+METRICS = (
+    ('http_requests_total', 'counter', "Обработанные запросы"),
+    ('http_request_duration_seconds', 'histogram', "Длительность обработки запроса"),
+    ('http_request_bytes_total', 'counter', "Байт в телах запросов"),
+    ('http_response_bytes_total', 'counter', "Байт в ответах (для потоковых — по Content-Length)"),
+    ('db_queries_total', 'counter', "Запросы к БД"),
+    ('db_query_duration_seconds_total', 'counter', "Суммарное время запросов к БД"),
+    ('slow_requests_total', 'counter', "Запросы дольше METRICS_SLOW_REQUEST_MS"),
+)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+current_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+
+def instrument_connection(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def instrument_connections():
+    # Соединения текущего потока, открытые до подключения сигнала
+    for connection in connections.all():
+        instrument_connection(connection)
+
+
+connection_created.connect(instrument_connection, dispatch_uid='mycloud.metrics')
+
+
+class Registry:
+    """Потокобезопасные счетчики: {(метрика, метки): значение}."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._flushed_at = 0.0
+        self._pid = None
+        self._file_name = None
+
+    def observe(self, view, method, status_code, duration, bytes_in, bytes_out, stats, slow):
+        labels = (('view', view), ('method', method))
+        status_labels = labels + (('status', str(status_code)),)
+        bucket = next((str(bound) for bound in DURATION_BUCKETS if duration <= bound), '+Inf')
+        with self._lock:
+            values = self._values
+            for key, amount in (
+                (('http_requests_total', status_labels), 1),
+                (('http_request_duration_seconds_bucket', labels + (('le', bucket),)), 1),
+                (('http_request_duration_seconds_sum', labels), duration),
+                (('http_request_duration_seconds_count', labels), 1),
+                (('http_request_bytes_total', labels), bytes_in),
+                (('http_response_bytes_total', labels), bytes_out),
+                (('db_queries_total', labels), stats.queries),
+                (('db_query_duration_seconds_total', labels), stats.query_time),
+                (('slow_requests_total', labels), 1 if slow else 0),
+            ):
+                values[key] = values.get(key, 0) + amount
+        self._maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _maybe_flush(self):
+        if not settings.METRICS_DIR:
+            return
+        now = time.monotonic()
+        if now - self._flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self._flushed_at = now
+        self.flush()
+
+    def file_name(self):
+        # Метка запуска отличает процесс от прежнего с тем же PID: его снимок
+        # не перезаписывается, а будет перенесен в dead.json после смерти
+        pid = os.getpid()
+        if self._pid != pid:
+            self._pid = pid
+            self._file_name = f'{pid}_{uuid.uuid4().hex[:8]}.json'
+            atexit.register(self._close, pid)
+        return self._file_name
+
+    def flush(self):
+        """Сохраняет снимок счетчиков процесса в METRICS_DIR/<pid>_<метка>.json."""
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        rows = [[name, list(labels), value] for (name, labels), value in self.snapshot().items()]
+        _write_rows(os.path.join(settings.METRICS_DIR, self.file_name()), rows)
+
+    def _close(self, pid):
+        # atexit наследуется форком: завершается только тот процесс, что регистрировал
+        if os.getpid() != pid or not settings.METRICS_DIR:
+            return
+        try:
+            self.flush()
+            with _locked_dir():
+                _merge_dead([self.file_name()])
+        except OSError:
+            logger.exception("Не удалось сохранить метрики процесса %s", pid)
+
+
+registry = Registry()
+
+DEAD_FILE = 'dead.json'
+LOCK_FILE = '.lock'
+
+
+def _write_rows(path, rows):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as fp:
+        json.dump(rows, fp)
+    os.replace(tmp_path, path)
+
+
+def _read(path, merged):
+    try:
+        with open(path) as fp:
+            rows = json.load(fp)
+    except (OSError, ValueError):
+        return
+    for metric, labels, value in rows:
+        key = (metric, tuple(tuple(pair) for pair in labels))
+        merged[key] = merged.get(key, 0) + value
+
+
+@contextmanager
+def _locked_dir():
+    """Эксклюзивная блокировка METRICS_DIR между процессами."""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.METRICS_DIR, LOCK_FILE), 'a') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _snapshot_files():
+    """{имя файла: pid} снимков процессов в METRICS_DIR."""
+    files = {}
+    for name in os.listdir(settings.METRICS_DIR):
+        stem, ext = os.path.splitext(name)
+        pid = stem.split('_', 1)[0]
+        if ext == '.json' and pid.isdigit():
+            files[name] = int(pid)
+    return files
+
+
+def _merge_dead(names):
+    """Переносит снимки завершившихся процессов в dead.json (под _locked_dir)."""
+    if not names:
+        return
+    merged = {}
+    _read(os.path.join(settings.METRICS_DIR, DEAD_FILE), merged)
+    for name in names:
+        _read(os.path.join(settings.METRICS_DIR, name), merged)
+    rows = [[name, list(labels), value] for (name, labels), value in merged.items()]
+    _write_rows(os.path.join(settings.METRICS_DIR, DEAD_FILE), rows)
+    for name in names:
+        try:
+            os.remove(os.path.join(settings.METRICS_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def mark_process_dead(pid):
+    """Переносит в dead.json снимки процесса pid (например, убитого по SIGKILL)."""
+    with _locked_dir():
+        _merge_dead([name for name, owner in _snapshot_files().items() if owner == pid])
+
+
+def collect():
+    """Счетчики всех процессов (или только текущего, если METRICS_DIR не задан)."""
+    if not settings.METRICS_DIR:
+        return registry.snapshot()
+
+    registry.flush()
+    merged = {}
+    with _locked_dir():
+        files = _snapshot_files()
+        own = registry.file_name()
+        dead = [name for name, pid in files.items() if name != own and not _process_alive(pid)]
+        _merge_dead(dead)
+        _read(os.path.join(settings.METRICS_DIR, DEAD_FILE), merged)
+        for name in files:
+            if name not in dead:
+                _read(os.path.join(settings.METRICS_DIR, name), merged)
+    return merged
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def render(values):
+    # Корзины гистограммы в Prometheus накопительные: пересчитываем из попаданий
+    buckets = {}
+    for (name, labels), value in values.items():
+        if name == 'http_request_duration_seconds_bucket':
+            *base, (_, bound) = labels
+            buckets.setdefault(tuple(base), Counter())[bound] += value
+
+    lines = []
+    for metric, kind, description in METRICS:
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {kind}')
+        if kind == 'histogram':
+            for base, hits in sorted(buckets.items()):
+                total = 0
+                for bound in [str(bound) for bound in DURATION_BUCKETS] + ['+Inf']:
+                    total += hits.get(bound, 0)
+                    lines.append(f'{metric}_bucket{_format_labels(base + (("le", bound),))} {total}')
+            names = (f'{metric}_sum', f'{metric}_count')
+        else:
+            names = (metric,)
+        for (name, labels), value in sorted(values.items()):
+            if name in names:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Эндпоинт для Prometheus. Доступен администратору или по заголовку
+    Authorization: Bearer <METRICS_TOKEN>.
+    """
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    authorized = bool(token) and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
+    if not authorized:
+        user = getattr(request, 'user', None)
+        authorized = user is not None and user.is_authenticated and user.is_admin
+    if not authorized:
+        return JsonResponse({"error": "Нет прав для просмотра метрик"}, status=403)
+    return HttpResponse(render(collect()), content_type=CONTENT_TYPE)
+
+
+class StackSampler:
+    """
+    Сэмплирующий профилировщик: фоновый поток раз в interval секунд снимает
+    стеки потоков, обрабатывающих запросы, и копит их в виде folded stacks
+    (формат flamegraph.pl и speedscope). Поток запускается при первом запросе.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}
+        self._thread = None
+        self._thread_pid = None
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._active[thread_id] = samples
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in active.items():
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = ';'.join(
+                    f'{summary.name} ({os.path.basename(summary.filename)}:{summary.lineno})'
+                    for summary in traceback.extract_stack(frame)
+                )
+                samples[stack] += 1
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                _sampler = StackSampler(settings.METRICS_PROFILE_INTERVAL_MS / 1000)
+    return _sampler
+
+
+def save_profile(request, duration, samples):
+    """Пишет folded stacks медленного запроса в METRICS_PROFILE_DIR (не больше METRICS_PROFILE_MAX_FILES)."""
+    if not samples:
+        return None
+    directory = settings.METRICS_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    if len(os.listdir(directory)) >= settings.METRICS_PROFILE_MAX_FILES:
+        return None
+    path = os.path.join(directory, f'{int(time.time() * 1000)}_{os.getpid()}_{threading.get_ident()}.folded')
+    with open(path, 'w') as fp:
+        for stack, count in samples.most_common():
+            fp.write(f'{stack} {count}\n')
+    return path
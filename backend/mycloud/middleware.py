@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import RequestStats, current_stats, get_sampler, instrument_connections, registry, save_profile
+
+logger = logging.getLogger('mycloud')
+
+
+class RequestMetricsMiddleware:
+    """
+    Учитывает для каждого запроса время, число и время запросов к БД, размер
+    тела запроса и ответа и имя view (см. mycloud/metrics.py). Запросы дольше
+    METRICS_SLOW_REQUEST_MS логируются, а при METRICS_PROFILE_SLOW для них
+    сохраняются стеки, снятые сэмплирующим профилировщиком.
+    Ставится первым в MIDDLEWARE, чтобы учитывать время остальных middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        instrument_connections()
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        thread_id = threading.get_ident()
+        profiling = settings.METRICS_PROFILE_SLOW and settings.METRICS_SLOW_REQUEST_MS
+        if profiling:
+            get_sampler().start(thread_id)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - started
+            samples = get_sampler().stop(thread_id) if profiling else None
+            current_stats.reset(token)
+        self.record(request, response, duration, stats, samples)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        # Event loop обслуживает много запросов сразу — стеки под ASGI не снимаются
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            duration = time.perf_counter() - started
+            current_stats.reset(token)
+        self.record(request, response, duration, stats, None)
+        return response
+
+    def record(self, request, response, duration, stats, samples):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        try:
+            bytes_in = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            bytes_in = 0
+        if response.streaming:
+            bytes_out = int(response.get('Content-Length') or 0)
+        else:
+            bytes_out = len(response.content)
+
+        threshold = settings.METRICS_SLOW_REQUEST_MS
+        slow = bool(threshold) and duration * 1000 >= threshold
+        registry.observe(view, request.method, response.status_code, duration, bytes_in, bytes_out, stats, slow)
+        if not slow:
+            return
+
+        profile = save_profile(request, duration, samples) if samples else None
+        logger.warning(
+            "Медленный запрос %s %s: %.0f мс, запросов к БД %s (%.0f мс)",
+            request.method, view, duration * 1000, stats.queries, stats.query_time * 1000,
+            extra={
+                'view': view,
+                'method': request.method,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 1),
+                'db_queries': stats.queries,
+                'db_time_ms': round(stats.query_time * 1000, 1),
+                'profile': profile,
+            },
+        )
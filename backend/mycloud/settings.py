@@ -1,11 +1,17 @@
 from pathlib import Path
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 import os
+import sys
+import tempfile
+from datetime import timedelta
 import environ
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Запуск тестов (manage.py test)
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
 env = environ.Env()
 environ.Env.read_env(os.path.join(BASE_DIR, ".env"))
 
@@ -13,12 +19,146 @@ environ.Env.read_env(os.path.join(BASE_DIR, ".env"))
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Хранилище файлов (см. storage/backends.py): local — MEDIA_ROOT, sharded — несколько каталогов
+# STORAGE_SHARDS через запятую, s3 — S3-совместимое хранилище (AWS, MinIO), нужен django-storages[s3]
+STORAGE_BACKEND = config('STORAGE_BACKEND', default='local')
+STORAGE_SHARDS = config('STORAGE_SHARDS', cast=Csv(), default='')
+# Чанки возобновляемой загрузки при удаленном хранилище собираются локально;
+# каталог должен быть доступен и веб-процессам, и воркеру run_worker
+UPLOAD_STAGING_DIR = config('UPLOAD_STAGING_DIR', default=str(BASE_DIR / 'upload_staging'))
+# Параллельная multipart-загрузка в S3 и срок жизни presigned-ссылок на скачивание
+S3_MULTIPART_THRESHOLD = config('S3_MULTIPART_THRESHOLD', cast=int, default=16 * 1024 ** 2)
+S3_MULTIPART_CHUNK_SIZE = config('S3_MULTIPART_CHUNK_SIZE', cast=int, default=16 * 1024 ** 2)
+S3_MULTIPART_CONCURRENCY = config('S3_MULTIPART_CONCURRENCY', cast=int, default=8)
+S3_DOWNLOAD_URL_EXPIRE = config('S3_DOWNLOAD_URL_EXPIRE', cast=int, default=300)
+
+DEFAULT_STORAGE_BACKENDS = {
+    'local': {
+        'BACKEND': 'storage.backends.LocalStorage',
+    },
+    'sharded': {
+        'BACKEND': 'storage.backends.ShardedStorage',
+        'OPTIONS': {'locations': STORAGE_SHARDS},
+    },
+    's3': {
+        'BACKEND': 'storage.backends.S3Storage',
+        'OPTIONS': {
+            'bucket_name': config('S3_BUCKET', default=''),
+            'endpoint_url': config('S3_ENDPOINT_URL', default=None),
+            'region_name': config('S3_REGION', default=None),
+            'access_key': config('S3_ACCESS_KEY', default=None),
+            'secret_key': config('S3_SECRET_KEY', default=None),
+            'location': config('S3_PREFIX', default=''),
+            'default_acl': None,
+            'file_overwrite': True,
+            'querystring_auth': True,
+        },
+    },
+}
+STORAGES = {
+    'default': DEFAULT_STORAGE_BACKENDS[STORAGE_BACKEND],
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Сжатие файлов в хранилище zstd (нужен пакет zstandard, см. storage/compression.py): файл сжимаемого
+# типа не меньше STORAGE_COMPRESSION_MIN_SIZE байт сжимается, если его начало ужимается
+# хотя бы до STORAGE_COMPRESSION_MAX_RATIO исходного размера. Уже записанные файлы не меняются
+STORAGE_COMPRESSION = config('STORAGE_COMPRESSION', cast=bool, default=False)
+STORAGE_COMPRESSION_LEVEL = config('STORAGE_COMPRESSION_LEVEL', cast=int, default=3)
+STORAGE_COMPRESSION_MIN_SIZE = config('STORAGE_COMPRESSION_MIN_SIZE', cast=int, default=4096)
+STORAGE_COMPRESSION_MAX_RATIO = config('STORAGE_COMPRESSION_MAX_RATIO', cast=float, default=0.8)
+
+# Отдача файлов: django (FileResponse, для разработки), nginx (X-Accel-Redirect) или apache (X-Sendfile)
+FILE_DELIVERY_BACKEND = config('FILE_DELIVERY_BACKEND', default='django')
+# Внутренний location nginx, который смотрит на MEDIA_ROOT
+FILE_DELIVERY_NGINX_PREFIX = config('FILE_DELIVERY_NGINX_PREFIX', default='/protected-media/')
+
+# Статистика скачиваний копится в памяти процесса и пишется в БД пакетами:
+# раз в DOWNLOAD_STATS_FLUSH_INTERVAL секунд или при накоплении DOWNLOAD_STATS_MAX_PENDING записей
+DOWNLOAD_STATS_FLUSH_INTERVAL = config('DOWNLOAD_STATS_FLUSH_INTERVAL', cast=float, default=5.0)
+DOWNLOAD_STATS_MAX_PENDING = config('DOWNLOAD_STATS_MAX_PENDING', cast=int, default=1000)
+# Без фонового потока (по умолчанию в тестах) накопленное сохраняет только явный вызов
+# storage.downloads.flush(): поток не пишет в БД параллельно с тестами
+DOWNLOAD_STATS_BACKGROUND = config('DOWNLOAD_STATS_BACKGROUND', cast=bool, default=not TESTING)
+
+# Срок действия подписанных ссылок на скачивание из списка файлов, секунды
+DOWNLOAD_LINK_TTL = config('DOWNLOAD_LINK_TTL', cast=int, default=3600)
+# Предельный срок публичной ссылки (ShareLink), секунды; 0 — без ограничения
+SHARE_LINK_MAX_TTL = config('SHARE_LINK_MAX_TTL', cast=int, default=30 * 24 * 60 * 60)
+
+# Возобновляемая загрузка по чанкам: максимальный размер файла и одного чанка
+UPLOAD_SESSION_MAX_SIZE = config('UPLOAD_SESSION_MAX_SIZE', cast=int, default=50 * 1024 ** 3)
+UPLOAD_CHUNK_MAX_SIZE = config('UPLOAD_CHUNK_MAX_SIZE', cast=int, default=64 * 1024 ** 2)
+
+# Квота на пользователя по умолчанию в байтах (0 — без ограничения)
+DEFAULT_STORAGE_QUOTA = config('DEFAULT_STORAGE_QUOTA', cast=int, default=10 * 1024 ** 3)
+
+# Кэш превью (ключ — содержимое файла) и его предельный размер в байтах
+PREVIEW_CACHE_DIR = config('PREVIEW_CACHE_DIR', default=str(BASE_DIR / 'preview_cache'))
+PREVIEW_CACHE_MAX_SIZE = config('PREVIEW_CACHE_MAX_SIZE', cast=int, default=1024 ** 3)
+# Как часто процесс сверяет размер кэша с диском (кэш общий для всех процессов)
+PREVIEW_CACHE_SCAN_INTERVAL = config('PREVIEW_CACHE_SCAN_INTERVAL', cast=int, default=60)
+
+# Фоновые задачи (manage.py run_worker): опрос очереди, повторы и зависшие задачи
+JOB_POLL_INTERVAL = config('JOB_POLL_INTERVAL', cast=float, default=1.0)
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', cast=int, default=5)
+JOB_RETRY_DELAY = config('JOB_RETRY_DELAY', cast=int, default=10)
+JOB_LOCK_TIMEOUT = config('JOB_LOCK_TIMEOUT', cast=int, default=600)
+# Как часто воркер продлевает блокировку выполняемой задачи; должно быть меньше JOB_LOCK_TIMEOUT
+JOB_HEARTBEAT_INTERVAL = config('JOB_HEARTBEAT_INTERVAL', cast=float, default=60.0)
+JOB_CLEANUP_INTERVAL = config('JOB_CLEANUP_INTERVAL', cast=int, default=3600)
+# Незавершенная сессия загрузки удаляется через UPLOAD_SESSION_TTL секунд бездействия
+UPLOAD_SESSION_TTL = config('UPLOAD_SESSION_TTL', cast=int, default=7 * 24 * 3600)
+# Файл блоба без записи в БД (сбой загрузки) удаляется уборкой не раньше чем через столько секунд
+BLOB_ORPHAN_GRACE_PERIOD = config('BLOB_ORPHAN_GRACE_PERIOD', cast=int, default=24 * 3600)
+
+# Записи журнала изменений файлов старше FILE_CHANGES_RETENTION_DAYS удаляются уборкой;
+# клиенту с более старым курсором понадобится полная синхронизация
+FILE_CHANGES_RETENTION_DAYS = config('FILE_CHANGES_RETENTION_DAYS', cast=int, default=90)
+
+# Проверка загруженных файлов антивирусом, например "clamdscan --no-summary --fdpass"
+VIRUS_SCAN_COMMAND = config('VIRUS_SCAN_COMMAND', default='')
+VIRUS_SCAN_TIMEOUT = config('VIRUS_SCAN_TIMEOUT', cast=int, default=300)
+
+# Потоки для хэширования и записи файлов при пакетной загрузке (общий пул на процесс)
+UPLOAD_WORKERS = config('UPLOAD_WORKERS', cast=int, default=4)
+
+# Метрики запросов для Prometheus (/api/metrics/, см. mycloud/metrics.py)
+METRICS_ENABLED = config('METRICS_ENABLED', cast=bool, default=True)
+# Токен для сборщика метрик (Authorization: Bearer ...); без него эндпоинт доступен только администратору
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+# Общая директория снимков счетчиков для нескольких воркеров gunicorn (пусто — только текущий процесс)
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', cast=float, default=10.0)
+# Запросы дольше порога логируются (0 — отключено); при METRICS_PROFILE_SLOW для них сохраняются
+# стеки сэмплирующего профилировщика в формате folded stacks (flamegraph.pl, speedscope)
+METRICS_SLOW_REQUEST_MS = config('METRICS_SLOW_REQUEST_MS', cast=int, default=1000)
+METRICS_PROFILE_SLOW = config('METRICS_PROFILE_SLOW', cast=bool, default=False)
+METRICS_PROFILE_INTERVAL_MS = config('METRICS_PROFILE_INTERVAL_MS', cast=int, default=5)
+METRICS_PROFILE_DIR = config('METRICS_PROFILE_DIR', default=os.path.join(tempfile.gettempdir(), 'mycloud_profiles'))
+METRICS_PROFILE_MAX_FILES = config('METRICS_PROFILE_MAX_FILES', cast=int, default=100)
+
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ORIGIN_ALLOW_ALL = True
 
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Кэш без внешних сервисов: по умолчанию файловый, общий для всех воркеров на хосте.
+# Бэкенд и расположение настраиваются (например, LocMemCache для тестов)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'mycloud_cache')),
+    }
+}
+
+# Сессии читаются из кэша и только при промахе — из БД
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+# Сколько секунд пользователь сессии живет в кэше процесса (0 — не кэшировать)
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', cast=int, default=30)
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SECURE = False
 SESSION_COOKIE_SAMESITE = "Lax"
@@ -39,16 +179,27 @@ CSRF_USE_SESSIONS = False
 SECRET_KEY = config('SECRET_KEY')
 DEBUG = config('DEBUG', cast=bool, default=False)
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': config('DB_NAME'),
-        'USER': config('DB_USER'),
-        'PASSWORD': config('DB_PASSWORD'),
-        'HOST': config('DB_HOST'),
-        'PORT': config('DB_PORT'),
+# DB_ENGINE=sqlite — локальная замена PostgreSQL (разработка, bench_storage)
+DB_ENGINE = config('DB_ENGINE', default='postgresql')
+
+if DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER'),
+            'PASSWORD': config('DB_PASSWORD'),
+            'HOST': config('DB_HOST'),
+            'PORT': config('DB_PORT'),
+        }
     }
-}
 
 ALLOWED_HOSTS = ['localhost', '127.0.0.1', 'localhost:5173', '', '194.58.126.217']
 
@@ -74,23 +225,43 @@ INSTALLED_APPS = [
 
 SITE_ID = 1
 
+# Basic-аутентификация хэширует пароль на каждом запросе — включается только явно
+API_BASIC_AUTH = config('API_BASIC_AUTH', cast=bool, default=False)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
-    ],
+        'users.authentication.CachedJWTAuthentication',
+    ] + (['rest_framework.authentication.BasicAuthentication'] if API_BASIC_AUTH else []),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 }
 
+# JWT для API и клиентов синхронизации: /api/token/, /api/token/refresh/, /api/token/blacklist/
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=config('JWT_ACCESS_MINUTES', cast=int, default=5)),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=config('JWT_REFRESH_DAYS', cast=int, default=7)),
+    'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': True,
+    # Смена пароля делает выданные токены недействительными
+    'CHECK_REVOKE_TOKEN': True,
+    'USER_ID_FIELD': 'id',
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.CachedTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.CachedTokenRefreshSerializer',
+    'TOKEN_BLACKLIST_SERIALIZER': 'users.serializers.CachedTokenBlacklistSerializer',
+}
+# Сколько секунд кэшируется результат проверки refresh-токена по черному списку
+JWT_BLACKLIST_CACHE_TTL = config('JWT_BLACKLIST_CACHE_TTL', cast=int, default=60)
+
 MIDDLEWARE = [
+    'mycloud.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -167,31 +338,60 @@ CORS_ALLOW_HEADERS = [
     'accept',
     'origin',
     'x-csrftoken',
+    'content-range',
+    'x-chunk-sha256',
+    'range',
+    'if-range',
+    'if-none-match',
+    'if-modified-since',
 ]
 
+# Уровень и формат логов: text или json (одна JSON-строка на запись, с полями из extra)
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='text')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'text': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+        'json': {
+            '()': 'mycloud.log_format.JsonFormatter',
+        },
+    },
     'handlers': {
         'console': {
-            'level': 'INFO',
+            'level': LOG_LEVEL,
             'class': 'logging.StreamHandler',
+            'formatter': LOG_FORMAT,
         },
     },
     'loggers': {
         'django': {
             'handlers': ['console'],
-            'level': 'INFO',
+            'level': LOG_LEVEL,
             'propagate': True,
         },
         'django.request': {
             'handlers': ['console'],
-            'level': 'INFO',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
         'users': {
             'handlers': ['console'],
-            'level': 'INFO',
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'storage': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'mycloud': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
             'propagate': False,
         },
     },
@@ -2,11 +2,14 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
+from rest_framework_simplejwt.views import TokenBlacklistView, TokenObtainPairView, TokenRefreshView
 from users.views import (
     RegisterView, LoginView, LogoutView, UpdateUserView, 
     DeleteUserView, GetUsersView, CheckAuthView, get_csrf_token
 )
-from storage.views import FileUploadView
+from storage.views import FileUploadView, ShareLinkView, UploadSessionView, media_download, shared_download, signed_download
+from storage import async_views
+from .metrics import metrics_view
 
 # Регистрация ViewSet для работы с файлами
 router = DefaultRouter()
@@ -15,8 +18,14 @@ router.register(r'files', FileUploadView, basename='file')
 urlpatterns = [
     # Используем маршруты для APIView (RegisterView, LoginView, LogoutView)
     path('api/csrf/', get_csrf_token, name='csrf_token'),
+    # Метрики для Prometheus
+    path('api/metrics/', metrics_view, name='metrics'),
     path('api/users/register/', RegisterView.as_view(), name='register'),
     path('api/users/login/', LoginView.as_view(), name='login'),
+    # JWT для API и клиентов синхронизации (сериализаторы заданы в SIMPLE_JWT)
+    path('api/token/', TokenObtainPairView.as_view(), name='token-obtain'),
+    path('api/token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('api/token/blacklist/', TokenBlacklistView.as_view(), name='token-blacklist'),
     path("api/users/check-auth/", CheckAuthView.as_view(), name="check-auth"),
     path('api/users/logout/', LogoutView.as_view(), name='logout'),
     path('api/users/update/', UpdateUserView.as_view(), name='update-user'),
@@ -25,11 +34,41 @@ urlpatterns = [
     
     path('api/files/<int:user_id>/upload/', FileUploadView.as_view({'post': 'upload_file'}), name='file-upload'),
     path('api/files/<int:user_id>/', FileUploadView.as_view({'get': 'get_list'}), name='file-list'),
+    path('api/files/<int:user_id>/search/', FileUploadView.as_view({'get': 'search'}), name='file-search'),
+    path('api/files/<int:user_id>/changes/', FileUploadView.as_view({'get': 'get_changes'}), name='file-changes'),
     path('api/files/<int:file_id>/download/', FileUploadView.as_view({'get': 'download_file'}), name='download-file'),
+    path('api/files/bulk/delete/', FileUploadView.as_view({'post': 'delete_files'}), name='bulk-delete'),
+    path('api/files/bulk/move/', FileUploadView.as_view({'post': 'move_files'}), name='bulk-move'),
+    path('api/files/bulk/comment/', FileUploadView.as_view({'post': 'comment_files'}), name='bulk-comment'),
+    path('api/files/archive/', FileUploadView.as_view({'get': 'download_archive', 'post': 'download_archive'}), name='download-archive'),
+    path('api/files/<int:file_id>/preview/', FileUploadView.as_view({'get': 'preview_file'}), name='preview-file'),
     path('api/files/<int:user_id>/delete/<int:file_id>/', FileUploadView.as_view({'delete': 'delete_file'}), name='delete-file'),
     path('api/files/<int:file_id>/update/', FileUploadView.as_view({'patch': 'update_file'}), name='update_file'),
+
+    # Подписанные ссылки на скачивание (без сессии) и публичные ссылки
+    path('api/files/signed/<str:token>/', signed_download, name='signed-download'),
+    path('api/files/<int:file_id>/share/', ShareLinkView.as_view({'get': 'list_links', 'post': 'create_link'}), name='file-share-links'),
+    path('api/files/share/<str:token>/', ShareLinkView.as_view({'delete': 'revoke_link'}), name='share-link'),
+    path('api/share/<str:token>/', shared_download, name='shared-download'),
+    # Содержимое файлов, которые не отдает /media/ (шарды, S3)
+    path('api/media/<path:name>', media_download, name='media-download'),
+
+    # Возобновляемая загрузка по чанкам
+    path('api/files/<int:user_id>/upload-sessions/', UploadSessionView.as_view({'post': 'create_session'}), name='upload-session-create'),
+    path('api/files/upload-sessions/<uuid:session_id>/', UploadSessionView.as_view({'get': 'get_session_status', 'put': 'upload_chunk', 'delete': 'abort_session'}), name='upload-session'),
+    path('api/files/upload-sessions/<uuid:session_id>/complete/', UploadSessionView.as_view({'post': 'complete_session'}), name='upload-session-complete'),
     
+    # Асинхронные версии для ASGI (uvicorn mycloud.asgi:application)
+    path('api/async/files/<int:user_id>/upload/', async_views.upload_file, name='async-file-upload'),
+    path('api/async/files/<int:user_id>/', async_views.get_list, name='async-file-list'),
+    path('api/async/files/<int:file_id>/download/', async_views.download_file, name='async-download-file'),
+    path('api/async/files/archive/', async_views.download_archive, name='async-download-archive'),
+
     # Маршруты ViewSet через DefaultRouter
     path('api/', include(router.urls)),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+# Медиа отдается Django только в режиме разработки без фронтового веб-сервера
+if settings.FILE_DELIVERY_BACKEND == 'django':
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
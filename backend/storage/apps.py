@@ -6,4 +6,6 @@ class StorageConfig(AppConfig):
     name = 'storage'
 
     def ready(self):
-        import storage.signals
\ No newline at end of file
+        import storage.signals
+        # Регистрация обработчиков фоновых задач
+        import storage.tasks
\ No newline at end of file
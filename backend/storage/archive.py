@@ -0,0 +1,178 @@
+"""
+ZIP-архив нескольких файлов, собираемый на лету.
+
+Архив пишется в поток без временного файла и без буфера на весь архив:
+zipfile работает с несекабельным выходом (размеры и CRC записываются в data
+descriptor после содержимого), а байты отдаются клиенту по мере чтения блоков
+файла из хранилища. Записи о файлах выбираются из БД пакетами по id, поэтому
+в памяти держатся только текущий блок и оглавление архива (central directory),
+которое zip пишет в конце.
+
+Уже сжатые форматы (изображения, видео, архивы, офисные документы) кладутся
+без сжатия — это экономит CPU и почти не меняет размер.
+"""
+import io
+import logging
+import posixpath
+import zipfile
+
+from asgiref.sync import sync_to_async
+from django.utils.timezone import localtime
+
+from .backends import file_available
+from .compression import content_stream, is_compressible_type
+from .downloads import record_download
+from .filters import parse_ids
+from .models import File
+
+logger = logging.getLogger('storage')
+
+# Поля файла, нужные для записи в архив
+ARCHIVE_FIELDS = ('id', 'file_name', 'url', 'file_size', 'type', 'updated_at')
+# Записей о файлах в одном запросе к БД
+ARCHIVE_BATCH_SIZE = 1000
+# Предел числа id в одном запросе на архив (весь аккаунт — параметр user_id)
+ARCHIVE_MAX_IDS = 10000
+
+
+class ArchiveError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def compression_for(content_type):
+    return zipfile.ZIP_DEFLATED if is_compressible_type(content_type) else zipfile.ZIP_STORED
+
+
+def select_files(user, params):
+    """
+    Выбирает файлы для архива по параметрам запроса: ids (список или строка
+    через запятую) или user_id — все файлы пользователя (себе или администратору).
+    Права на все перечисленные файлы проверяются одним запросом.
+    Возвращает (queryset, имя архива).
+    """
+    owner_id = params.get('user_id')
+
+    if owner_id:
+        try:
+            owner_id = int(owner_id)
+        except (TypeError, ValueError):
+            raise ArchiveError("Параметр user_id должен быть числом.", 400)
+        if not user.is_admin and user.id != owner_id:
+            raise ArchiveError("Нет прав для просмотра файлов пользователя.", 403)
+        return File.objects.filter(user_id=owner_id), f'files_{owner_id}.zip'
+
+    try:
+        ids = parse_ids(params)
+    except ValueError as e:
+        raise ArchiveError(str(e), 400)
+    if not ids:
+        raise ArchiveError("Укажите файлы (ids) или пользователя (user_id).", 400)
+    if len(ids) > ARCHIVE_MAX_IDS:
+        raise ArchiveError(f"Не больше {ARCHIVE_MAX_IDS} файлов в одном архиве.", 400)
+
+    files = File.objects.filter(id__in=ids)
+    if not user.is_admin:
+        files = files.filter(user=user)
+    if files.count() != len(ids):
+        raise ArchiveError("Файлы не найдены.", 404)
+    return files, 'files.zip'
+
+
+def iter_rows(files, batch_size=ARCHIVE_BATCH_SIZE):
+    """Записи о файлах пакетами по возрастанию id (keyset, без OFFSET и серверного курсора)."""
+    last_id = 0
+    while True:
+        batch = list(files.filter(id__gt=last_id).order_by('id').values_list(*ARCHIVE_FIELDS)[:batch_size])
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1][0]
+
+
+class _Output(io.RawIOBase):
+    """Несекабельный приемник для zipfile: накапливает записанное до следующей отдачи."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _entry_name(file_name, file_id, used):
+    # Имена без каталогов: разделители из имени файла не должны создавать пути при распаковке
+    name = file_name.replace('/', '_').replace('\\', '_').strip()
+    if name in ('', '.', '..'):
+        name = f'file_{file_id}'
+    base, extension = posixpath.splitext(name)
+    candidate = name
+    number = 2
+    while candidate in used:
+        candidate = f'{base} ({number}){extension}'
+        number += 1
+    used.add(candidate)
+    return candidate
+
+
+def iter_archive(files):
+    """Генератор байтов ZIP-архива из файлов queryset files."""
+    output = _Output()
+    archive = zipfile.ZipFile(output, mode='w', allowZip64=True)
+    used_names = set()
+
+    for file_id, file_name, name, size, content_type, updated_at in iter_rows(files):
+        # Файл после загрузки по чанкам еще не перенесен в хранилище, или удален с диска
+        if not name or not file_available(name):
+            logger.warning("Файл %s пропущен в архиве: нет в хранилище", file_id)
+            continue
+
+        info = zipfile.ZipInfo(_entry_name(file_name, file_id, used_names), localtime(updated_at).timetuple()[:6])
+        info.compress_type = compression_for(content_type)
+        info.external_attr = 0o644 << 16
+        # По размеру zipfile заранее решает, нужен ли ZIP64 для записи
+        info.file_size = size
+        with archive.open(info, mode='w') as target:
+            for block in content_stream(name):
+                target.write(block)
+                data = output.take()
+                if data:
+                    yield data
+        # Data descriptor записи (CRC и размеры) zipfile дописывает при закрытии
+        data = output.take()
+        if data:
+            yield data
+        record_download(file_id)
+
+    archive.close()
+    yield output.take()
+
+
+async def aiter_archive(files):
+    """
+    Асинхронный вариант для ASGI. Шаги генератора выполняются в потоке,
+    закрепленном за запросом (thread_sensitive): чтение файлов и запросы
+    к БД не блокируют event loop и идут через одно соединение.
+    """
+    iterator = iter_archive(files)
+    step = sync_to_async(next)
+    try:
+        while True:
+            data = await step(iterator, None)
+            if data is None:
+                return
+            if data:
+                yield data
+    finally:
+        await sync_to_async(iterator.close)()
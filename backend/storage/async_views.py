@@ -0,0 +1,209 @@
+"""
+Асинхронные версии загрузки, скачивания и списка файлов для запуска под ASGI
+(uvicorn mycloud.asgi:application). Логика и формат ответов те же, что у
+FileUploadView; запросы к БД идут через async ORM, а чтение и запись файлов
+выполняются в пуле потоков, не блокируя event loop.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sites.models import Site
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from rest_framework import status
+from rest_framework.authentication import CSRFCheck
+from rest_framework.request import Request
+
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from users.auth_cache import get_cached_user
+from users.authentication import CachedJWTAuthentication
+
+from .archive import ArchiveError, aiter_archive, select_files
+from .backends import file_available
+from .delivery import file_response
+from .downloads import is_new_download, record_download
+from .filters import filter_files
+from .ingest import ingest_files, upload_response
+from .models import File
+from .pagination import FileCursorPagination
+from .serializers import FILE_QUERY_FIELDS, FileSerializer
+
+User = get_user_model()
+
+
+jwt_authentication = CachedJWTAuthentication()
+
+
+class CsrfFailed(Exception):
+    pass
+
+
+def session_csrf(view):
+    """
+    Отключает проверку CsrfViewMiddleware: CSRF проверяется в authenticate
+    только для пользователя из сессии, как в SessionAuthentication DRF,
+    поэтому клиентам с Bearer-токеном CSRF-cookie не нужна.
+    """
+    view.csrf_exempt = True
+    return view
+
+
+def enforce_csrf(request):
+    check = CSRFCheck(lambda request: None)
+    # process_request заполняет META['CSRF_COOKIE'], которую читает process_view
+    check.process_request(request)
+    reason = check.process_view(request, None, (), {})
+    if reason:
+        raise CsrfFailed(reason)
+
+
+def authenticate(request):
+    # Сначала Bearer-токен (клиенты API), затем сессия
+    try:
+        result = jwt_authentication.authenticate(request)
+    except (AuthenticationFailed, InvalidToken):
+        return AnonymousUser()
+    if result is not None:
+        return result[0]
+    user = get_cached_user(request)
+    if user.is_authenticated:
+        enforce_csrf(request)
+    return user
+
+
+async def get_request_user(request):
+    """
+    Возвращает (пользователь, None) или (None, ответ с ошибкой), если запрос
+    не аутентифицирован или не прошел проверку CSRF.
+    """
+    # Загрузка сессии и пользователя — синхронный код, выполняем вне event loop
+    try:
+        user = await sync_to_async(authenticate)(request)
+    except CsrfFailed as e:
+        return None, JsonResponse({"detail": f"CSRF Failed: {e}"}, status=status.HTTP_403_FORBIDDEN)
+    if not user.is_authenticated:
+        return None, JsonResponse(
+            {"detail": "Учетные данные не были предоставлены."}, status=status.HTTP_403_FORBIDDEN
+        )
+    return user, None
+
+
+# Загрузка файлов
+@session_csrf
+async def upload_file(request, user_id=None):
+    if request.method != 'POST':
+        return JsonResponse({"error": "Метод не поддерживается"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    user, error = await get_request_user(request)
+    if error:
+        return error
+
+    # Разбор multipart читает тело запроса с диска
+    files = await sync_to_async(request.FILES.getlist)('file')
+    comment = request.POST.get('comment', '')
+    target_user_id = request.POST.get('user_id')
+
+    if not files:
+        return JsonResponse({"error": "Файлы не предоставлены"}, status=status.HTTP_400_BAD_REQUEST)
+
+    target_user = user
+    if target_user_id and user.is_admin:
+        try:
+            target_user = await User.objects.aget(id=target_user_id)
+        except User.DoesNotExist:
+            return JsonResponse({"error": "Пользователь не найден"}, status=status.HTTP_404_NOT_FOUND)
+
+    uploaded_files, errors = await sync_to_async(ingest_files)(target_user, files, comment)
+    response_data, status_code = upload_response(uploaded_files, errors)
+    return JsonResponse(response_data, status=status_code)
+
+
+# Скачивание файла
+@session_csrf
+async def download_file(request, file_id):
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({"error": "Метод не поддерживается"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    user, error = await get_request_user(request)
+    if error:
+        return error
+
+    files = File.objects.select_related('blob')
+    if not user.is_admin:
+        files = files.filter(user=user)
+    try:
+        file_instance = await files.aget(id=file_id)
+    except File.DoesNotExist:
+        raise Http404("Файл не найден.")
+
+    if not file_instance.url:
+        return JsonResponse({"error": "Файл еще обрабатывается"}, status=status.HTTP_409_CONFLICT)
+    if not await sync_to_async(file_available, thread_sensitive=False)(file_instance.url.name):
+        raise Http404("Файл не найден.")
+
+    response = file_response(request, file_instance, asynchronous=True)
+    if is_new_download(request, response):
+        record_download(file_instance.id)
+    return response
+
+
+def archive_params(request):
+    if request.method == 'GET':
+        return request.GET
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            raise ArchiveError("Некорректный JSON.", status.HTTP_400_BAD_REQUEST)
+        if not isinstance(data, dict):
+            raise ArchiveError("Некорректный JSON.", status.HTTP_400_BAD_REQUEST)
+        return data
+    return request.POST
+
+
+# ZIP-архив файлов: тело генерируется в потоке запроса, event loop не блокируется
+@session_csrf
+async def download_archive(request):
+    if request.method not in ('GET', 'POST'):
+        return JsonResponse({"error": "Метод не поддерживается"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    user, error = await get_request_user(request)
+    if error:
+        return error
+
+    try:
+        files, archive_name = await sync_to_async(select_files)(user, archive_params(request))
+    except ArchiveError as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
+    response = StreamingHttpResponse(aiter_archive(files), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, archive_name)
+    return response
+
+
+# Получение списка файлов
+@session_csrf
+async def get_list(request, user_id):
+    if request.method != 'GET':
+        return JsonResponse({"error": "Метод не поддерживается"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    user, error = await get_request_user(request)
+    if error:
+        return error
+    if not user.is_admin and user.id != int(user_id):
+        return JsonResponse({"error": "Нет прав для просмотра файлов пользователя."}, status=status.HTTP_403_FORBIDDEN)
+
+    paginator = FileCursorPagination()
+    drf_request = Request(request)
+    try:
+        files = filter_files(File.objects.filter(user_id=user_id).only(*FILE_QUERY_FIELDS), drf_request.query_params)
+        rows = [file async for file in paginator.get_page_queryset(files, drf_request)]
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    page = paginator.finalize_page(rows)
+
+    # Прогреваем кэш Site (SITE_CACHE Django), чтобы сериализация не ходила в БД из event loop
+    await sync_to_async(Site.objects.get_current)()
+    return JsonResponse({
+        paginator.results_key: FileSerializer(page, many=True).data,
+        'next_cursor': paginator.next_cursor,
+    })
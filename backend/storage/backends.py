@@ -0,0 +1,266 @@
+"""
+Бэкенды хранения файлов (STORAGES['default'], выбираются STORAGE_BACKEND):
+
+- local — один каталог MEDIA_ROOT (LocalStorage);
+- sharded — несколько каталогов или дисков STORAGE_SHARDS, каталог выбирается
+  по хэшу имени файла (ShardedStorage);
+- s3 — S3-совместимое объектное хранилище: AWS, MinIO (S3Storage, нужен
+  django-storages[s3]). Большие объекты пишутся параллельной multipart-загрузкой,
+  а скачиваются по presigned URL напрямую из хранилища, минуя воркеры Django.
+
+Помимо API Storage бэкенды реализуют:
+    is_local — доступен ли файл по локальному пути (path());
+    public_media — отдает ли файлы фронтовой веб-сервер по MEDIA_URL (/media/ на MEDIA_ROOT);
+    write(name, content) — атомарная запись с перезаписью существующего файла;
+    move(old_name, new_name) — перенос внутри хранилища;
+    stream(name) — чтение содержимого блоками, без копии файла (архивы);
+    delete_many(names) — удаление пакета файлов (в S3 — одним запросом на 1000 ключей);
+    list_files(prefix) — все файлы под каталогом prefix: пары (имя, время изменения);
+    internal_name(name) — имя для внутреннего location nginx (X-Accel-Redirect);
+    download_url(name, filename, content_type, as_attachment, content_encoding) — прямая ссылка или None.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils._os import safe_join
+from django.utils.deconstruct import deconstructible
+from django.utils.http import content_disposition_header
+
+try:
+    from boto3.s3.transfer import TransferConfig
+    from storages.backends.s3 import S3Storage as BaseS3Storage
+    from storages.utils import clean_name
+except ImportError:  # django-storages[s3] не установлен
+    BaseS3Storage = None
+
+# Размер блока при копировании файлов
+BLOCK_SIZE = 1024 * 1024
+# Предел ключей в одном запросе DeleteObjects S3
+S3_DELETE_BATCH_SIZE = 1000
+
+
+@deconstructible(path='storage.backends.LocalStorage')
+class LocalStorage(FileSystemStorage):
+    is_local = True
+    public_media = True
+
+    def write(self, name, content):
+        """
+        Пишет содержимое под именем name атомарно: через временный файл
+        в той же директории и os.replace. Временные загрузки просто перемещаются.
+        """
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+            return name
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as destination:
+                for chunk in content.chunks(BLOCK_SIZE):
+                    destination.write(chunk)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+    def move(self, old_name, new_name):
+        target = self.path(new_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # В пределах одного диска — rename, между дисками (шардами) — копирование
+        file_move_safe(self.path(old_name), target, allow_overwrite=True)
+        return new_name
+
+    def stream(self, name, block_size=BLOCK_SIZE):
+        with open(self.path(name), 'rb') as source:
+            yield from iter(lambda: source.read(block_size), b'')
+
+    def delete_many(self, names):
+        for name in names:
+            self.delete(name)
+
+    def list_files(self, prefix):
+        for root in self.roots():
+            for directory, _, file_names in os.walk(safe_join(root, prefix)):
+                for file_name in file_names:
+                    full_path = os.path.join(directory, file_name)
+                    try:
+                        modified = os.path.getmtime(full_path)
+                    except FileNotFoundError:
+                        continue
+                    name = os.path.relpath(full_path, root).replace(os.sep, '/')
+                    yield name, datetime.fromtimestamp(modified, timezone.utc)
+
+    def roots(self):
+        return [self.location]
+
+    def internal_name(self, name):
+        return name
+
+    def download_url(self, name, filename, content_type, as_attachment=False, content_encoding=None):
+        return None
+
+
+@deconstructible(path='storage.backends.ShardedStorage')
+class ShardedStorage(LocalStorage):
+    """
+    Локальное хранилище на нескольких каталогах (обычно — на разных дисках).
+    Каталог файла определяется хэшем его имени, поэтому список locations
+    после начала работы менять нельзя. Для nginx каждый каталог публикуется
+    отдельным внутренним location: <FILE_DELIVERY_NGINX_PREFIX><номер>/.
+    /media/ видит только первый каталог, поэтому постоянные ссылки идут через API.
+    """
+    public_media = False
+
+    def __init__(self, locations=None, **kwargs):
+        self.locations = [str(location) for location in (locations or settings.STORAGE_SHARDS)]
+        if not self.locations:
+            raise ImproperlyConfigured("Для ShardedStorage нужен хотя бы один каталог (STORAGE_SHARDS)")
+        super().__init__(location=self.locations[0], **kwargs)
+
+    def shard(self, name):
+        digest = hashlib.md5(name.replace('\\', '/').encode()).hexdigest()
+        return int(digest[:8], 16) % len(self.locations)
+
+    def path(self, name):
+        return safe_join(self.locations[self.shard(name)], name)
+
+    def roots(self):
+        return self.locations
+
+    def internal_name(self, name):
+        return f'{self.shard(name)}/{name}'
+
+
+if BaseS3Storage is not None:
+
+    @deconstructible(path='storage.backends.S3Storage')
+    class S3Storage(BaseS3Storage):
+        """
+        S3-совместимое хранилище. Запись через upload_fileobj с TransferConfig:
+        объекты больше S3_MULTIPART_THRESHOLD загружаются частями в
+        S3_MULTIPART_CONCURRENCY потоков.
+        """
+        is_local = False
+        public_media = False
+
+        def get_default_settings(self):
+            defaults = super().get_default_settings()
+            if defaults.get('transfer_config') is None:
+                defaults['transfer_config'] = TransferConfig(
+                    multipart_threshold=settings.S3_MULTIPART_THRESHOLD,
+                    multipart_chunksize=settings.S3_MULTIPART_CHUNK_SIZE,
+                    max_concurrency=settings.S3_MULTIPART_CONCURRENCY,
+                )
+            return defaults
+
+        def write(self, name, content):
+            # Запись объекта в S3 атомарна, одинаковое имя перезаписывается (file_overwrite)
+            self._save(name, content)
+            return name
+
+        def move(self, old_name, new_name):
+            source = self._normalize_name(clean_name(old_name))
+            target = self._normalize_name(clean_name(new_name))
+            # Управляемое копирование на стороне хранилища (multipart для больших объектов)
+            self.connection.meta.client.copy(
+                {'Bucket': self.bucket_name, 'Key': source}, self.bucket_name, target, Config=self.transfer_config,
+            )
+            self.delete(old_name)
+            return new_name
+
+        def download(self, name, path):
+            """Скачивает объект в локальный файл параллельными запросами по диапазонам."""
+            key = self._normalize_name(clean_name(name))
+            self.bucket.download_file(key, path, Config=self.transfer_config)
+
+        def stream(self, name, block_size=BLOCK_SIZE):
+            # Тело GET-ответа читается по мере отдачи; S3File скачал бы объект целиком во временный файл
+            key = self._normalize_name(clean_name(name))
+            body = self.connection.meta.client.get_object(Bucket=self.bucket_name, Key=key)['Body']
+            try:
+                yield from body.iter_chunks(block_size)
+            finally:
+                body.close()
+
+        def delete_many(self, names):
+            keys = [{'Key': self._normalize_name(clean_name(name))} for name in names]
+            for start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+                self.bucket.delete_objects(Delete={'Objects': keys[start:start + S3_DELETE_BATCH_SIZE], 'Quiet': True})
+
+        def list_files(self, prefix):
+            prefix = clean_name(prefix).rstrip('/') + '/'
+            key_prefix = self._normalize_name(prefix)
+            for item in self.bucket.objects.filter(Prefix=key_prefix):
+                yield prefix + item.key[len(key_prefix):], item.last_modified
+
+        def internal_name(self, name):
+            return name
+
+        def download_url(self, name, filename, content_type, as_attachment=False, content_encoding=None):
+            parameters = {
+                'ResponseContentDisposition': content_disposition_header(as_attachment, filename),
+                'ResponseContentType': content_type,
+            }
+            if content_encoding:
+                parameters['ResponseContentEncoding'] = content_encoding
+            return self.url(name, parameters=parameters, expire=settings.S3_DOWNLOAD_URL_EXPIRE)
+
+
+def file_available(name):
+    # В удаленном хранилище не тратим HEAD-запрос: отсутствие объекта вернет само хранилище
+    return not default_storage.is_local or default_storage.exists(name)
+
+
+@contextmanager
+def local_copy(name):
+    """
+    Локальный путь к файлу хранилища: сам файл для локальных бэкендов,
+    временная копия — для удаленных (превью, антивирус) и распакованная
+    копия — для сжатых блобов.
+    """
+    from .compression import content_stream, is_compressed
+
+    compressed = is_compressed(name)
+    if default_storage.is_local and not compressed:
+        yield default_storage.path(name)
+        return
+
+    fd, tmp_path = tempfile.mkstemp(suffix='' if compressed else os.path.splitext(name)[1])
+    try:
+        if compressed:
+            with os.fdopen(fd, 'wb') as destination:
+                for block in content_stream(name):
+                    destination.write(block)
+        elif hasattr(default_storage, 'download'):
+            os.close(fd)
+            default_storage.download(name, tmp_path)
+        else:
+            with os.fdopen(fd, 'wb') as destination, default_storage.open(name, 'rb') as source:
+                shutil.copyfileobj(source, destination, BLOCK_SIZE)
+        yield tmp_path
+    finally:
+        os.remove(tmp_path)
+
+
+def upload_staging_storage():
+    """
+    Где собираются чанки возобновляемой загрузки. Для локальных бэкендов —
+    сразу в хранилище, для удаленных — в локальном UPLOAD_STAGING_DIR,
+    откуда файл переносит фоновая задача adopt_file.
+    """
+    if default_storage.is_local:
+        return default_storage
+    return LocalStorage(location=settings.UPLOAD_STAGING_DIR)
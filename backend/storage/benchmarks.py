@@ -0,0 +1,189 @@
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+# Распределение синтетических файлов: (размер, тип, вес)
+FILE_PROFILE = (
+    (2 * 1024, 'text/plain', 40),
+    (48 * 1024, 'image/png', 30),
+    (512 * 1024, 'application/pdf', 20),
+    (4 * 1024 * 1024, 'application/octet-stream', 10),
+)
+
+
+def percentiles(samples):
+    """Задержки в миллисекундах: p50, p90, p99, max."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        'p50_ms': round(pick(0.50), 3),
+        'p90_ms': round(pick(0.90), 3),
+        'p99_ms': round(pick(0.99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+def summarize(name, samples, elapsed, **extra):
+    return {
+        'name': name,
+        'requests': len(samples),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        **percentiles(samples),
+        **extra,
+    }
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def synthetic_file(name, size, content_type='application/octet-stream', seed=0):
+    """Детерминированное содержимое заданного размера (разное для разных seed)."""
+    pattern = f'{name}:{seed}:'.encode()
+    data = (pattern * (size // len(pattern) + 1))[:size]
+    return SimpleUploadedFile(name, data, content_type=content_type)
+
+
+def current_rss_kb():
+    """Текущий RSS процесса в КБ (Linux, /proc/self/statm) или None."""
+    try:
+        with open('/proc/self/statm') as fp:
+            pages = int(fp.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+class MemorySampler:
+    """
+    Пиковый RSS за время одного сценария. ru_maxrss для этого не подходит:
+    это максимум за всю жизнь процесса, и после самого тяжелого сценария
+    он одинаков у всех следующих. Поэтому текущий RSS опрашивается фоновым
+    потоком; rss_growth_kb — рост пика относительно начала сценария.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_kb() or 0)
+
+    def __enter__(self):
+        self.start = self.peak = current_rss_kb()
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, name='rss-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss_kb() or 0)
+
+    def result(self):
+        if self.start is None:
+            return {'rss_peak_kb': None, 'rss_growth_kb': None}
+        return {'rss_peak_kb': self.peak, 'rss_growth_kb': self.peak - self.start}
+
+
+def consume(response):
+    """Дочитывает ответ (в том числе потоковый) и возвращает число байт."""
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def run_concurrent(one_request, requests, concurrency):
+    """
+    Выполняет one_request(i) requests раз в concurrency потоках.
+    Возвращает (задержки в секундах, общее время).
+    """
+    def measured(i):
+        started = time.perf_counter()
+        one_request(i)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(measured, range(requests)))
+    return samples, time.perf_counter() - started
+
+
+def count_queries(func):
+    """Число запросов к БД за один вызов func в текущем потоке."""
+    with CaptureQueriesContext(connection) as context:
+        func()
+    return len(context.captured_queries)
+
+
+def seed_storage(users, files_per_user, distinct=20, seed=0):
+    """
+    Создает users пользователей по files_per_user файлов. Содержимое берется
+    из distinct синтетических блобов, поэтому диск занимает немного места,
+    а строки File создаются пакетами через bulk_create.
+    Возвращает список созданных пользователей.
+    """
+    from users.models import CustomUser
+
+    from .blobs import acquire_blobs, prepare_blob
+    from .models import File
+    from .usage import recalculate
+
+    rng = random.Random(seed)
+    weights = [weight for _, _, weight in FILE_PROFILE]
+    profiles = [rng.choices(FILE_PROFILE, weights)[0] for _ in range(distinct)]
+    digests = [
+        (prepare_blob(synthetic_file(f'seed{i}', size, content_type, seed=i), content_type), content_type)
+        for i, (size, content_type, _) in enumerate(profiles)
+    ]
+
+    accounts = CustomUser.objects.bulk_create([
+        CustomUser(login=f'bench{i}', fullname=f'Bench User {i}', email=f'bench{i}@example.com')
+        for i in range(users)
+    ])
+    picks = [(account, rng.randrange(distinct)) for account in accounts for _ in range(files_per_user)]
+
+    uses = {}
+    for _, index in picks:
+        (sha256, size, path, stored_size), _ = digests[index]
+        uses[sha256] = (size, uses.get(sha256, (size, 0))[1] + 1, path, stored_size)
+
+    with transaction.atomic():
+        blobs, _ = acquire_blobs(uses)
+        File.objects.bulk_create(
+            [
+                File(
+                    user=account,
+                    blob=blobs[digests[index][0][0]],
+                    url=blobs[digests[index][0][0]].path,
+                    file_name=f'file{number}.bin',
+                    file_size=digests[index][0][1],
+                    type=digests[index][1],
+                )
+                for number, (account, index) in enumerate(picks)
+            ],
+            batch_size=1000,
+        )
+        recalculate(CustomUser.objects.filter(id__in=[account.id for account in accounts]))
+    return accounts
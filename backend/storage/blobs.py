@@ -0,0 +1,332 @@
+import hashlib
+import os
+import posixpath
+import re
+from datetime import timedelta
+
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .compression import compressed_copy, is_compressed, should_compress
+from .models import Blob, blob_path
+
+# Размер блока чтения при хэшировании и копировании
+BLOCK_SIZE = 1024 * 1024
+# Блобов в одной задаче пакетного удаления
+DELETE_BATCH_SIZE = 1000
+# Каталог хранилища блобов (см. blob_path)
+BLOB_DIR = 'blobs'
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def hash_content(content):
+    """Считает SHA-256 и размер загруженного файла (Django File)."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in content.chunks(BLOCK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def hash_path(path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(BLOCK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def find_blob_file(sha256):
+    """Путь уже записанного содержимого (несжатого или сжатого) или None."""
+    for path in (blob_path(sha256), blob_path(sha256, compressed=True)):
+        if default_storage.exists(path):
+            return path
+    return None
+
+
+def write_blob(sha256, content, compressed=False):
+    """Пишет содержимое (Django File) в хранилище блобов. Возвращает (путь, занятый размер)."""
+    if not compressed:
+        size = content.size
+        return default_storage.write(blob_path(sha256), content), size
+    with compressed_copy(content) as copy:
+        return default_storage.write(blob_path(sha256, compressed=True), copy), copy.size
+
+
+def _acquire_existing(sha256, store):
+    """
+    Увеличивает счетчик ссылок существующего блоба под блокировкой строки.
+    Если файла в хранилище нет (прерванное удаление), дописывает его заново
+    в том же виде (сжатым или нет). Возвращает None, если блоба нет.
+    """
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=sha256).first()
+        if blob is None:
+            return None
+        if not default_storage.exists(blob.path):
+            store(is_compressed(blob.path))
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        blob.ref_count += 1
+        return blob
+
+
+def _acquire(sha256, size, store, compressed):
+    """store(compressed) пишет содержимое блоба и возвращает (путь, занятый размер)."""
+    while True:
+        blob = _acquire_existing(sha256, store)
+        if blob is not None:
+            return blob, False
+
+        # Нового содержимого еще нет: сначала файл, потом запись в БД
+        path, stored_size = store(compressed)
+        try:
+            with transaction.atomic():
+                blob = Blob.objects.create(sha256=sha256, size=size, stored_size=stored_size, path=path, ref_count=1)
+                return blob, True
+        except IntegrityError:
+            # Такой же блоб создали параллельно — повторяем как для существующего
+            continue
+
+
+def prepare_blob(content, content_type=''):
+    """
+    Первая стадия пакетной загрузки: хэширует содержимое и пишет файл блоба
+    (сжатым, если это выгодно, см. storage/compression.py), если такого
+    содержимого еще нет в хранилище. К БД не обращается, поэтому безопасна
+    для пула потоков.
+    Возвращает (sha256, size, путь, занятый размер — None для уже записанного файла).
+    """
+    sha256, size = hash_content(content)
+    path = find_blob_file(sha256)
+    if path is not None:
+        return sha256, size, path, None
+    path, stored_size = write_blob(sha256, content, should_compress(content, content_type))
+    return sha256, size, path, stored_size
+
+
+def acquire_blobs(digests):
+    """
+    Вторая стадия: одной транзакцией берет ссылки на блобы.
+    digests — {sha256: (size, число ссылок, путь, занятый размер)} по данным
+    prepare_blob. Существующим блобам счетчик
+    увеличивается одним bulk UPDATE, новые создаются одним INSERT.
+    Возвращает ({sha256: Blob}, множество sha256, чьи файлы пропали из хранилища
+    из-за параллельного удаления — на них ссылки не берутся).
+    Блобы без ссылок, ожидающие удаления, при этом снова оживают.
+    """
+    with transaction.atomic():
+        existing = {
+            blob.sha256: blob
+            for blob in Blob.objects.select_for_update().filter(sha256__in=digests).order_by('id')
+        }
+        lost = {sha256 for sha256, blob in existing.items() if not default_storage.exists(blob.path)}
+        Blob.objects.bulk_update(
+            [
+                Blob(id=blob.id, ref_count=F('ref_count') + digests[sha256][1])
+                for sha256, blob in existing.items() if sha256 not in lost
+            ],
+            ['ref_count'],
+        )
+        blobs = {sha256: blob for sha256, blob in existing.items() if sha256 not in lost}
+
+        # Новые блобы тоже проверяем: пока мы ждали блокировку, файл мог удалить delete_blob
+        new_blobs = []
+        for sha256, (size, uses, path, stored_size) in digests.items():
+            if sha256 in existing:
+                continue
+            if not default_storage.exists(path):
+                lost.add(sha256)
+                continue
+            if stored_size is None:
+                stored_size = default_storage.size(path)
+            new_blobs.append(Blob(sha256=sha256, size=size, stored_size=stored_size, path=path, ref_count=uses))
+        try:
+            with transaction.atomic():
+                Blob.objects.bulk_create(new_blobs)
+            blobs.update((blob.sha256, blob) for blob in new_blobs)
+        except IntegrityError:
+            # Часть блобов параллельно создала другая загрузка — добираем по одному
+            for blob in new_blobs:
+                blobs[blob.sha256] = _acquire_prepared(blob)
+
+    return blobs, lost
+
+
+def _acquire_prepared(new_blob):
+    while True:
+        try:
+            with transaction.atomic():
+                new_blob.pk = None
+                new_blob.save(force_insert=True)
+                return new_blob
+        except IntegrityError:
+            pass
+        updated = Blob.objects.filter(sha256=new_blob.sha256).update(ref_count=F('ref_count') + new_blob.ref_count)
+        if updated:
+            return Blob.objects.get(sha256=new_blob.sha256)
+
+
+def adopt_path(name, content_type=''):
+    """
+    Переносит уже лежащий в хранилище файл в хранилище блобов: файл перемещается
+    на место блоба (на локальном диске — без копирования) или записывается
+    сжатым, а если такое содержимое уже есть — удаляется.
+    """
+    with default_storage.open(name, 'rb') as source:
+        sha256, size = hash_content(source)
+        compressed = should_compress(source, content_type)
+
+    def store(compressed):
+        if not compressed:
+            return default_storage.move(name, blob_path(sha256)), size
+        with default_storage.open(name, 'rb') as source:
+            stored = write_blob(sha256, source, compressed=True)
+        default_storage.delete(name)
+        return stored
+
+    blob, created = _acquire(sha256, size, store, compressed)
+    if not created:
+        default_storage.delete(name)
+    return blob
+
+
+def adopt_local(path, content_type=''):
+    """
+    Переносит локальный файл (собранный из чанков при удаленном хранилище)
+    в хранилище блобов и удаляет его. Большие файлы уходят multipart-загрузкой.
+    """
+    sha256, size = hash_path(path)
+    with open(path, 'rb') as source:
+        compressed = should_compress(DjangoFile(source), content_type)
+
+    def store(compressed):
+        with open(path, 'rb') as source:
+            return write_blob(sha256, DjangoFile(source), compressed)
+
+    blob, _ = _acquire(sha256, size, store, compressed)
+    os.remove(path)
+    return blob
+
+
+def release_blob(blob_id):
+    """
+    Уменьшает счетчик ссылок. Блоб без ссылок не удаляется сразу:
+    файл и запись удалит фоновая задача delete_blob.
+    Вызывается внутри транзакции удаления File.
+    """
+    from .queue import enqueue
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().get(pk=blob_id)
+        Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+        if blob.ref_count <= 1:
+            enqueue('delete_blob', blob_id=blob.pk)
+
+
+def release_blobs(uses):
+    """
+    Групповой вариант release_blob для удаления многих файлов:
+    uses — {blob_id: число снимаемых ссылок}. Счетчики уменьшаются одним
+    bulk UPDATE, блобы без ссылок передаются задачам delete_blobs пакетами.
+    """
+    from .queue import enqueue_many
+
+    with transaction.atomic():
+        blobs = list(
+            Blob.objects.select_for_update().filter(id__in=uses).order_by('id').values_list('id', 'ref_count')
+        )
+        Blob.objects.bulk_update(
+            [Blob(id=blob_id, ref_count=F('ref_count') - uses[blob_id]) for blob_id, _ in blobs],
+            ['ref_count'],
+        )
+        unreferenced = [blob_id for blob_id, ref_count in blobs if ref_count <= uses[blob_id]]
+        enqueue_many('delete_blobs', [
+            {'blob_ids': unreferenced[start:start + DELETE_BATCH_SIZE]}
+            for start in range(0, len(unreferenced), DELETE_BATCH_SIZE)
+        ])
+
+
+def delete_unreferenced_blobs(blob_ids):
+    """Пакетный вариант delete_unreferenced_blob: одна транзакция и одно удаление файлов на пакет."""
+    with transaction.atomic():
+        blobs = list(
+            Blob.objects.select_for_update().filter(id__in=blob_ids, ref_count=0).order_by('id').values_list('id', 'path')
+        )
+        if not blobs:
+            return 0
+        Blob.objects.filter(id__in=[blob_id for blob_id, _ in blobs]).delete()
+        # Файлы удаляются под блокировкой строк, чтобы не гоняться с новой загрузкой
+        default_storage.delete_many([path for _, path in blobs])
+        return len(blobs)
+
+
+def delete_unreferenced_blob(blob_id):
+    """Удаляет блоб и его файл, если на него так и не появилось новых ссылок."""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(pk=blob_id, ref_count=0).first()
+        if blob is None:
+            return False
+        blob.delete()
+        # Файл удаляется под блокировкой строки, чтобы не гоняться с новой загрузкой
+        default_storage.delete(blob.path)
+        return True
+
+
+def _blob_sha256(name):
+    """SHA-256 из имени файла блоба или None для посторонних файлов (брошенные .tmp)."""
+    sha256 = posixpath.basename(name).split('.', 1)[0]
+    if SHA256_RE.match(sha256) and name in (blob_path(sha256), blob_path(sha256, compressed=True)):
+        return sha256
+    return None
+
+
+def delete_orphan_files(grace_period):
+    """
+    Удаляет файлы в каталоге блобов, у которых нет записи Blob: их оставляет
+    prepare_blob, если транзакция пакета откатилась или содержимое удалили
+    во время загрузки (lost). Файлы моложе grace_period секунд не трогаются —
+    запись о них может быть еще не зафиксирована. Возвращает число удаленных файлов.
+    """
+    cutoff = timezone.now() - timedelta(seconds=grace_period)
+    deleted = 0
+    batch = []
+    for name, modified in default_storage.list_files(BLOB_DIR):
+        if modified < cutoff:
+            batch.append(name)
+        if len(batch) >= DELETE_BATCH_SIZE:
+            deleted += _delete_orphans(batch)
+            batch = []
+    if batch:
+        deleted += _delete_orphans(batch)
+    return deleted
+
+
+def _delete_orphans(names):
+    known = set(Blob.objects.filter(path__in=names).values_list('path', flat=True))
+    orphans = {name: _blob_sha256(name) for name in names if name not in known}
+    if not orphans:
+        return 0
+
+    # Содержимое уже хранится под другим именем (сжатым или нет) — лишний файл удаляется сразу
+    stored = set(Blob.objects.filter(sha256__in=orphans.values()).values_list('sha256', flat=True))
+    extra = [name for name, sha256 in orphans.items() if sha256 is None or sha256 in stored]
+    default_storage.delete_many(extra)
+
+    # Остальные регистрируются блобами без ссылок и удаляются как они — под блокировкой
+    # строки, поэтому параллельная загрузка того же содержимого либо оживит блоб, либо
+    # увидит, что файла нет (lost), и не сошлется на удаленный файл. Размер у такой
+    # строки не заполняется: размеры блоба справочные, а строка почти всегда удаляется ниже
+    pending = {name: sha256 for name, sha256 in orphans.items() if name not in extra}
+    Blob.objects.bulk_create(
+        [Blob(sha256=sha256, size=0, path=name, ref_count=0) for name, sha256 in pending.items()],
+        ignore_conflicts=True,
+    )
+    blob_ids = list(Blob.objects.filter(path__in=pending, ref_count=0).values_list('id', flat=True))
+    return len(extra) + delete_unreferenced_blobs(blob_ids)
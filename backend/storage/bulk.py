@@ -0,0 +1,194 @@
+"""
+Групповые операции над файлами: удаление, перенос другому пользователю
+и изменение комментария многих файлов одним запросом.
+
+Пакет обрабатывается в одной транзакции запросами над множествами: строки
+файлов блокируются одним SELECT ... FOR UPDATE, счетчики блобов меняются
+одним bulk UPDATE, счетчики места и журнал изменений — одним запросом на
+пользователя, а не на файл. Файлы на диске удаляются фоновыми задачами
+пакетами. Блокировки берутся в том же порядке, что и при удалении одного
+файла: файлы, блобы, пользователи (по возрастанию id).
+"""
+from collections import Counter, defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from .blobs import release_blobs
+from .changes import created, record_changes
+from .filters import parse_ids
+from .models import File, FileChange
+from .queue import enqueue_many
+from .serializers import FileSerializer
+from .usage import QuotaExceeded, release, reserve
+
+User = get_user_model()
+
+# Предел файлов в одном запросе групповой операции
+BULK_MAX_FILES = 1000
+# Файлов в одной транзакции при удалении пользователя и путей в одной задаче удаления
+DELETE_BATCH_SIZE = 1000
+
+BULK_FIELDS = ('id', 'user_id', 'blob_id', 'url', 'file_name', 'comment', 'file_size', 'type')
+
+
+class BulkError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def lock_files(user, data):
+    """
+    Блокирует файлы из параметра ids, доступные user (администратору — любые).
+    Права на весь пакет проверяются одним запросом: если часть файлов
+    не найдена или чужая, операция не выполняется (404).
+    """
+    try:
+        ids = parse_ids(data)
+    except ValueError as e:
+        raise BulkError(str(e), 400)
+    if not ids:
+        raise BulkError("Укажите файлы (ids).", 400)
+    if len(ids) > BULK_MAX_FILES:
+        raise BulkError(f"Не больше {BULK_MAX_FILES} файлов за один запрос.", 400)
+
+    files = File.objects.select_for_update().filter(id__in=ids)
+    if not user.is_admin:
+        files = files.filter(user=user)
+    files = list(files.order_by('id').only(*BULK_FIELDS))
+    if len(files) != len(ids):
+        raise BulkError("Файлы не найдены.", 404)
+    return files
+
+
+def _by_user(files):
+    grouped = defaultdict(list)
+    for file_instance in files:
+        grouped[file_instance.user_id].append(file_instance)
+    return grouped
+
+
+def _clear_avatars(files):
+    """Ставит сброс аватаров владельцев, указывающих на эти файлы (один запрос на пакет)."""
+    serializer = FileSerializer()
+    urls = {serializer.get_url(file_instance) for file_instance in files if file_instance.url}
+    owners = User.objects.filter(id__in={file_instance.user_id for file_instance in files}, avatar__in=urls)
+    enqueue_many('clear_avatar', [
+        {'user_id': user_id, 'url': avatar} for user_id, avatar in owners.values_list('id', 'avatar')
+    ])
+
+
+def delete_files(files, owner_deleted=False):
+    """
+    Удаляет заблокированные файлы (см. lock_files) в текущей транзакции.
+    owner_deleted — файлы удаляются вместе с пользователем: журнал и аватар не трогаются.
+    """
+    if not files:
+        return 0
+    File.objects.filter(id__in=[file_instance.id for file_instance in files]).delete()
+
+    uses = Counter(file_instance.blob_id for file_instance in files if file_instance.blob_id)
+    if uses:
+        release_blobs(uses)
+    # Файлы вне хранилища блобов (прежняя раскладка, незавершенный перенос)
+    paths = [file_instance.url.name for file_instance in files if not file_instance.blob_id and file_instance.url]
+    enqueue_many('delete_paths', [
+        {'names': paths[start:start + DELETE_BATCH_SIZE]} for start in range(0, len(paths), DELETE_BATCH_SIZE)
+    ])
+
+    for user_id, user_files in sorted(_by_user(files).items()):
+        release(user_id, sum(file_instance.file_size for file_instance in user_files), len(user_files))
+        if not owner_deleted:
+            record_changes(user_id, [(file_instance.id, FileChange.KIND_DELETE, {}) for file_instance in user_files])
+    if not owner_deleted:
+        _clear_avatars(files)
+    return len(files)
+
+
+def bulk_delete(user, data):
+    with transaction.atomic():
+        return delete_files(lock_files(user, data))
+
+
+def bulk_move(user, data):
+    """
+    Переносит файлы другому пользователю (только администратор). Место
+    переносится между счетчиками; у нового владельца проверяется квота.
+    В журнале старого владельца файл удаляется, у нового — создается.
+    """
+    if not user.is_admin:
+        raise BulkError("Нет прав для переноса файлов.", 403)
+    try:
+        target_id = int(data.get('user_id'))
+    except (TypeError, ValueError):
+        raise BulkError("Параметр user_id должен быть числом.", 400)
+
+    with transaction.atomic():
+        files = [file_instance for file_instance in lock_files(user, data) if file_instance.user_id != target_id]
+        if not User.objects.filter(id=target_id).exists():
+            raise BulkError("Пользователь не найден.", 404)
+        if not files:
+            return 0
+
+        sources = _by_user(files)
+        # Строки пользователей блокируются по возрастанию id
+        for user_id in sorted(set(sources) | {target_id}):
+            if user_id == target_id:
+                try:
+                    reserve(target_id, sum(file_instance.file_size for file_instance in files), len(files))
+                except QuotaExceeded as e:
+                    raise BulkError(str(e), 413)
+            else:
+                user_files = sources[user_id]
+                release(user_id, sum(file_instance.file_size for file_instance in user_files), len(user_files))
+
+        File.objects.filter(id__in=[file_instance.id for file_instance in files]).update(
+            user_id=target_id, updated_at=timezone.now()
+        )
+        _clear_avatars(files)
+
+        for user_id in sorted(set(sources) | {target_id}):
+            if user_id == target_id:
+                record_changes(target_id, [created(file_instance) for file_instance in files])
+            else:
+                record_changes(user_id, [
+                    (file_instance.id, FileChange.KIND_DELETE, {}) for file_instance in sources[user_id]
+                ])
+        return len(files)
+
+
+def bulk_comment(user, data):
+    comment = data.get('comment')
+    if comment is None:
+        raise BulkError("Параметр comment обязателен.", 400)
+    comment = str(comment)
+
+    with transaction.atomic():
+        files = [file_instance for file_instance in lock_files(user, data) if file_instance.comment != comment]
+        File.objects.filter(id__in=[file_instance.id for file_instance in files]).update(
+            comment=comment, updated_at=timezone.now()
+        )
+        for user_id, user_files in sorted(_by_user(files).items()):
+            record_changes(user_id, [
+                (file_instance.id, FileChange.KIND_COMMENT, {'comment': comment}) for file_instance in user_files
+            ])
+        return len(files)
+
+
+def delete_user_files(user_id):
+    """
+    Удаляет все файлы пользователя пакетами по DELETE_BATCH_SIZE, каждый
+    пакет — своей транзакцией. Повторный запуск продолжает с оставшихся файлов.
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            files = list(
+                File.objects.select_for_update().filter(user_id=user_id)
+                .order_by('id').only(*BULK_FIELDS)[:DELETE_BATCH_SIZE]
+            )
+            if not files:
+                return deleted
+            deleted += delete_files(files, owner_deleted=True)
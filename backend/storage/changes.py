@@ -0,0 +1,69 @@
+"""
+Журнал изменений файлов для дельта-синхронизации клиентов.
+
+Каждое создание, переименование, изменение комментария и удаление файла
+пишется в FileChange с номером seq, сплошным в пределах пользователя.
+Номера выдаются увеличением CustomUser.change_seq в той же транзакции,
+что и само изменение: строка пользователя остается заблокированной до
+коммита, поэтому записи одного пользователя фиксируются строго в порядке
+номеров и клиент, прочитавший журнал до seq N, не пропустит запись с
+меньшим номером. Сплошная нумерация позволяет обнаружить, что нужная
+клиенту часть журнала уже удалена (см. prune_changes).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import FileChange
+
+User = get_user_model()
+
+
+def file_snapshot(file_instance):
+    return {
+        'file_name': file_instance.file_name,
+        'comment': file_instance.comment,
+        'file_size': file_instance.file_size,
+        'type': file_instance.type,
+    }
+
+
+def created(file_instance):
+    return file_instance.id, FileChange.KIND_CREATE, file_snapshot(file_instance)
+
+
+def record_changes(user_id, changes):
+    """
+    Добавляет в журнал пользователя изменения [(file_id, kind, data)].
+    Вызывается в конце транзакции, меняющей файлы: блокировка строки
+    пользователя держится до ее коммита.
+    """
+    if not changes:
+        return
+    with transaction.atomic():
+        User.objects.filter(pk=user_id).update(change_seq=F('change_seq') + len(changes))
+        last = User.objects.filter(pk=user_id).values_list('change_seq', flat=True).first()
+        if last is None:
+            return
+        first = last - len(changes) + 1
+        FileChange.objects.bulk_create([
+            FileChange(user_id=user_id, seq=first + i, file_id=file_id, kind=kind, data=data)
+            for i, (file_id, kind, data) in enumerate(changes)
+        ])
+
+
+def current_seq(user_id):
+    return User.objects.filter(pk=user_id).values_list('change_seq', flat=True).first()
+
+
+def prune_changes():
+    """
+    Удаляет записи старше FILE_CHANGES_RETENTION_DAYS, кроме последней записи
+    каждого пользователя: по ней клиент с устаревшим курсором узнает о пропуске.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.FILE_CHANGES_RETENTION_DAYS)
+    return FileChange.objects.filter(created_at__lt=cutoff).exclude(seq=F('user__change_seq')).delete()[0]
@@ -0,0 +1,78 @@
+import fcntl
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+
+# Размер блока чтения тела запроса при записи чанка
+READ_BLOCK_SIZE = 1024 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class ChunkError(ValueError):
+    pass
+
+
+class ChunkBusy(ChunkError):
+    """Чанк той же сессии уже записывает другой запрос."""
+
+
+def parse_content_range(header):
+    """
+    Разбирает заголовок "Content-Range: bytes <start>-<end>/<total>".
+    Возвращает (start, length, total).
+    """
+    match = CONTENT_RANGE_RE.match((header or '').strip())
+    if not match:
+        raise ChunkError("Заголовок Content-Range должен иметь вид 'bytes start-end/total'.")
+    start, end, total = (int(value) for value in match.groups())
+    if end < start or end >= total:
+        raise ChunkError("Некорректный диапазон в Content-Range.")
+    return start, end - start + 1, total
+
+
+@contextmanager
+def open_for_chunk(path):
+    """
+    Открывает файл сессии для записи чанка под исключительной блокировкой flock
+    (снимается при закрытии файла). Параллельный запрос той же сессии сразу
+    получает ChunkBusy, а не ждет, пока медленный клиент передаст свой чанк.
+    """
+    with open(path, 'r+b') as destination:
+        try:
+            fcntl.flock(destination.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ChunkBusy("Чанк этой сессии уже загружается.")
+        yield destination
+
+
+def write_chunk(destination, offset, stream, length, checksum):
+    """
+    Потоково пишет length байт из stream в открытый файл destination начиная
+    с offset, не буферизуя чанк целиком. Если длина или SHA-256 не совпали,
+    файл обрезается до offset и выбрасывается ChunkError.
+    """
+    digest = hashlib.sha256()
+    written = 0
+    destination.seek(offset)
+    try:
+        while written < length:
+            block = stream.read(min(READ_BLOCK_SIZE, length - written))
+            if not block:
+                break
+            digest.update(block)
+            destination.write(block)
+            written += len(block)
+
+        if written != length:
+            raise ChunkError(f"Получено {written} байт вместо {length}.")
+        if digest.hexdigest() != checksum.lower():
+            raise ChunkError("Контрольная сумма чанка не совпадает.")
+    except Exception:
+        # Откатываем частично записанный чанк до последнего подтвержденного смещения
+        destination.truncate(offset)
+        raise
+
+    destination.flush()
+    os.fsync(destination.fileno())
@@ -0,0 +1,196 @@
+"""
+Сжатие содержимого файлов в хранилище (zstd, нужен пакет zstandard).
+
+С STORAGE_COMPRESSION=True блоб сжимаемого типа записывается сжатым, если
+пробный фрагмент из начала файла ужимается хотя бы до
+STORAGE_COMPRESSION_MAX_RATIO исходного размера. Сжатый блоб хранится под
+именем <sha256>.zst: способ хранения виден по имени, поэтому отдача
+(в том числе по подписанным ссылкам) не обращается к БД.
+
+Клиенту, который принимает zstd (Accept-Encoding), сжатые байты отдаются
+как есть с Content-Encoding: zstd — с диска читается и по сети передается
+меньше. Остальным содержимое распаковывается потоком; исходный размер
+записан в заголовке кадра zstd, поэтому диапазоны (Range) тоже поддерживаются —
+байты до начала диапазона распаковываются и отбрасываются.
+"""
+import tempfile
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File as DjangoFile
+from django.core.files.storage import default_storage
+
+from .models import COMPRESSED_BLOB_SUFFIX
+
+try:
+    import zstandard
+except ImportError:  # zstandard не установлен
+    zstandard = None
+
+ENCODING_ZSTD = 'zstd'
+
+# Пробный фрагмент для оценки степени сжатия
+SAMPLE_SIZE = 256 * 1024
+BLOCK_SIZE = 1024 * 1024
+# Наибольший размер заголовка кадра zstd
+FRAME_HEADER_MAX_SIZE = 18
+
+COMPRESSED_TYPE_PREFIXES = ('image/', 'video/', 'audio/')
+# Несжатые форматы изображений и аудио: им deflate полезен
+UNCOMPRESSED_MEDIA_TYPES = {'image/bmp', 'image/svg+xml', 'image/tiff', 'image/x-icon', 'audio/wav', 'audio/x-wav'}
+COMPRESSED_TYPES = {
+    'application/zip',
+    'application/gzip',
+    'application/x-gzip',
+    'application/x-bzip2',
+    'application/x-xz',
+    'application/zstd',
+    'application/x-7z-compressed',
+    'application/x-rar-compressed',
+    'application/vnd.rar',
+    'application/pdf',
+    'application/epub+zip',
+    'application/java-archive',
+    'application/vnd.android.package-archive',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.oasis.opendocument.text',
+    'application/vnd.oasis.opendocument.spreadsheet',
+}
+
+
+def _media_type(content_type):
+    return (content_type or '').split(';', 1)[0].strip().lower()
+
+
+def is_compressible_type(content_type):
+    """Имеет ли смысл сжимать содержимое такого типа: уже сжатые форматы — нет."""
+    content_type = _media_type(content_type)
+    if content_type in COMPRESSED_TYPES:
+        return False
+    return not content_type.startswith(COMPRESSED_TYPE_PREFIXES) or content_type in UNCOMPRESSED_MEDIA_TYPES
+
+
+def is_compressed(name):
+    return name.endswith(COMPRESSED_BLOB_SUFFIX)
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ImproperlyConfigured("Для сжатых файлов в хранилище нужен пакет zstandard")
+    return zstandard
+
+
+def should_compress(content, content_type):
+    """
+    Сжимать ли содержимое (Django File) при записи: сжатие включено, файл
+    не слишком мал, тип сжимаемый, и пробный фрагмент дает выигрыш.
+    """
+    if not settings.STORAGE_COMPRESSION or content.size < settings.STORAGE_COMPRESSION_MIN_SIZE:
+        return False
+    # Изображения могут стать аватарами, а их по /media/ отдает nginx без распаковки
+    if _media_type(content_type).startswith('image/') or not is_compressible_type(content_type):
+        return False
+
+    content.seek(0)
+    sample = content.read(SAMPLE_SIZE)
+    content.seek(0)
+    compressed = _zstandard().ZstdCompressor(level=settings.STORAGE_COMPRESSION_LEVEL).compress(sample)
+    return len(compressed) <= len(sample) * settings.STORAGE_COMPRESSION_MAX_RATIO
+
+
+@contextmanager
+def compressed_copy(content):
+    """Сжатая копия содержимого (Django File) во временном файле."""
+    compressor = _zstandard().ZstdCompressor(level=settings.STORAGE_COMPRESSION_LEVEL)
+    with tempfile.TemporaryFile() as target:
+        with compressor.stream_writer(target, size=content.size, closefd=False) as writer:
+            for chunk in content.chunks(BLOCK_SIZE):
+                writer.write(chunk)
+        size = target.tell()
+        target.seek(0)
+        compressed = DjangoFile(target)
+        compressed.size = size
+        yield compressed
+
+
+def decompress(blocks):
+    """Распаковывает поток блоков сжатого содержимого."""
+    decompressor = _zstandard().ZstdDecompressor().decompressobj()
+    for block in blocks:
+        data = decompressor.decompress(block)
+        if data:
+            yield data
+
+
+def content_size(name):
+    """Исходный размер сжатого блоба из заголовка кадра или None, если он не записан."""
+    blocks = default_storage.stream(name, FRAME_HEADER_MAX_SIZE)
+    try:
+        header = next(blocks, b'')
+    finally:
+        blocks.close()
+    try:
+        size = _zstandard().frame_content_size(header)
+    except zstandard.ZstdError:
+        return None
+    return size if size >= 0 else None
+
+
+def slice_blocks(blocks, start, end):
+    """Байты [start, end] потока блоков; блоки до start читаются и отбрасываются."""
+    position = 0
+    try:
+        for block in blocks:
+            block_end = position + len(block)
+            if block_end > start:
+                yield block[max(start - position, 0):end - position + 1]
+            position = block_end
+            if position > end:
+                return
+    finally:
+        blocks.close()
+
+
+def content_stream(name, block_size=BLOCK_SIZE, start=0, end=None):
+    """
+    Исходное содержимое файла хранилища блоками, сжатые блобы распаковываются
+    на лету. С end отдаются только байты [start, end] исходного содержимого.
+    """
+    blocks = default_storage.stream(name, block_size)
+    if is_compressed(name):
+        blocks = decompress(blocks)
+    return blocks if end is None else slice_blocks(blocks, start, end)
+
+
+async def acontent_stream(name, block_size=BLOCK_SIZE, start=0, end=None):
+    """Асинхронный вариант content_stream для ASGI: чтение и распаковка — в пуле потоков."""
+    iterator = content_stream(name, block_size, start, end)
+    step = sync_to_async(next, thread_sensitive=False)
+    try:
+        while True:
+            block = await step(iterator, None)
+            if block is None:
+                return
+            yield block
+    finally:
+        await sync_to_async(iterator.close, thread_sensitive=False)()
+
+
+def accepts_encoding(request, encoding=ENCODING_ZSTD):
+    """Указана ли кодировка в Accept-Encoding запроса (с ненулевым q)."""
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        token, _, params = item.partition(';')
+        if token.strip().lower() != encoding:
+            continue
+        params = params.strip().replace(' ', '')
+        if not params.startswith('q='):
+            return True
+        try:
+            return float(params[2:]) > 0
+        except ValueError:
+            return False
+    return False
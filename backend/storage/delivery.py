@@ -0,0 +1,192 @@
+import hashlib
+import os
+import posixpath
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .compression import ENCODING_ZSTD, accepts_encoding, acontent_stream, content_size, content_stream, is_compressed
+from .ranges import RangeNotSatisfiable, aiter_file_range, iter_file_range, multipart_byteranges, parse_range_header
+
+# Доступные способы отдачи файлов
+DELIVERY_DJANGO = 'django'
+DELIVERY_NGINX = 'nginx'
+DELIVERY_APACHE = 'apache'
+
+
+def file_etag(file_instance):
+    """
+    Сильный ETag. Для файлов из хранилища блобов это хэш содержимого
+    (последний компонент пути блоба, без загрузки Blob), для старых
+    файлов — производная от updated_at и размера.
+    """
+    if file_instance.blob_id:
+        # Без суффикса .zst: ETag описывает исходное содержимое
+        return '"%s"' % posixpath.basename(file_instance.url.name).split('.', 1)[0]
+    source = f'{file_instance.pk}:{file_instance.updated_at.isoformat()}:{file_instance.file_size}'
+    return '"%s"' % hashlib.sha256(source.encode()).hexdigest()[:32]
+
+
+def file_last_modified(file_instance):
+    return int(file_instance.updated_at.timestamp())
+
+
+def range_allowed(request, etag, last_modified):
+    """Условие If-Range: диапазон отдается, только если файл не изменился."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def file_response(request, file_instance, as_attachment=False, asynchronous=False):
+    """
+    Возвращает ответ с содержимым файла. Проверка прав выполняется до вызова.
+
+    Условные запросы (If-None-Match, If-Modified-Since) обрабатываются здесь,
+    до передачи данных, и завершаются ответом 304 без чтения файла.
+
+    В режимах nginx (X-Accel-Redirect) и apache (X-Sendfile) Django отдает
+    только заголовки, а передачу байтов и Range выполняет фронтовой веб-сервер.
+    Файлы из удаленного хранилища (S3) отдаются редиректом на presigned URL.
+    Режим django сам отдает файл целиком или по диапазонам (для разработки);
+    с asynchronous=True тело читается асинхронным итератором (для ASGI).
+
+    Сжатый блоб (см. storage/compression.py) клиенту, принимающему zstd,
+    отдается любым из этих способов как есть с Content-Encoding: zstd,
+    остальным — распакованным потоком через Django.
+    """
+    return stored_file_response(
+        request,
+        file_instance.url.name,
+        file_instance.download_name,
+        file_instance.type or 'application/octet-stream',
+        file_etag(file_instance),
+        file_last_modified(file_instance),
+        as_attachment,
+        asynchronous,
+    )
+
+
+def stored_file_response(request, name, filename, content_type, etag, last_modified,
+                         as_attachment=False, asynchronous=False):
+    """
+    Ответ с файлом name из хранилища по уже известным метаданным —
+    без обращения к БД (используется подписанными ссылками, см. storage/signing.py).
+    """
+    backend = settings.FILE_DELIVERY_BACKEND
+    compressed = is_compressed(name)
+    content_encoding = ENCODING_ZSTD if compressed and accepts_encoding(request, ENCODING_ZSTD) else None
+    if content_encoding:
+        # Сжатые байты — другое представление, у него свой сильный ETag
+        etag = f'{etag[:-1]}-{content_encoding}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None and compressed and not content_encoding:
+        response = decompressed_response(request, name, content_type, etag, last_modified, asynchronous)
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    elif response is None:
+        direct_url = default_storage.download_url(name, filename, content_type, as_attachment, content_encoding)
+        if direct_url:
+            # Байты и Range отдает само хранилище; заголовки ответа заданы в подписи ссылки
+            response = HttpResponseRedirect(direct_url)
+            if compressed:
+                patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+        if backend == DELIVERY_DJANGO:
+            response = django_file_response(request, name, content_type, etag, last_modified, asynchronous)
+        else:
+            response = HttpResponse(content_type=content_type)
+            if backend == DELIVERY_NGINX:
+                # Внутренний location nginx, указывающий на MEDIA_ROOT (или на каталог шарда)
+                response['X-Accel-Redirect'] = settings.FILE_DELIVERY_NGINX_PREFIX + quote(default_storage.internal_name(name))
+            elif backend == DELIVERY_APACHE:
+                response['X-Sendfile'] = default_storage.path(name)
+            else:
+                raise ValueError(f"Неизвестный способ отдачи файлов: {backend}")
+        if content_encoding:
+            # nginx не передает этот заголовок при X-Accel-Redirect — его добавляет location для .zst
+            response['Content-Encoding'] = content_encoding
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response.setdefault('Accept-Ranges', 'bytes')
+    if compressed:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def decompressed_response(request, name, content_type, etag, last_modified, asynchronous=False):
+    """
+    Распакованное содержимое сжатого блоба потоком. Поддерживается один диапазон:
+    смещения в исходном содержимом не соответствуют смещениям в файле, поэтому
+    байты до начала диапазона распаковываются и отбрасываются. На несколько
+    диапазонов отдается весь файл.
+    """
+    size = content_size(name)
+    ranges = None
+    if size is not None and range_allowed(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    stream = acontent_stream if asynchronous else content_stream
+    if ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(stream(name, start=start, end=end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        return response
+
+    response = StreamingHttpResponse(stream(name), content_type=content_type)
+    if size is None:
+        response['Accept-Ranges'] = 'none'
+    else:
+        response['Content-Length'] = size
+    return response
+
+
+def django_file_response(request, name, content_type, etag, last_modified, asynchronous=False):
+    path = default_storage.path(name)
+    size = os.path.getsize(path)
+    iter_range = aiter_file_range if asynchronous else iter_file_range
+
+    ranges = None
+    if range_allowed(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if not ranges:
+        if not asynchronous:
+            return FileResponse(open(path, 'rb'), content_type=content_type)
+        response = StreamingHttpResponse(iter_range(path, 0, size - 1), content_type=content_type)
+        response['Content-Length'] = size
+        return response
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(iter_range(path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+        return response
+
+    boundary, length, body = multipart_byteranges(path, ranges, size, content_type, asynchronous)
+    response = StreamingHttpResponse(
+        body, status=206, content_type=f'multipart/byteranges; boundary={boundary}'
+    )
+    response['Content-Length'] = length
+    return response
@@ -0,0 +1,172 @@
+import atexit
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DownloadStat, File
+
+logger = logging.getLogger('storage')
+
+# (file_id, дата) -> [время последнего скачивания, количество]
+_pending = {}
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_flusher = None
+_flusher_pid = None
+
+
+def record_download(file_id, when=None):
+    """
+    Учитывает скачивание в памяти процесса, без записи в БД.
+    Данные сбрасываются фоновым потоком пакетами (см. flush), если он
+    не отключен DOWNLOAD_STATS_BACKGROUND.
+    """
+    when = when or timezone.now()
+    key = (file_id, timezone.localdate(when))
+    with _lock:
+        entry = _pending.get(key)
+        if entry is None:
+            _pending[key] = [when, 1]
+        else:
+            entry[0] = max(entry[0], when)
+            entry[1] += 1
+        pending = len(_pending)
+
+    _ensure_flusher()
+    if pending >= settings.DOWNLOAD_STATS_MAX_PENDING:
+        _wakeup.set()
+
+
+def is_new_download(request, response):
+    """
+    Считается ли ответ отдельным скачиванием: успешный ответ на GET (или редирект
+    на хранилище) без Range или с диапазоном от нулевого байта. Докачка и HEAD
+    (DRF обрабатывает его тем же методом, что и GET) не учитываются.
+    """
+    if request.method != 'GET' or response.status_code not in (200, 206, 302):
+        return False
+    return requests_from_start(request)
+
+
+def requests_from_start(request):
+    """Запрос без Range или с диапазоном от нулевого байта (не докачка)."""
+    range_header = request.headers.get('Range', '')
+    return not range_header or range_header.replace(' ', '').startswith('bytes=0-')
+
+
+def _take_pending():
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+    return batch
+
+
+def _restore_pending(batch):
+    # Возвращаем несохраненный пакет, чтобы не потерять скачивания
+    with _lock:
+        for key, (when, count) in batch.items():
+            entry = _pending.get(key)
+            if entry is None:
+                _pending[key] = [when, count]
+            else:
+                entry[0] = max(entry[0], when)
+                entry[1] += count
+
+
+def flush():
+    """
+    Пишет накопленные скачивания одной транзакцией: bulk UPDATE
+    last_downloaded/download_count и upsert дневных агрегатов DownloadStat.
+    Возвращает количество учтенных скачиваний.
+    """
+    batch = _take_pending()
+    if not batch:
+        return 0
+
+    per_file = {}
+    for (file_id, _), (when, count) in batch.items():
+        last, total = per_file.get(file_id, (when, 0))
+        per_file[file_id] = (max(last, when), total + count)
+
+    try:
+        with transaction.atomic():
+            # Блокируем строки в порядке id; удаленные к этому моменту файлы пропускаем
+            existing = set(
+                File.objects.select_for_update().filter(id__in=per_file).order_by('id').values_list('id', flat=True)
+            )
+            File.objects.bulk_update(
+                [
+                    File(id=file_id, last_downloaded=when, download_count=F('download_count') + count)
+                    for file_id, (when, count) in per_file.items() if file_id in existing
+                ],
+                ['last_downloaded', 'download_count'],
+                batch_size=500,
+            )
+            _upsert_daily_stats([
+                (file_id, day, count)
+                for (file_id, day), (_, count) in batch.items() if file_id in existing
+            ])
+    except Exception:
+        _restore_pending(batch)
+        raise
+
+    return sum(count for file_id, (_, count) in per_file.items() if file_id in existing)
+
+
+def _upsert_daily_stats(rows):
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    table = qn(DownloadStat._meta.db_table)
+    count = qn('count')
+    # ON CONFLICT ... DO UPDATE поддерживают и PostgreSQL, и SQLite
+    sql = (
+        f"INSERT INTO {table} ({qn('file_id')}, {qn('date')}, {count}) VALUES (%s, %s, %s) "
+        f"ON CONFLICT ({qn('file_id')}, {qn('date')}) "
+        f"DO UPDATE SET {count} = {table}.{count} + EXCLUDED.{count}"
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _flush_loop():
+    while True:
+        _wakeup.wait(settings.DOWNLOAD_STATS_FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Не удалось сохранить статистику скачиваний")
+        finally:
+            # Поток держит собственное соединение — не оставляем его открытым между сбросами
+            connections.close_all()
+
+
+def _ensure_flusher():
+    global _flusher, _flusher_pid
+    if not settings.DOWNLOAD_STATS_BACKGROUND:
+        return
+    # После fork (gunicorn) поток родителя в дочернем процессе не существует
+    if _flusher is not None and _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher is not None and _flusher_pid == os.getpid():
+            return
+        _flusher = threading.Thread(target=_flush_loop, name='download-stats-flusher', daemon=True)
+        _flusher_pid = os.getpid()
+        _flusher.start()
+
+
+@atexit.register
+def _flush_at_exit():
+    if not settings.DOWNLOAD_STATS_BACKGROUND:
+        return
+    try:
+        flush()
+    except Exception:
+        logger.exception("Не удалось сохранить статистику скачиваний при завершении")
@@ -0,0 +1,86 @@
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def _parse_int(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Параметр {name} должен быть целым числом.")
+
+
+def parse_ids(params, name='ids'):
+    """
+    Список id из параметра name: строка через запятую, повторяющийся
+    параметр (ids=1&ids=2) или JSON-список. Возвращает отсортированные уникальные id.
+    """
+    values = params.getlist(name) if hasattr(params, 'getlist') else params.get(name)
+    if values in (None, ''):
+        return []
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    parts = [part for value in values for part in str(value).split(',') if part.strip()]
+    try:
+        return sorted({int(part) for part in parts})
+    except ValueError:
+        raise ValueError(f"Параметр {name} должен быть списком чисел.")
+
+
+def _parse_date(params, name):
+    """
+    Возвращает (datetime, whole_day). Для даты без времени возвращается начало
+    календарного дня, чтобы сравнение шло по upload_date и использовало индекс.
+    """
+    value = params.get(name)
+    if value in (None, ''):
+        return None, False
+    parsed = parse_datetime(value)
+    whole_day = parsed is None
+    if whole_day:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Параметр {name} должен быть датой в формате ISO 8601.")
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed, whole_day
+
+
+def filter_files(queryset, params):
+    """
+    Серверная фильтрация списка файлов по query-параметрам:
+    type (точное совпадение или префикс вида "image/"), size_min, size_max,
+    date_from, date_to (дата загрузки, включительно).
+    """
+    file_type = params.get('type')
+    if file_type:
+        if file_type.endswith('/'):
+            queryset = queryset.filter(type__startswith=file_type)
+        else:
+            queryset = queryset.filter(type=file_type)
+
+    size_min = _parse_int(params, 'size_min')
+    if size_min is not None:
+        queryset = queryset.filter(file_size__gte=size_min)
+
+    size_max = _parse_int(params, 'size_max')
+    if size_max is not None:
+        queryset = queryset.filter(file_size__lte=size_max)
+
+    date_from, _ = _parse_date(params, 'date_from')
+    if date_from is not None:
+        queryset = queryset.filter(upload_date__gte=date_from)
+
+    date_to, whole_day = _parse_date(params, 'date_to')
+    if date_to is not None:
+        if whole_day:
+            queryset = queryset.filter(upload_date__lt=date_to + timedelta(days=1))
+        else:
+            queryset = queryset.filter(upload_date__lte=date_to)
+
+    return queryset
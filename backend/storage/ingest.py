@@ -0,0 +1,127 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import status
+
+from .blobs import acquire_blobs, prepare_blob
+from .changes import created, record_changes
+from .models import File
+from .serializers import FileSerializer
+from .tasks import after_upload
+from .usage import QuotaExceeded, release, reserve
+
+logger = logging.getLogger('storage')
+
+MAX_UPLOAD_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Общий ограниченный пул потоков для дисковой части загрузки."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_WORKERS, thread_name_prefix='upload')
+    return _executor
+
+
+def _prepare(file):
+    # Ошибка одного файла (диск, сжатие) не должна прерывать загрузку остальных
+    try:
+        return prepare_blob(file, file.content_type), None
+    except Exception as e:
+        logger.exception("Не удалось записать файл %s", file.name)
+        return None, e
+
+
+def ingest_files(target_user, files, comment=''):
+    """
+    Сохраняет загруженные файлы пользователю target_user.
+    Возвращает (сериализованные файлы, список ошибок по отдельным файлам).
+
+    Загрузка идет в две стадии: хэширование и запись блобов на диск
+    параллельно в пуле потоков, затем одна транзакция на весь пакет —
+    ссылки на блобы и bulk INSERT записей File.
+    Место под весь пакет резервируется в квоте до записи на диск.
+    """
+    errors = []
+
+    accepted = []
+    for file in files:
+        if file.size > MAX_UPLOAD_FILE_SIZE:
+            errors.append(f"Файл {file.name} превышает допустимый лимит (10 МБ)")
+            continue
+        accepted.append(file)
+
+    if not accepted:
+        return [], errors
+
+    try:
+        reserve(target_user.id, sum(file.size for file in accepted), len(accepted))
+    except QuotaExceeded as e:
+        errors.extend(f"Ошибка при загрузке файла {file.name}: {e}" for file in accepted)
+        return [], errors
+
+    instances = []
+    # Резерв возвращается целиком при любой ошибке до фиксации транзакции
+    try:
+        prepared = []
+        failed = []
+        for file, (digest, error) in zip(accepted, get_executor().map(_prepare, accepted)):
+            if error is not None:
+                errors.append(f"Ошибка при загрузке файла {file.name}: {error}")
+                failed.append(file)
+                continue
+            prepared.append((file, digest))
+
+        # Одинаковое содержимое хранится один раз, в том числе внутри одного пакета
+        digests = {}
+        for _, (sha256, size, path, stored_size) in prepared:
+            size, uses, path, stored_size = digests.get(sha256, (size, 0, path, stored_size))
+            digests[sha256] = (size, uses + 1, path, stored_size)
+
+        with transaction.atomic():
+            blobs, lost = acquire_blobs(digests) if digests else ({}, set())
+            for file, (sha256, size, _, _) in prepared:
+                if sha256 in lost:
+                    errors.append(f"Ошибка при загрузке файла {file.name}: файл был удален во время загрузки")
+                    failed.append(file)
+                    continue
+                blob = blobs[sha256]
+                instances.append(File(
+                    user=target_user,
+                    blob=blob,
+                    file_name=file.name,
+                    file_size=size,
+                    type=file.content_type,
+                    url=blob.path,
+                    comment=comment
+                ))
+            File.objects.bulk_create(instances)
+            after_upload(instances)
+            record_changes(target_user.id, [created(instance) for instance in instances])
+    except BaseException:
+        release(target_user.id, sum(file.size for file in accepted), len(accepted))
+        raise
+
+    # Возвращаем резерв за файлы, которые не сохранились
+    if failed:
+        release(target_user.id, sum(file.size for file in failed), len(failed))
+
+    return FileSerializer(instances, many=True).data, errors
+
+
+def upload_response(uploaded_files, errors):
+    """Тело и статус ответа на загрузку: 207, если часть файлов не загрузилась."""
+    response_data = {"uploaded_files": uploaded_files}
+    if errors:
+        response_data["errors"] = errors
+
+    status_code = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+    return response_data, status_code
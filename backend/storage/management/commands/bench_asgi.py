@@ -0,0 +1,104 @@
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import get_runner, override_settings
+from django.conf import settings
+from django.urls import reverse
+
+from storage import downloads
+from storage.benchmarks import MemorySampler, consume, run_concurrent, summarize, synthetic_file
+from storage.ingest import ingest_files
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает синхронный (WSGI, DRF) и асинхронный (ASGI) путь скачивания и списка файлов "
+        "при заданной конкурентности. Запускается на временной тестовой БД."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="Число запросов на сценарий")
+        parser.add_argument('--concurrency', type=int, default=50, help="Одновременных клиентов")
+        parser.add_argument('--file-size', type=int, default=1024 * 1024, help="Размер скачиваемого файла, байт")
+        parser.add_argument('--output', help="Файл для результатов в JSON (по умолчанию stdout)")
+
+    def handle(self, *args, **options):
+        runner = get_runner(settings)(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        media_root = tempfile.mkdtemp(prefix='bench-media-')
+        try:
+            with override_settings(FILE_DELIVERY_BACKEND='django', ALLOWED_HOSTS=['*'], MEDIA_ROOT=media_root):
+                results = self.run_benchmarks(options)
+                downloads.flush()
+        finally:
+            runner.teardown_databases(old_config)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        output = json.dumps({'vendor': connection.vendor, 'results': results}, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(output)
+        else:
+            self.stdout.write(output)
+
+    def run_benchmarks(self, options):
+        user = CustomUser.objects.create_user(login='bench', fullname='Bench', password='bench')
+        uploaded, _ = ingest_files(user, [synthetic_file('bench.bin', options['file_size'])])
+        file_id = uploaded[0]['id']
+
+        scenarios = {
+            'download': (
+                reverse('download-file', kwargs={'file_id': file_id}),
+                reverse('async-download-file', kwargs={'file_id': file_id}),
+            ),
+            'list': (
+                reverse('file-list', kwargs={'user_id': user.id}),
+                reverse('async-file-list', kwargs={'user_id': user.id}),
+            ),
+        }
+        results = []
+        for name, (sync_url, async_url) in scenarios.items():
+            results.append(self.run_wsgi(f'{name}:wsgi', user, sync_url, options))
+            results.append(asyncio.run(self.run_asgi(f'{name}:asgi', user, async_url, options)))
+        return results
+
+    def run_wsgi(self, name, user, url, options):
+        # Одна сессия на всех клиентов, логин не входит в замер
+        session = Client()
+        session.force_login(user)
+
+        def one_request(_):
+            client = Client()
+            client.cookies = session.cookies
+            consume(client.get(url))
+
+        with MemorySampler() as memory:
+            samples, elapsed = run_concurrent(one_request, options['requests'], options['concurrency'])
+        return summarize(name, samples, elapsed, concurrency=options['concurrency'], **memory.result())
+
+    async def run_asgi(self, name, user, url, options):
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        client = AsyncClient()
+        await asyncio.to_thread(client.force_login, user)
+
+        async def one_request():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url)
+                if response.streaming:
+                    async for _ in response.streaming_content:
+                        pass
+                return time.perf_counter() - started
+
+        with MemorySampler() as memory:
+            started = time.perf_counter()
+            samples = await asyncio.gather(*(one_request() for _ in range(options['requests'])))
+            elapsed = time.perf_counter() - started
+        return summarize(name, list(samples), elapsed, concurrency=options['concurrency'], **memory.result())
@@ -0,0 +1,208 @@
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import get_runner, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from storage import downloads
+from storage.benchmarks import (
+    MemorySampler,
+    consume,
+    count_queries,
+    run_concurrent,
+    seed_storage,
+    summarize,
+    synthetic_file,
+)
+from storage.models import File
+from storage.signing import sign_download
+from users.models import CustomUser
+
+# Метрики, по которым сравниваются прогоны: (ключ, больше — хуже)
+COMPARED_METRICS = (
+    ('p50_ms', True),
+    ('p99_ms', True),
+    ('throughput_rps', False),
+    ('queries', True),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест API хранилища: наполняет временную БД синтетическими "
+        "пользователями и файлами и замеряет задержки (p50/p90/p99), пропускную "
+        "способность, число запросов к БД и пиковый RSS (и его рост) по сценариям. "
+        "Для запуска без PostgreSQL: DB_ENGINE=sqlite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help="Число пользователей")
+        parser.add_argument('--files', type=int, default=100, help="Файлов на пользователя")
+        parser.add_argument('--distinct', type=int, default=20, help="Разных содержимых среди файлов")
+        parser.add_argument('--requests', type=int, default=200, help="Число запросов на сценарий")
+        parser.add_argument('--concurrency', type=int, default=8, help="Одновременных клиентов")
+        parser.add_argument('--upload-size', type=int, default=64 * 1024, help="Размер загружаемого файла, байт")
+        parser.add_argument('--seed', type=int, default=0, help="Seed генератора данных")
+        parser.add_argument('--output', help="Файл для результатов в JSON (по умолчанию stdout)")
+        parser.add_argument('--compare', help="JSON прошлого прогона для сравнения")
+        parser.add_argument(
+            '--max-regression', type=float,
+            help="Допустимое ухудшение метрик относительно --compare, в процентах",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as fp:
+                baseline = json.load(fp)
+
+        runner = get_runner(settings)(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        media_root = tempfile.mkdtemp(prefix='bench-media-')
+        try:
+            with override_settings(FILE_DELIVERY_BACKEND='django', ALLOWED_HOSTS=['*'], MEDIA_ROOT=media_root):
+                seed_started = timezone.now()
+                users = seed_storage(options['users'], options['files'], options['distinct'], options['seed'])
+                seed_seconds = (timezone.now() - seed_started).total_seconds()
+                results = self.run_benchmarks(users, options)
+                downloads.flush()
+        finally:
+            runner.teardown_databases(old_config)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = {
+            'commit': self.git_commit(),
+            'vendor': connection.vendor,
+            'created_at': timezone.now().isoformat(),
+            'parameters': {
+                key: options[key]
+                for key in ('users', 'files', 'distinct', 'requests', 'concurrency', 'upload_size', 'seed')
+            },
+            'seed_s': round(seed_seconds, 3),
+            'results': results,
+        }
+        regressions = []
+        if baseline is not None:
+            regressions = self.compare(report, baseline, options['max_regression'])
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(output)
+        else:
+            self.stdout.write(output)
+
+        if regressions:
+            raise CommandError("Ухудшение относительно базового прогона: " + ', '.join(regressions))
+
+    def run_benchmarks(self, users, options):
+        admin = CustomUser.objects.create_superuser(login='bench-admin', fullname='Bench Admin', password='bench')
+        owner = users[0]
+        file_ids = list(File.objects.filter(user=owner).order_by('id').values_list('id', flat=True))
+        if not file_ids:
+            raise CommandError("Нужен хотя бы один файл на пользователя (--files)")
+
+        # Курсор страницы из середины списка: проверка, что глубокие страницы не медленнее первой
+        client = Client()
+        client.force_login(admin)
+        list_url = reverse('file-list', kwargs={'user_id': owner.id})
+        deep_cursor = None
+        for _ in range(len(file_ids) // 2 // 100):
+            deep_cursor = client.get(list_url, {'cursor': deep_cursor} if deep_cursor else {}).json()['next_cursor']
+
+        def rotate(values):
+            return lambda i: values[i % len(values)]
+
+        upload_size = options['upload_size']
+        scenarios = [
+            ('upload', 'post', rotate([reverse('file-upload', kwargs={'user_id': owner.id})]),
+             lambda i: {'file': synthetic_file(f'upload{i}.bin', upload_size, seed=i), 'user_id': owner.id}),
+            ('download', 'get', rotate([reverse('download-file', kwargs={'file_id': file_id}) for file_id in file_ids]),
+             None),
+            ('download_signed', 'get', rotate([
+                reverse('signed-download', kwargs={'token': sign_download(file_instance)})
+                for file_instance in File.objects.filter(user=owner).order_by('id')
+            ]), None),
+            ('list', 'get', rotate([reverse('file-list', kwargs={'user_id': user.id}) for user in users]), None),
+            ('list_deep', 'get', rotate([f'{list_url}?cursor={deep_cursor}' if deep_cursor else list_url]), None),
+            ('users', 'get', rotate([reverse('get-users')]), None),
+            ('users_search', 'get', rotate([f"{reverse('get-users')}?search=bench1"]), None),
+            ('check_auth', 'get', rotate([reverse('check-auth')]), None),
+        ]
+
+        # SQLite не переносит параллельную запись: загрузки идут в один поток
+        write_concurrency = 1 if connection.vendor == 'sqlite' else options['concurrency']
+
+        results = []
+        for name, method, url_for, data_for in scenarios:
+            concurrency = write_concurrency if method == 'post' else options['concurrency']
+            results.append(self.run_scenario(name, admin, method, url_for, data_for, concurrency, options['requests']))
+        return results
+
+    def run_scenario(self, name, user, method, url_for, data_for, concurrency, requests):
+        # Одна сессия на всех клиентов, логин не входит в замер
+        session = Client()
+        session.force_login(user)
+        errors = []
+        errors_lock = threading.Lock()
+
+        def one_request(i):
+            client = Client()
+            client.cookies = session.cookies
+            kwargs = {'data': data_for(i)} if data_for else {}
+            response = getattr(client, method)(url_for(i), **kwargs)
+            consume(response)
+            if response.status_code >= 400:
+                with errors_lock:
+                    errors.append(response.status_code)
+
+        # Отдельный запрос в текущем потоке — только для подсчета обращений к БД
+        queries = count_queries(lambda: one_request(requests))
+        with MemorySampler() as memory:
+            samples, elapsed = run_concurrent(one_request, requests, concurrency)
+        return summarize(
+            name, samples, elapsed,
+            concurrency=concurrency,
+            queries=queries,
+            errors=len(errors),
+            **memory.result(),
+        )
+
+    def compare(self, report, baseline, max_regression):
+        """Добавляет к результатам изменение метрик в процентах; возвращает список превышений."""
+        previous = {result['name']: result for result in baseline.get('results', [])}
+        regressions = []
+        for result in report['results']:
+            old = previous.get(result['name'])
+            if old is None:
+                continue
+            delta = {}
+            for key, higher_is_worse in COMPARED_METRICS:
+                if not old.get(key) or result.get(key) is None:
+                    continue
+                change = (result[key] - old[key]) / old[key] * 100
+                delta[key] = round(change, 1)
+                worse = change if higher_is_worse else -change
+                if max_regression is not None and worse > max_regression:
+                    regressions.append(f"{result['name']}.{key} {change:+.1f}%")
+            result['delta_pct'] = delta
+        report['baseline_commit'] = baseline.get('commit')
+        return regressions
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
@@ -0,0 +1,37 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from storage.models import File
+from storage.tasks import move_to_blob_store
+
+
+class Command(BaseCommand):
+    help = "Переносит файлы из user_files в хранилище блобов, удаляя дубликаты на месте"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, сколько файлов будет перенесено")
+
+    def handle(self, *args, **options):
+        files = File.objects.filter(blob__isnull=True).order_by('id')
+        if options['dry_run']:
+            self.stdout.write(f"Файлов для переноса: {files.count()}")
+            return
+
+        moved = duplicates = missing = 0
+        for file_instance in files.iterator():
+            old_name = file_instance.url.name
+            if not default_storage.exists(old_name):
+                missing += 1
+                self.stderr.write(f"Файл не найден на диске: {old_name} (id={file_instance.id})")
+                continue
+
+            with transaction.atomic():
+                blob = move_to_blob_store(file_instance)
+                if blob.ref_count > 1:
+                    duplicates += 1
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено: {moved}, из них дубликатов: {duplicates}, не найдено: {missing}"
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from storage.usage import recalculate
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает занятое место и количество файлов пользователей по таблице файлов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help="id пользователя (можно несколько)")
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.all()
+        if options['user_ids']:
+            users = users.filter(id__in=options['user_ids'])
+        updated = recalculate(users)
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано пользователей: {updated}"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from storage.models import LEGACY_USER_PATH, File
+from storage.queue import enqueue_many
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Ставит фоновые задачи переноса файлов из прежней раскладки user_files/<id>/<имя> "
+        "под ключи во вложенных каталогах; сами файлы переносит воркер (run_worker)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, сколько файлов будет перенесено")
+
+    def handle(self, *args, **options):
+        file_ids = (
+            File.objects.filter(blob__isnull=True, url__regex=LEGACY_USER_PATH.pattern)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        if options['dry_run']:
+            self.stdout.write(f"Файлов для переноса: {file_ids.count()}")
+            return
+
+        queued = 0
+        batch = []
+        for file_id in file_ids.iterator(chunk_size=BATCH_SIZE):
+            batch.append({'file_id': file_id})
+            if len(batch) >= BATCH_SIZE:
+                queued += len(enqueue_many('relocate_file', batch))
+                batch = []
+        if batch:
+            queued += len(enqueue_many('relocate_file', batch))
+
+        self.stdout.write(self.style.SUCCESS(f"Поставлено задач переноса: {queued}"))
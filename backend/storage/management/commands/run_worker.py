@@ -0,0 +1,55 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from storage.models import Job
+from storage.queue import claim_jobs, enqueue, release_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Выполняет фоновые задачи из очереди в БД (можно запускать несколько воркеров)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=10, help="Сколько задач забирать за раз")
+        parser.add_argument('--once', action='store_true', help="Выполнить готовые задачи и выйти")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Текущая задача доводится до конца, новые не берутся
+        previous = {signum: signal.signal(signum, self.stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            self.work(options)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def work(self, options):
+        next_cleanup = 0
+        while not self.stopping:
+            close_old_connections()
+            if time.monotonic() >= next_cleanup:
+                self.schedule_cleanup()
+                next_cleanup = time.monotonic() + settings.JOB_CLEANUP_INTERVAL
+
+            jobs = claim_jobs(options['batch'])
+            for index, job in enumerate(jobs):
+                if self.stopping:
+                    # Остальные задачи пакета сразу достанутся другим воркерам
+                    release_jobs(jobs[index:])
+                    break
+                run_job(job)
+
+            if not jobs:
+                if options['once']:
+                    break
+                time.sleep(settings.JOB_POLL_INTERVAL)
+
+    def schedule_cleanup(self):
+        if not Job.objects.filter(kind='cleanup_orphans', status=Job.STATUS_PENDING).exists():
+            enqueue('cleanup_orphans')
+
+    def stop(self, *args):
+        self.stopping = True
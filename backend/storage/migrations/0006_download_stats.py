@@ -0,0 +1,32 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0005_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='download_count',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DownloadStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='download_stats', to='storage.file')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='downloadstat',
+            constraint=models.UniqueConstraint(fields=('file', 'date'), name='downloadstat_file_date_uniq'),
+        ),
+    ]
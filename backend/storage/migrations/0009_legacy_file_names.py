@@ -0,0 +1,41 @@
+import posixpath
+
+from django.db import migrations
+
+# Файлы в прежней раскладке user_files/<id пользователя>/<имя>
+LEGACY_USER_PATH = r'^user_files/[0-9]+/[^/]+$'
+BATCH_SIZE = 1000
+
+
+def fill_empty_names(apps, schema_editor):
+    """
+    Имя для скачивания теперь хранится только в базе. Старым файлам без
+    file_name проставляем имя файла на диске; заполненные имена не трогаем —
+    на диске они могут отличаться суффиксом, который Django добавляет при
+    совпадении имен (report_AbC123x.pdf).
+    """
+    File = apps.get_model('storage', 'File')
+    files = (
+        File.objects.filter(blob__isnull=True, url__regex=LEGACY_USER_PATH, file_name='')
+        .only('id', 'file_name', 'url')
+    )
+    changed = []
+    for file_instance in files.iterator(chunk_size=BATCH_SIZE):
+        file_instance.file_name = posixpath.basename(file_instance.url.name)
+        changed.append(file_instance)
+        if len(changed) >= BATCH_SIZE:
+            File.objects.bulk_update(changed, ['file_name'])
+            changed = []
+    if changed:
+        File.objects.bulk_update(changed, ['file_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0008_share_links'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_empty_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# Поиск файлов (storage/search.py) в PostgreSQL:
+# - search_vector — генерируемая колонка tsvector из имени (вес A), комментария (B)
+#   и типа (C), поддерживается самой СУБД при каждом INSERT/UPDATE;
+# - составные GIN-индексы с user_id впереди (btree_gin): поиск ограничен файлами
+#   одного пользователя и не просматривает чужие строки;
+# - триграммный индекс по имени (pg_trgm) для ILIKE '%...%' и поиска с опечатками.
+# Колонки нет в модели: Django ее не пишет и не читает. В других СУБД миграция
+# ничего не делает — поиск там идет по подстроке без индексов.
+# Добавление генерируемой колонки перезаписывает таблицу; индексы строятся
+# CONCURRENTLY, поэтому миграция выполняется вне транзакции.
+#
+# CREATE EXTENSION требует прав суперпользователя (или владельца БД для доверенных
+# расширений в PostgreSQL 13+). Если у пользователя приложения таких прав нет
+# (управляемые БД), расширения pg_trgm и btree_gin заранее создает администратор:
+# IF NOT EXISTS тогда ничего не делает.
+#
+# Колонка зависит от file_name, comment и type: PostgreSQL не даст изменить их тип
+# (AlterField с новой длиной или типом упадет). Миграция, меняющая эти поля, должна
+# сначала удалить колонку и индекс storage_file_search_idx (BACKWARD ниже без
+# индекса по имени), а после AlterField — создать их заново (FORWARD).
+
+FORWARD = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    "ALTER TABLE storage_file ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(file_name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(comment, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(\"type\", '')), 'C')) STORED",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS storage_file_search_idx "
+    "ON storage_file USING gin (user_id, search_vector)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS storage_file_name_trgm_idx "
+    "ON storage_file USING gin (user_id, file_name gin_trgm_ops)",
+)
+
+BACKWARD = (
+    "DROP INDEX CONCURRENTLY IF EXISTS storage_file_name_trgm_idx",
+    "DROP INDEX CONCURRENTLY IF EXISTS storage_file_search_idx",
+    "ALTER TABLE storage_file DROP COLUMN IF EXISTS search_vector",
+)
+
+
+def run(statements):
+    def apply(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return apply
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('storage', '0009_legacy_file_names'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(FORWARD), run(BACKWARD)),
+    ]
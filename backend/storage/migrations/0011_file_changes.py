@@ -0,0 +1,35 @@
+# Generated by Django 4.2.17 on 2026-10-18 13:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('storage', '0010_file_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('file_id', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('create', 'Создание'), ('rename', 'Переименование'), ('comment', 'Изменение комментария'), ('delete', 'Удаление')], max_length=16)),
+                ('data', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='filechange_created_at_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='filechange',
+            constraint=models.UniqueConstraint(fields=('user', 'seq'), name='filechange_user_seq_uniq'),
+        ),
+    ]
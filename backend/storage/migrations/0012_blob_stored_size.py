@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+def fill_stored_size(apps, schema_editor):
+    # До сжатия в хранилище все блобы лежали как есть
+    Blob = apps.get_model('storage', 'Blob')
+    Blob.objects.update(stored_size=models.F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0011_file_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_stored_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.17 on 2026-10-18 13:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('storage', '0012_blob_stored_size'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sharelink',
+            name='created_by',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='share_links', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
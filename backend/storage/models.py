@@ -1,21 +1,75 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from users.models import CustomUser
 import os
+import re
+import secrets
+import uuid
+
+# Прежняя раскладка: все файлы пользователя в одном каталоге под исходным именем
+LEGACY_USER_PATH = re.compile(r'^user_files/\d+/[^/]+$')
+
 
 def user_directory_path(instance, filename):
-    return f'user_files/{instance.user.id}/{filename}'
+    """
+    Ключ файла вне хранилища блобов: случайный, не зависящий от имени файла
+    (одинаковые имена не конфликтуют, переименование не трогает диск) и
+    разложенный по вложенным каталогам, чтобы ни один каталог не разрастался.
+    """
+    key = uuid.uuid4().hex
+    return f'user_files/{key[:2]}/{key[2:4]}/{key}'
+
+
+# Суффикс имени блоба, сжатого zstd (см. storage/compression.py)
+COMPRESSED_BLOB_SUFFIX = '.zst'
+
+
+def blob_path(sha256, compressed=False):
+    suffix = COMPRESSED_BLOB_SUFFIX if compressed else ''
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{suffix}'
+
+
+class Blob(models.Model):
+    """
+    Содержимое файла, адресуемое по SHA-256. Одинаковые загрузки (в том числе
+    разных пользователей) ссылаются на один Blob. Блоб без ссылок (ref_count=0)
+    удаляет вместе с файлом фоновая задача delete_blob, если до ее запуска
+    такое же содержимое не загрузили снова.
+    size — исходный размер, stored_size — занятое в хранилище место
+    (меньше size у сжатых блобов с суффиксом .zst).
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    stored_size = models.BigIntegerField(default=0)
+    path = models.CharField(max_length=255)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
 
 class File(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="files")
+    # Для файлов в хранилище блобов url указывает на blob.path
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="files", null=True, blank=True)
     file_name = models.CharField(max_length=255)
     url = models.FileField(upload_to=user_directory_path)
-    file_size = models.IntegerField()
+    file_size = models.BigIntegerField()
     upload_date = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     last_downloaded = models.DateTimeField(null=True, blank=True)
+    download_count = models.BigIntegerField(default=0)
     comment = models.TextField(blank=True)
     type = models.CharField(max_length=50, null=True, blank=True)
 
+    class Meta:
+        # Индексы под курсорную пагинацию списка файлов: (user, поле сортировки, id)
+        indexes = [
+            models.Index(fields=['user', 'upload_date', 'id'], name='file_user_upload_date_idx'),
+            models.Index(fields=['user', 'file_size', 'id'], name='file_user_size_idx'),
+            models.Index(fields=['user', 'type', 'id'], name='file_user_type_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if self.url:
             if not self.file_size:
@@ -28,9 +82,35 @@ class File(models.Model):
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.url:
-            self.url.delete(False)
-        super().delete(*args, **kwargs)
+        """
+        Удаляет запись; физический файл удаляется фоновой задачей,
+        поэтому время запроса определяется только транзакцией в БД.
+        """
+        from .blobs import release_blob
+        from .changes import record_changes
+        from .queue import enqueue
+        from .usage import release
+
+        file_id = self.pk
+        with transaction.atomic():
+            # blob_id перечитывается под блокировкой: фоновая задача могла перенести файл в блоб
+            current = File.objects.select_for_update().filter(pk=file_id).values('blob_id', 'url').first()
+            if current is None:
+                return 0, {}
+            result = super().delete(*args, **kwargs)
+            # Блоб блокируется раньше строки пользователя — в том же порядке, что и при загрузке
+            if current['blob_id']:
+                release_blob(current['blob_id'])
+            elif current['url']:
+                enqueue('delete_path', name=current['url'])
+            release(self.user_id, self.file_size)
+            record_changes(self.user_id, [(file_id, FileChange.KIND_DELETE, {})])
+        return result
+
+    @property
+    def download_name(self):
+        # Имя на диске — хэш или случайный ключ, имя для пользователя хранится только в базе
+        return self.file_name
 
     def __str__(self):
         return self.file_name
@@ -38,3 +118,131 @@ class File(models.Model):
     @property
     def file_url(self):
         return self.url.url
+
+
+class DownloadStat(models.Model):
+    """Число скачиваний файла за день; пополняется пакетно из storage.downloads."""
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name="download_stats")
+    date = models.DateField()
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['file', 'date'], name='downloadstat_file_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_id} {self.date}: {self.count}"
+
+
+def generate_share_token():
+    return secrets.token_urlsafe(24)
+
+
+class ShareLink(models.Model):
+    """
+    Публичная ссылка на файл. Каждое скачивание увеличивает download_count
+    условным UPDATE, поэтому лимит max_downloads соблюдается и при параллельных
+    запросах. Пустые expires_at и max_downloads — без ограничений.
+    Ссылка переживает удаление своего автора: created_by становится пустым.
+    """
+    token = models.CharField(max_length=64, unique=True, default=generate_share_token)
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name="share_links")
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name="share_links")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    max_downloads = models.PositiveIntegerField(null=True, blank=True)
+    download_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.file_id}: {self.token}"
+
+
+class FileChange(models.Model):
+    """
+    Запись журнала изменений файлов пользователя для дельта-синхронизации
+    клиентов. seq — сплошная нумерация в пределах пользователя (см. storage/changes.py).
+    file_id не внешний ключ: записи об удалении переживают сам файл.
+    """
+    KIND_CREATE = 'create'
+    KIND_RENAME = 'rename'
+    KIND_COMMENT = 'comment'
+    KIND_DELETE = 'delete'
+    KIND_CHOICES = [
+        (KIND_CREATE, 'Создание'),
+        (KIND_RENAME, 'Переименование'),
+        (KIND_COMMENT, 'Изменение комментария'),
+        (KIND_DELETE, 'Удаление'),
+    ]
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="file_changes")
+    seq = models.BigIntegerField()
+    file_id = models.BigIntegerField()
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    # Новые значения полей файла на момент изменения
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'seq'], name='filechange_user_seq_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='filechange_created_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}#{self.seq} {self.kind} {self.file_id}"
+
+
+class UploadSession(models.Model):
+    """
+    Сессия возобновляемой загрузки по чанкам. Чанки пишутся сразу в конечный
+    файл (path относительно MEDIA_ROOT), offset — число подтвержденных байт.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="upload_sessions")
+    file_name = models.CharField(max_length=255)
+    type = models.CharField(max_length=50, default='application/octet-stream')
+    comment = models.TextField(blank=True)
+    file_size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    path = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.offset}/{self.file_size})"
+
+
+class Job(models.Model):
+    """
+    Фоновая задача: обработчик из storage/tasks.py и его аргументы.
+    Задачи выбираются командой run_worker через SELECT ... FOR UPDATE SKIP LOCKED,
+    успешно выполненные удаляются, исчерпавшие попытки остаются со статусом failed.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id'], name='job_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk}'
@@ -0,0 +1,162 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q, F
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация по паре (поле сортировки, id).
+
+    Следующая страница выбирается условием WHERE (поле, id) > (значение, id)
+    вместо OFFSET, поэтому время ответа не зависит от номера страницы.
+    NULL-значения поля сортировки всегда идут в конце.
+    """
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    # Разрешенные поля сортировки
+    ordering_fields = ('id',)
+    default_ordering = 'id'
+    results_key = 'results'
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise InvalidCursor("Параметр page_size должен быть числом.")
+        if page_size < 1:
+            raise InvalidCursor("Параметр page_size должен быть больше нуля.")
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise InvalidCursor(f"Недопустимое поле сортировки: {ordering}.")
+        return ordering
+
+    def encode_cursor(self, ordering, instance):
+        field = ordering.lstrip('-')
+        value = getattr(instance, field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        payload = json.dumps({'o': ordering, 'v': value, 'id': instance.pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, ordering, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            position = payload['v'], int(payload['id'])
+            cursor_ordering = payload['o']
+        except (ValueError, KeyError, TypeError):
+            raise InvalidCursor("Некорректный курсор.")
+        if cursor_ordering != ordering:
+            raise InvalidCursor("Курсор получен для другой сортировки.")
+        return position
+
+    def get_position_filter(self, queryset, ordering, value, pk):
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        model_field = queryset.model._meta.get_field(field)
+        if value is not None and model_field.get_internal_type() == 'DateTimeField':
+            value = parse_datetime(value)
+            if value is None:
+                raise InvalidCursor("Некорректный курсор.")
+
+        pk_lookup = 'id__lt' if descending else 'id__gt'
+        if field == 'id':
+            return Q(**{pk_lookup: pk})
+        if value is None:
+            # Курсор уже в «хвосте» из NULL-значений
+            return Q(**{f'{field}__isnull': True, pk_lookup: pk})
+
+        value_lookup = f'{field}__lt' if descending else f'{field}__gt'
+        position = Q(**{value_lookup: value}) | Q(**{field: value, pk_lookup: pk})
+        if model_field.null:
+            position |= Q(**{f'{field}__isnull': True})
+        return position
+
+    def is_nullable(self, queryset, field):
+        try:
+            return queryset.model._meta.get_field(field).null
+        except FieldDoesNotExist:
+            # Аннотация (rank в поиске) всегда вычисляется
+            return False
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Возвращает ленивый queryset страницы (с одной лишней записью).
+        Выполняется отдельно от paginate_queryset, чтобы async-представления
+        могли перебирать его через async for.
+        """
+        self.page_size_value = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+
+        field = self.ordering.lstrip('-')
+        if not self.is_nullable(queryset, field):
+            # Без NULLS LAST порядок совпадает с индексом (user, поле, id) в обе стороны
+            order_by = [self.ordering, '-id' if self.ordering.startswith('-') else 'id']
+        elif self.ordering.startswith('-'):
+            order_by = [F(field).desc(nulls_last=True), '-id']
+        else:
+            order_by = [F(field).asc(nulls_last=True), 'id']
+        queryset = queryset.order_by(*order_by)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(self.ordering, cursor)
+            queryset = queryset.filter(self.get_position_filter(queryset, self.ordering, value, pk))
+
+        # Запрашиваем на одну запись больше, чтобы узнать, есть ли следующая страница
+        return queryset[:self.page_size_value + 1]
+
+    def finalize_page(self, rows):
+        self.has_next = len(rows) > self.page_size_value
+        page = rows[:self.page_size_value]
+        self.next_cursor = self.encode_cursor(self.ordering, page[-1]) if self.has_next else None
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finalize_page(list(self.get_page_queryset(queryset, request)))
+
+    def get_paginated_response(self, data):
+        return Response({
+            self.results_key: data,
+            'next_cursor': self.next_cursor,
+        })
+
+
+class FileCursorPagination(KeysetPagination):
+    ordering_fields = ('upload_date', 'file_size', 'type', 'id')
+    # Новые файлы первыми
+    default_ordering = '-upload_date'
+
+
+class SearchPagination(KeysetPagination):
+    """Результаты поиска по убыванию релевантности: курсор по паре (rank, id)."""
+    ordering_fields = ('rank',)
+    default_ordering = '-rank'
+
+    def get_ordering(self, request):
+        return self.default_ordering
+
+    def get_position_filter(self, queryset, ordering, value, pk):
+        # rank — аннотация (см. storage/search.py), а не поле модели
+        if not isinstance(value, (int, float)):
+            raise InvalidCursor("Некорректный курсор.")
+        return Q(rank__lt=value) | Q(rank=value, id__lt=pk)
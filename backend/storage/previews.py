@@ -0,0 +1,221 @@
+"""
+Превью файлов: уменьшенные копии изображений (Pillow) и рендер первой
+страницы PDF (pdftoppm из poppler-utils). Обе зависимости необязательные —
+без них превью для соответствующих типов просто недоступны.
+
+Превью лежат в отдельном кэше PREVIEW_CACHE_DIR под ключом от содержимого
+файла, поэтому одинаковые файлы разных пользователей делят одно превью.
+Кэш ограничен PREVIEW_CACHE_MAX_SIZE: при переполнении удаляются давно не
+использованные файлы (время последнего обращения хранится в mtime). Кэш общий
+для всех процессов, поэтому размер, который процесс ведет по своим превью,
+раз в PREVIEW_CACHE_SCAN_INTERVAL секунд сверяется с обходом каталога:
+превышение лимита ограничено тем, что все процессы успеют добавить за интервал.
+Превью отдается открытым файлом: удаление другим процессом уже не помешает.
+"""
+import functools
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from .backends import local_copy
+
+logger = logging.getLogger('storage')
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен
+    Image = None
+
+# Длина большей стороны превью в пикселях
+PREVIEW_SIZES = {
+    'small': 256,
+    'large': 1024,
+}
+PREVIEW_CONTENT_TYPE = 'image/jpeg'
+PDF_CONTENT_TYPE = 'application/pdf'
+
+# После очистки кэш занимает не больше этой доли лимита
+EVICT_TARGET = 0.9
+
+_cache_size = None
+_next_scan = 0
+_cache_lock = threading.Lock()
+
+
+class PreviewUnavailable(Exception):
+    pass
+
+
+def supports_preview(content_type):
+    if not content_type:
+        return False
+    if content_type.startswith('image/'):
+        return Image is not None
+    if content_type == PDF_CONTENT_TYPE:
+        return _has_pdftoppm()
+    return False
+
+
+@functools.lru_cache(maxsize=None)
+def _has_pdftoppm():
+    return shutil.which('pdftoppm') is not None
+
+
+def content_key(file_instance):
+    # Для блобов ключ — хэш содержимого, для старых файлов — производная от пути и даты изменения
+    if file_instance.blob_id:
+        return file_instance.blob.sha256
+    source = f'{file_instance.url.name}:{file_instance.updated_at.isoformat()}:{file_instance.file_size}'
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def preview_path(key, size):
+    return os.path.join(settings.PREVIEW_CACHE_DIR, key[:2], f'{key}_{size}.jpg')
+
+
+def get_preview(file_instance, size):
+    """
+    Возвращает открытый файл превью (режим rb), создавая превью при отсутствии
+    в кэше. Бросает PreviewUnavailable, если для файла превью не строится.
+    """
+    if size not in PREVIEW_SIZES:
+        raise PreviewUnavailable(f"Неизвестный размер превью: {size}")
+    if not supports_preview(file_instance.type):
+        raise PreviewUnavailable("Превью для этого типа файла недоступно")
+
+    path = preview_path(content_key(file_instance), size)
+    try:
+        preview = open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        # Отмечаем обращение для LRU; файл уже открыт, удаление из кэша его не затронет
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return preview
+
+    # Из удаленного хранилища исходник скачивается во временный файл
+    with local_copy(file_instance.url.name) as source:
+        preview = _render(source, file_instance.type, PREVIEW_SIZES[size], path)
+    _account(os.fstat(preview.fileno()).st_size)
+    return preview
+
+
+def generate_previews(file_ids):
+    """Строит превью всех размеров для загруженных файлов (вызывается в фоне)."""
+    from .models import File
+
+    for file_instance in File.objects.select_related('blob').filter(id__in=file_ids):
+        if not supports_preview(file_instance.type):
+            continue
+        for size in PREVIEW_SIZES:
+            try:
+                get_preview(file_instance, size).close()
+            except Exception:
+                logger.exception("Не удалось построить превью %s для файла %s", size, file_instance.id)
+                break
+
+
+def _render(source, content_type, pixels, target):
+    """Строит превью в target и возвращает его открытым (файл открывается до переименования)."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    os.close(fd)
+    try:
+        if content_type == PDF_CONTENT_TYPE:
+            _render_pdf(source, pixels, tmp_path)
+        else:
+            _render_image(source, pixels, tmp_path)
+        preview = open(tmp_path, 'rb')
+        os.replace(tmp_path, target)
+        return preview
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _render_image(source, pixels, target):
+    try:
+        with Image.open(source) as image:
+            # draft() позволяет декодеру JPEG сразу читать уменьшенное изображение
+            image.draft('RGB', (pixels, pixels))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((pixels, pixels))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(target, 'JPEG', quality=80, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise PreviewUnavailable(f"Не удалось прочитать изображение: {e}")
+
+
+def _render_pdf(source, pixels, target):
+    prefix = target[:-len('.tmp')]
+    try:
+        subprocess.run(
+            ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-scale-to', str(pixels), source, prefix],
+            check=True, capture_output=True, timeout=60,
+        )
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        raise PreviewUnavailable(f"Не удалось отрисовать PDF: {e}")
+    os.replace(prefix + '.jpg', target)
+
+
+def _scan_cache():
+    entries = []
+    for root, _, names in os.walk(settings.PREVIEW_CACHE_DIR):
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _account(added):
+    global _cache_size, _next_scan
+    with _cache_lock:
+        # Размер сверяется с диском: в тот же кэш пишут и другие процессы
+        if _cache_size is None or time.monotonic() >= _next_scan:
+            _cache_size = sum(size for _, size, _ in _scan_cache())
+            _next_scan = time.monotonic() + settings.PREVIEW_CACHE_SCAN_INTERVAL
+        else:
+            _cache_size += added
+        if _cache_size > settings.PREVIEW_CACHE_MAX_SIZE:
+            _cache_size = evict_cache()
+
+
+def evict_cache(max_size=None):
+    """
+    Удаляет давно не использованные превью, пока кэш не станет меньше
+    EVICT_TARGET от лимита. Возвращает итоговый размер кэша.
+    """
+    max_size = settings.PREVIEW_CACHE_MAX_SIZE if max_size is None else max_size
+    entries = sorted(_scan_cache())
+    total = sum(size for _, size, _ in entries)
+    if total <= max_size:
+        return total
+
+    target = max_size * EVICT_TARGET
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
@@ -0,0 +1,141 @@
+"""
+Очередь фоновых задач в таблице Job, без внешнего брокера.
+
+Задача ставится в той же транзакции, что и изменения, которые ее породили,
+поэтому не теряется при ошибке и не выполняется раньше фиксации.
+Воркеры (manage.py run_worker) забирают задачи через
+SELECT ... FOR UPDATE SKIP LOCKED и не мешают друг другу. Пока задача
+выполняется, воркер раз в JOB_HEARTBEAT_INTERVAL обновляет ее locked_at:
+повторно берутся только задачи, чей воркер перестал отзываться дольше
+JOB_LOCK_TIMEOUT, а не просто долгие.
+"""
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger('storage')
+
+# Имя задачи -> обработчик
+TASKS = {}
+
+
+def task(name):
+    """Регистрирует обработчик задачи. Аргументы обработчика — поля payload."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(kind, delay=None, **payload):
+    run_after = timezone.now() + timedelta(seconds=delay) if delay else timezone.now()
+    return Job.objects.create(kind=kind, payload=payload, run_after=run_after)
+
+
+def enqueue_many(kind, payloads):
+    now = timezone.now()
+    return Job.objects.bulk_create([Job(kind=kind, payload=payload, run_after=now) for payload in payloads])
+
+
+def claim_jobs(limit):
+    """
+    Забирает до limit готовых задач и помечает их выполняемыми.
+    Задачи, чей locked_at не обновлялся дольше JOB_LOCK_TIMEOUT (упавший воркер),
+    берутся повторно.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=Job.STATUS_PENDING, run_after__lte=now)
+                | Q(status=Job.STATUS_RUNNING, locked_at__lt=stale)
+            )
+            .order_by('run_after', 'id')[:limit]
+        )
+        Job.objects.filter(id__in=[job.id for job in jobs]).update(
+            status=Job.STATUS_RUNNING, locked_at=now, attempts=F('attempts') + 1
+        )
+    for job in jobs:
+        job.status = Job.STATUS_RUNNING
+        job.locked_at = now
+        job.attempts += 1
+    return jobs
+
+
+def release_jobs(jobs):
+    """Возвращает в очередь забранные, но не начатые задачи (остановка воркера)."""
+    Job.objects.filter(id__in=[job.id for job in jobs], status=Job.STATUS_RUNNING).update(
+        status=Job.STATUS_PENDING, locked_at=None, attempts=F('attempts') - 1
+    )
+
+
+@contextmanager
+def heartbeat(job):
+    """Обновляет locked_at задачи в отдельном потоке, пока выполняется блок."""
+    done = threading.Event()
+
+    def beat():
+        try:
+            while not done.wait(settings.JOB_HEARTBEAT_INTERVAL):
+                try:
+                    Job.objects.filter(id=job.id, status=Job.STATUS_RUNNING).update(locked_at=timezone.now())
+                except Exception:
+                    logger.exception("Не удалось продлить блокировку задачи %s", job)
+        finally:
+            # Поток держит собственное соединение с БД
+            connections.close_all()
+
+    thread = threading.Thread(target=beat, name=f'job-heartbeat-{job.id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def run_job(job):
+    """Выполняет задачу. Ошибка откладывает повтор с экспоненциальной задержкой."""
+    try:
+        handler = TASKS.get(job.kind)
+        if handler is None:
+            raise LookupError(f"Неизвестная задача: {job.kind}")
+        with heartbeat(job):
+            handler(**job.payload)
+    except Exception:
+        logger.exception("Задача %s завершилась с ошибкой (попытка %s)", job, job.attempts)
+        failed = job.attempts >= settings.JOB_MAX_ATTEMPTS
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        Job.objects.filter(id=job.id).update(
+            status=Job.STATUS_FAILED if failed else Job.STATUS_PENDING,
+            run_after=timezone.now() + timedelta(seconds=delay),
+            locked_at=None,
+            last_error=traceback.format_exc(),
+        )
+        return False
+
+    Job.objects.filter(id=job.id).delete()
+    return True
+
+
+def run_pending(limit=100):
+    """Выполняет все готовые задачи. Возвращает количество обработанных."""
+    processed = 0
+    while True:
+        jobs = claim_jobs(limit)
+        if not jobs:
+            return processed
+        for job in jobs:
+            run_job(job)
+        processed += len(jobs)
@@ -0,0 +1,132 @@
+import re
+import secrets
+
+from asgiref.sync import sync_to_async
+
+# Размер блока чтения при потоковой отдаче диапазонов
+STREAM_BLOCK_SIZE = 64 * 1024
+# Больше диапазонов в одном запросе не обслуживаем: отдаем файл целиком
+MAX_RANGES = 16
+
+RANGE_SPEC_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range_header(header, size):
+    """
+    Разбирает заголовок Range вида "bytes=0-499,1000-,-500".
+    Возвращает список пар (start, end) включительно или None, если заголовок
+    отсутствует или синтаксически некорректен (тогда отдается весь файл).
+    Если ни один диапазон не попадает в файл, выбрасывает RangeNotSatisfiable.
+    """
+    if not header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        match = RANGE_SPEC_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if not first:
+            # Суффикс: последние N байт
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if last and end < start:
+                return None
+            if start >= size:
+                continue
+            end = min(end, size - 1)
+        ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return ranges
+
+
+def iter_file_range(path, start, end, block_size=STREAM_BLOCK_SIZE):
+    """Читает байты [start, end] файла блоками."""
+    with open(path, 'rb') as source:
+        source.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = source.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+async def aiter_file_range(path, start, end, block_size=STREAM_BLOCK_SIZE):
+    """
+    Асинхронный вариант iter_file_range для ASGI: чтение с диска выполняется
+    в пуле потоков, event loop не блокируется.
+    """
+    run = lambda func: sync_to_async(func, thread_sensitive=False)  # noqa: E731
+    source = await run(open)(path, 'rb')
+    try:
+        await run(source.seek)(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = await run(source.read)(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+    finally:
+        await run(source.close)()
+
+
+def multipart_byteranges(path, ranges, size, content_type, asynchronous=False):
+    """
+    Готовит тело ответа multipart/byteranges.
+    Возвращает (boundary, длина тела, генератор тела).
+    """
+    boundary = secrets.token_hex(16)
+    headers = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        for start, end in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    # Перед каждым заголовком части, кроме первого, стоит CRLF после данных предыдущей
+    length = sum(len(h) for h in headers) + sum(end - start + 1 for start, end in ranges)
+    length += 2 * (len(ranges) - 1) + len(closing)
+    parts = list(zip(ranges, headers))
+
+    def body():
+        for index, ((start, end), part_header) in enumerate(parts):
+            if index:
+                yield b'\r\n'
+            yield part_header
+            yield from iter_file_range(path, start, end)
+        yield closing
+
+    async def abody():
+        for index, ((start, end), part_header) in enumerate(parts):
+            if index:
+                yield b'\r\n'
+            yield part_header
+            async for block in aiter_file_range(path, start, end):
+                yield block
+        yield closing
+
+    return boundary, length, abody() if asynchronous else body()
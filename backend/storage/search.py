@@ -0,0 +1,85 @@
+"""
+Поиск файлов по имени, комментарию и типу.
+
+В PostgreSQL используется колонка search_vector (tsvector, генерируемая
+из file_name, comment и type, см. миграцию 0010_file_search) с составным
+GIN-индексом (user_id, search_vector), а для подстрок и опечаток в имени —
+триграммный индекс (user_id, file_name gin_trgm_ops). Оба индекса начинаются
+с user_id, поэтому поиск внутри файлов пользователя не зависит от размера таблицы.
+
+В остальных СУБД (SQLite в тестах и разработке) — поиск подстроки без индексов.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from .models import File
+
+# Конфигурация полнотекстового поиска: без стемминга, имена файлов бывают на любом языке
+SEARCH_CONFIG = 'simple'
+
+MAX_QUERY_LENGTH = 200
+
+
+def search_words(query):
+    # Только буквы и цифры: из них безопасно собирать tsquery
+    return re.findall(r'[^\W_]+', query)[:16]
+
+
+def _like_pattern(query):
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_files(queryset, query):
+    """
+    Фильтрует queryset файлов по строке query и добавляет аннотацию rank
+    (чем больше, тем релевантнее). Ожидается непустая query.
+    """
+    query = query.strip()[:MAX_QUERY_LENGTH]
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(queryset, query)
+    return _search_fallback(queryset, query)
+
+
+def _search_postgresql(queryset, query):
+    table = connection.ops.quote_name(File._meta.db_table)
+    words = search_words(query)
+    # Каждое слово — префикс: "отч 2024" найдет "отчет_2024.pdf"
+    tsquery = ' & '.join(f'{word}:*' for word in words)
+
+    conditions = [f"{table}.file_name ILIKE %s", f"%s <%% {table}.file_name"]
+    params = [_like_pattern(query), query]
+    if tsquery:
+        conditions.insert(0, f"{table}.search_vector @@ to_tsquery('{SEARCH_CONFIG}', %s)")
+        params.insert(0, tsquery)
+    matches = RawSQL('(' + ' OR '.join(conditions) + ')', params, output_field=BooleanField())
+
+    if tsquery:
+        rank = RawSQL(
+            f"(ts_rank_cd({table}.search_vector, to_tsquery('{SEARCH_CONFIG}', %s))"
+            f" + word_similarity(%s, {table}.file_name))::float8",
+            [tsquery, query],
+            output_field=FloatField(),
+        )
+    else:
+        rank = RawSQL(f"word_similarity(%s, {table}.file_name)::float8", [query], output_field=FloatField())
+    return queryset.filter(matches).annotate(rank=rank)
+
+
+def _search_fallback(queryset, query):
+    words = search_words(query) or [query]
+    for word in words:
+        queryset = queryset.filter(
+            Q(file_name__icontains=word) | Q(comment__icontains=word) | Q(type__icontains=word)
+        )
+    rank = Case(
+        When(file_name__istartswith=query, then=Value(3.0)),
+        When(file_name__icontains=query, then=Value(2.0)),
+        When(comment__icontains=query, then=Value(1.0)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    return queryset.annotate(rank=rank)
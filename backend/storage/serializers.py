@@ -1,30 +1,55 @@
 from rest_framework import serializers
+from django.core.files.storage import default_storage
 from django.utils.timezone import localtime
-from .models import File
+from .models import File, FileChange, ShareLink
+from .compression import is_compressed
+from .previews import supports_preview
+from .signing import sign_download
 from django.contrib.sites.models import Site
 
+
+def file_url(name):
+    """
+    Постоянная ссылка на содержимое файла хранилища: /media/, если его отдает
+    фронтовой веб-сервер из MEDIA_ROOT, иначе — маршрут API (шарды, S3).
+    Сжатые блобы тоже идут через API: /media/ отдал бы их без распаковки.
+    """
+    prefix = 'media' if default_storage.public_media and not is_compressed(name) else 'api/media'
+    return f"http://{Site.objects.get_current().domain}/{prefix}/{name}"
+
+
+# Поля модели, необходимые сериализатору; используются в .only() для списков
+FILE_LIST_FIELDS = (
+    'id',
+    'file_name',
+    'url',
+    'file_size',
+    'upload_date',
+    'last_downloaded',
+    'download_count',
+    'updated_at',
+    'comment',
+    'user_id',
+    'type',
+)
+
+# Поля для .only(): blob нужен подписанной ссылке (имя и ETag файла из блоба)
+FILE_QUERY_FIELDS = FILE_LIST_FIELDS + ('blob',)
+
+
 class FileSerializer(serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
-    user_id = serializers.IntegerField(source='user.id')
+    user_id = serializers.IntegerField(read_only=True)
     upload_date = serializers.SerializerMethodField()
     last_downloaded = serializers.SerializerMethodField()
     file_size = serializers.SerializerMethodField()
     file_name = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
 
     class Meta:
         model = File
-        fields = [
-            'id',
-            'file_name',
-            'url',
-            'file_size',
-            'upload_date',
-            'last_downloaded',
-            'updated_at',
-            'comment',
-            'user_id',
-            'type',
-        ]
+        fields = FILE_LIST_FIELDS + ('preview_url', 'download_url')
 
     def get_upload_date(self, obj):
         if obj.upload_date:
@@ -54,5 +79,33 @@ class FileSerializer(serializers.ModelSerializer):
         return obj.file_name.rsplit('.', 1)[0]
     
     def get_url(self, obj):
-        current_site = Site.objects.get_current()
-        return f"http://{current_site.domain}/media/{obj.url}"
\ No newline at end of file
+        return file_url(obj.url.name)
+
+    # Ссылка на маленькое превью; большое — с параметром ?size=large
+    def get_preview_url(self, obj):
+        if not supports_preview(obj.type):
+            return None
+        return f"http://{Site.objects.get_current().domain}/api/files/{obj.id}/preview/"
+
+    # Подписанная ссылка на скачивание без сессии (действует DOWNLOAD_LINK_TTL)
+    def get_download_url(self, obj):
+        if not obj.url:
+            return None
+        return f"http://{Site.objects.get_current().domain}/api/files/signed/{sign_download(obj)}/"
+
+
+class ShareLinkSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ShareLink
+        fields = ('token', 'url', 'file', 'created_at', 'expires_at', 'max_downloads', 'download_count')
+
+    def get_url(self, obj):
+        return f"http://{Site.objects.get_current().domain}/api/share/{obj.token}/"
+
+
+class FileChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FileChange
+        fields = ('seq', 'kind', 'file_id', 'data', 'created_at')
@@ -1,7 +1,9 @@
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, pre_delete
 from django.contrib.sites.models import Site
 from django.conf import settings
+from users.models import CustomUser
 import environ
+from .bulk import delete_user_files
 
 env = environ.Env()
 
@@ -15,4 +17,10 @@ def create_default_site(sender, **kwargs):
             },
         )
 
+# Каскадное удаление пользователя не вызывает File.delete(): без этого
+# счетчики ссылок блобов не уменьшились бы, а файлы остались бы в хранилище
+def release_user_files(sender, instance, **kwargs):
+    delete_user_files(instance.pk)
+
 post_migrate.connect(create_default_site)
+pre_delete.connect(release_user_files, sender=CustomUser)
@@ -0,0 +1,52 @@
+"""
+Подписанные ссылки на скачивание.
+
+Токен содержит все, что нужно для отдачи файла: имя в хранилище, имя для
+скачивания, тип, ETag и время изменения, а также срок действия. Подпись
+(HMAC на SECRET_KEY) проверяется без обращений к сессии и БД, поэтому такая
+ссылка обслуживается за время одного вычисления HMAC и может отдаваться
+фронтовым веб-сервером (X-Accel-Redirect) или хранилищем (presigned URL S3).
+
+Отозвать выданную ссылку нельзя — только дождаться конца DOWNLOAD_LINK_TTL,
+поэтому срок держится коротким. Для публичных ссылок с ограничениями
+используется ShareLink.
+"""
+import time
+
+from django.conf import settings
+from django.core import signing
+
+from .delivery import file_etag, file_last_modified
+
+SALT = 'storage.download'
+
+
+class LinkExpired(Exception):
+    pass
+
+
+def sign_download(file_instance, ttl=None, as_attachment=True):
+    """Токен подписанной ссылки на скачивание файла (url должен быть заполнен)."""
+    ttl = settings.DOWNLOAD_LINK_TTL if ttl is None else ttl
+    payload = {
+        'i': file_instance.id,
+        'n': file_instance.url.name,
+        'f': file_instance.download_name,
+        't': file_instance.type or 'application/octet-stream',
+        'e': file_etag(file_instance),
+        'm': file_last_modified(file_instance),
+        'a': as_attachment,
+        'x': int(time.time()) + ttl,
+    }
+    return signing.dumps(payload, salt=SALT, compress=True)
+
+
+def unsign_download(token):
+    """
+    Проверяет подпись и срок действия токена и возвращает его содержимое.
+    Поддельный токен — signing.BadSignature, просроченный — LinkExpired.
+    """
+    payload = signing.loads(token, salt=SALT)
+    if payload['x'] < time.time():
+        raise LinkExpired()
+    return payload
@@ -0,0 +1,238 @@
+"""
+Обработчики фоновых задач (см. storage/queue.py).
+"""
+import logging
+import os
+import shlex
+import subprocess
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import CustomUser
+
+from .backends import local_copy, upload_staging_storage
+from .changes import prune_changes
+from .blobs import (
+    adopt_local, adopt_path, delete_orphan_files, delete_unreferenced_blob, delete_unreferenced_blobs, release_blob,
+)
+from .bulk import delete_user_files
+from .models import LEGACY_USER_PATH, Blob, File, Job, UploadSession, user_directory_path
+from .previews import generate_previews, supports_preview
+from .queue import enqueue, enqueue_many, task
+from .serializers import FileSerializer
+from .usage import release
+
+logger = logging.getLogger('storage')
+
+# Код возврата clamscan/clamdscan при найденном вирусе
+VIRUS_FOUND_EXIT_CODE = 1
+
+
+def after_upload(instances):
+    """Ставит обработку новых файлов: превью и, если настроена, проверку антивирусом."""
+    preview_ids = [instance.id for instance in instances if supports_preview(instance.type)]
+    if preview_ids:
+        enqueue('generate_previews', file_ids=preview_ids)
+    if settings.VIRUS_SCAN_COMMAND:
+        enqueue_many('scan_file', [{'file_id': instance.id} for instance in instances])
+
+
+def move_to_blob_store(file_instance):
+    """
+    Переносит файл из user_files в хранилище блобов и переключает на него
+    запись File и аватары, ссылающиеся на старый URL. Вызывается в транзакции.
+    """
+    serializer = FileSerializer()
+    old_name = file_instance.url.name
+    old_url = serializer.get_url(file_instance)
+    blob = adopt_path(old_name, file_instance.type)
+
+    # Имя на диске станет хэшем: сохраняем расширение в file_name
+    extension = os.path.splitext(old_name)[1]
+    if extension and not os.path.splitext(file_instance.file_name)[1]:
+        file_instance.file_name += extension
+
+    file_instance.blob = blob
+    file_instance.url.name = blob.path
+    File.objects.filter(id=file_instance.id).update(blob=blob, url=blob.path, file_name=file_instance.file_name)
+
+    # Аватары ссылаются на полный URL файла
+    CustomUser.objects.filter(avatar=old_url).update(avatar=serializer.get_url(file_instance))
+    return blob
+
+
+@task('adopt_file')
+def adopt_file(file_id, staged=None):
+    # Хэширование больших файлов (загрузка по чанкам) вынесено из запроса сюда
+    if staged is not None:
+        adopt_staged_file(file_id, staged)
+        return
+    with transaction.atomic():
+        file_instance = File.objects.select_for_update().filter(id=file_id, blob__isnull=True).first()
+        if file_instance is None:
+            return
+        if not default_storage.exists(file_instance.url.name):
+            logger.warning("Файл для переноса в хранилище блобов не найден: %s", file_instance.url.name)
+            return
+        move_to_blob_store(file_instance)
+        after_upload([file_instance])
+
+
+def adopt_staged_file(file_id, staged):
+    """
+    Загружает собранный из чанков локальный файл в удаленное хранилище.
+    Загрузка идет вне транзакции: запись File блокируется только для привязки блоба.
+    """
+    if not os.path.exists(staged):
+        logger.warning("Файл для загрузки в хранилище не найден: %s", staged)
+        return
+    pending = File.objects.filter(id=file_id, blob__isnull=True).values('type').first()
+    if pending is None:
+        os.remove(staged)
+        return
+
+    blob = adopt_local(staged, pending['type'])
+    with transaction.atomic():
+        file_instance = File.objects.select_for_update().filter(id=file_id, blob__isnull=True).first()
+        if file_instance is None:
+            # Файл удалили, пока шла загрузка
+            release_blob(blob.id)
+            return
+        file_instance.blob = blob
+        file_instance.url.name = blob.path
+        File.objects.filter(id=file_id).update(blob=blob, url=blob.path)
+        after_upload([file_instance])
+
+
+@task('relocate_file')
+def relocate_file(file_id):
+    """
+    Переносит файл из прежней раскладки user_files/<id>/<имя> под случайный
+    ключ во вложенных каталогах (см. user_directory_path). Ставится командой relocate_user_files.
+    """
+    with transaction.atomic():
+        file_instance = File.objects.select_for_update().filter(id=file_id, blob__isnull=True).first()
+        if file_instance is None or not LEGACY_USER_PATH.match(file_instance.url.name):
+            return
+        old_name = file_instance.url.name
+        if not default_storage.exists(old_name):
+            logger.warning("Файл для переноса не найден: %s", old_name)
+            return
+
+        serializer = FileSerializer()
+        old_url = serializer.get_url(file_instance)
+        file_instance.url.name = default_storage.move(old_name, user_directory_path(file_instance, old_name))
+        File.objects.filter(id=file_id).update(url=file_instance.url.name)
+
+        # Аватары ссылаются на полный URL файла
+        CustomUser.objects.filter(avatar=old_url).update(avatar=serializer.get_url(file_instance))
+
+
+@task('generate_previews')
+def generate_previews_task(file_ids):
+    generate_previews(file_ids)
+
+
+@task('delete_blob')
+def delete_blob(blob_id):
+    delete_unreferenced_blob(blob_id)
+
+
+@task('delete_blobs')
+def delete_blobs(blob_ids):
+    delete_unreferenced_blobs(blob_ids)
+
+
+@task('delete_path')
+def delete_path(name):
+    default_storage.delete(name)
+
+
+@task('delete_paths')
+def delete_paths(names):
+    default_storage.delete_many(names)
+
+
+@task('delete_user')
+def delete_user(user_id):
+    """
+    Удаляет пользователя, отключенного DeleteUserView: файлы пакетами
+    (см. storage/bulk.py), брошенные сессии загрузки, затем саму запись —
+    журнал изменений и прочие зависимые строки удаляются каскадом.
+    Созданные пользователем ссылки на чужие файлы остаются (created_by = NULL).
+    """
+    delete_user_files(user_id)
+    for session in UploadSession.objects.filter(user_id=user_id).iterator():
+        upload_staging_storage().delete(session.path)
+    with transaction.atomic():
+        user = CustomUser.objects.filter(id=user_id).first()
+        if user is None:
+            return
+        # Загрузка, начатая до отключения, могла завершиться после первого прохода:
+        # оставшиеся файлы освобождаются в той же транзакции, что и удаление записи
+        delete_user_files(user_id)
+        user.delete()
+
+
+@task('clear_avatar')
+def clear_avatar(user_id, url):
+    # Тот же URL может остаться у другого файла пользователя с таким же содержимым
+    blob_path = url.split('/media/', 1)[-1]
+    if File.objects.filter(user_id=user_id, url=blob_path).exists():
+        return
+    CustomUser.objects.filter(id=user_id, avatar=url).update(avatar=None)
+
+
+@task('scan_file')
+def scan_file(file_id):
+    """
+    Проверяет файл внешней командой VIRUS_SCAN_COMMAND (например, clamdscan).
+    Зараженный файл удаляется, ошибка самого сканера приводит к повтору задачи.
+    """
+    if not settings.VIRUS_SCAN_COMMAND:
+        return
+    file_instance = File.objects.filter(id=file_id).first()
+    if file_instance is None:
+        return
+
+    with local_copy(file_instance.url.name) as path:
+        command = shlex.split(settings.VIRUS_SCAN_COMMAND) + [path]
+        result = subprocess.run(command, capture_output=True, text=True, timeout=settings.VIRUS_SCAN_TIMEOUT)
+    if result.returncode == VIRUS_FOUND_EXIT_CODE:
+        logger.warning("Файл %s заражен и удален: %s", file_id, result.stdout.strip())
+        file_instance.delete()
+    elif result.returncode != 0:
+        raise RuntimeError(f"Ошибка антивируса ({result.returncode}): {result.stderr.strip()}")
+
+
+@task('cleanup_orphans')
+def cleanup_orphans():
+    """
+    Периодическая уборка: брошенные сессии загрузки (с возвратом квоты),
+    блобы без ссылок, чья задача удаления потерялась, файлы блобов без записи
+    в БД (после сбоя загрузки), старые упавшие задачи и устаревшие записи
+    журнала изменений.
+    """
+    now = timezone.now()
+
+    expired = now - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    for session in UploadSession.objects.filter(updated_at__lt=expired).iterator():
+        upload_staging_storage().delete(session.path)
+        with transaction.atomic():
+            if UploadSession.objects.filter(id=session.id).delete()[0]:
+                release(session.user_id, session.file_size)
+
+    for blob_id in Blob.objects.filter(ref_count=0).values_list('id', flat=True).iterator():
+        delete_unreferenced_blob(blob_id)
+
+    deleted = delete_orphan_files(settings.BLOB_ORPHAN_GRACE_PERIOD)
+    if deleted:
+        logger.info("Удалено файлов блобов без записи в БД: %s", deleted)
+
+    Job.objects.filter(status=Job.STATUS_FAILED, created_at__lt=now - timedelta(days=30)).delete()
+
+    prune_changes()
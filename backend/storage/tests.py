@@ -1,3 +1,1493 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.sites.models import Site
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.conf import settings
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from users.models import CustomUser
+from .models import LEGACY_USER_PATH, Blob, DownloadStat, File, FileChange, Job, ShareLink, UploadSession, blob_path
+from .downloads import _take_pending, flush, record_download
+from . import ingest, tasks
+from .changes import prune_changes
+from .serializers import FileSerializer
+from .queue import TASKS, claim_jobs, enqueue, run_job, run_pending, task
+from django.core.management import call_command
+from .previews import Image, content_key, evict_cache, get_preview, preview_path
+from .usage import recalculate
+from .backends import BaseS3Storage
+from .signing import sign_download
+from .compression import zstandard
+from mycloud.metrics import Registry, RequestStats, collect, registry
+import fcntl
+import hashlib
+import importlib
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+import zipfile
+from datetime import timedelta
 
-# Create your tests here.
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:  # moto не установлен
+    mock_aws = None
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class QueryCountTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.admin = CustomUser.objects.create_user(login='admin1', fullname='Admin', password='pass', is_admin=True)
+        self.user = CustomUser.objects.create_user(login='user1', fullname='User', email='user1@test.ru', password='pass')
+        self.client = APIClient()
+
+    def create_files(self, user, count):
+        for i in range(count):
+            File.objects.create(
+                user=user,
+                file_name=f'file{i}.txt',
+                file_size=4,
+                type='text/plain',
+                url=ContentFile(b'data', name=f'file{i}.txt'),
+            )
+
+    def test_get_list_query_count_does_not_depend_on_files(self):
+        self.create_files(self.user, 30)
+        self.client.force_authenticate(self.user)
+        url = reverse('file-list', kwargs={'user_id': self.user.id})
+
+        # Файлы одним запросом + домен сайта один раз на процесс
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 30)
+
+        with self.assertNumQueries(1):
+            self.client.get(url)
+
+    def test_get_users_query_count_does_not_depend_on_files(self):
+        self.create_files(self.user, 10)
+        self.create_files(self.admin, 10)
+        self.client.force_authenticate(self.admin)
+
+        # Только пользователи: размер и количество файлов хранятся в строке пользователя
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('get-users'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['users']), CustomUser.objects.count())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FileListTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(login='list1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('file-list', kwargs={'user_id': self.user.id})
+
+    def create_file(self, name, size, file_type='text/plain'):
+        return File.objects.create(
+            user=self.user, file_name=name, file_size=size, type=file_type,
+            url=ContentFile(b'data', name=name),
+        )
+
+    def all_pages(self, **params):
+        ids = []
+        cursor = None
+        while True:
+            response = self.client.get(self.url, {'page_size': 2, **params, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.data['results']]
+            cursor = response.data['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_pages_follow_cursor_in_both_directions(self):
+        files = [self.create_file(f'f{i}.txt', size) for i, size in enumerate([5, 3, 5, 1, 9])]
+        by_size = sorted(files, key=lambda f: (f.file_size, f.id))
+
+        self.assertEqual(self.all_pages(ordering='file_size'), [f.id for f in by_size])
+        self.assertEqual(
+            self.all_pages(ordering='-file_size'),
+            [f.id for f in sorted(files, key=lambda f: (f.file_size, f.id), reverse=True)],
+        )
+        # По умолчанию новые файлы первыми
+        self.assertEqual(self.all_pages(), [f.id for f in reversed(files)])
+
+    def test_null_type_goes_last(self):
+        untyped = self.create_file('a.bin', 1)
+        text = self.create_file('b.txt', 1, file_type='text/plain')
+        image = self.create_file('c.png', 1, file_type='image/png')
+        File.objects.filter(id=untyped.id).update(type=None)
+
+        self.assertEqual(self.all_pages(ordering='type'), [image.id, text.id, untyped.id])
+        self.assertEqual(self.all_pages(ordering='-type'), [text.id, image.id, untyped.id])
+
+    def test_invalid_cursor_and_ordering(self):
+        self.create_file('a.txt', 1)
+        self.create_file('b.txt', 2)
+        self.create_file('c.txt', 3)
+        cursor = self.client.get(self.url, {'page_size': 1, 'ordering': 'file_size'}).data['next_cursor']
+
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': cursor, 'ordering': '-file_size'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'ordering': 'file_name'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'page_size': 0}).status_code, 400)
+
+    def test_filters(self):
+        text = self.create_file('a.txt', 10)
+        image = self.create_file('b.png', 100, file_type='image/png')
+        old = self.create_file('c.jpg', 1000, file_type='image/jpeg')
+        File.objects.filter(id=old.id).update(upload_date=timezone.now() - timedelta(days=10))
+
+        def ids(**params):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            return [item['id'] for item in response.data['results']]
+
+        self.assertEqual(ids(type='image/'), [image.id, old.id])
+        self.assertEqual(ids(type='text/plain'), [text.id])
+        self.assertEqual(ids(size_min=50, size_max=500), [image.id])
+        yesterday = (timezone.now() - timedelta(days=1)).date().isoformat()
+        self.assertEqual(ids(date_to=yesterday), [old.id])
+        self.assertEqual(ids(date_from=yesterday), [image.id, text.id])
+        self.assertEqual(self.client.get(self.url, {'size_min': 'x'}).status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class UploadSessionTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(login='session1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.data = b'0123456789abcdef'
+
+    def create_session(self, **data):
+        return self.client.post(
+            reverse('upload-session-create', kwargs={'user_id': self.user.id}),
+            {'file_name': 'big.bin', 'file_size': len(self.data), **data}, format='json',
+        )
+
+    def put_chunk(self, session_id, start, chunk, checksum=None):
+        end = start + len(chunk) - 1
+        return self.client.generic(
+            'PUT', reverse('upload-session', kwargs={'session_id': session_id}), chunk,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.data)}',
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(chunk).hexdigest(),
+        )
+
+    def test_resume_after_interrupted_upload(self):
+        session_id = self.create_session().data['id']
+        self.assertEqual(self.put_chunk(session_id, 0, self.data[:6]).data['offset'], 6)
+
+        # Клиент после обрыва узнает смещение и продолжает с него
+        status_response = self.client.get(reverse('upload-session', kwargs={'session_id': session_id}))
+        self.assertEqual(status_response.data['offset'], 6)
+
+        response = self.put_chunk(session_id, 0, self.data[:6])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 6)
+
+        response = self.put_chunk(session_id, 6, self.data[6:], checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['offset'], 6)
+
+        incomplete = self.client.post(reverse('upload-session-complete', kwargs={'session_id': session_id}))
+        self.assertEqual(incomplete.status_code, 409)
+
+        self.assertEqual(self.put_chunk(session_id, 6, self.data[6:]).data['offset'], len(self.data))
+        response = self.client.post(reverse('upload-session-complete', kwargs={'session_id': session_id}))
+        self.assertEqual(response.status_code, 201)
+        with File.objects.get(id=response.data['id']).url.open('rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+
+    def test_chunk_without_body_or_in_parallel_is_rejected(self):
+        session_id = self.create_session().data['id']
+        response = self.client.generic(
+            'PUT', reverse('upload-session', kwargs={'session_id': session_id}), b'',
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes 0-5/{len(self.data)}', HTTP_X_CHUNK_SHA256='0' * 64,
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # Пока чанк пишет другой запрос, файл сессии заблокирован
+        path = default_storage.path(UploadSession.objects.get(id=session_id).path)
+        with open(path, 'r+b') as busy:
+            fcntl.flock(busy.fileno(), fcntl.LOCK_EX)
+            response = self.put_chunk(session_id, 0, self.data[:6])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 0)
+        self.assertEqual(self.put_chunk(session_id, 0, self.data[:6]).data['offset'], 6)
+
+    def test_abort_releases_reserved_space(self):
+        session_id = self.create_session().data['id']
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.storage_used, len(self.data))
+
+        response = self.client.delete(reverse('upload-session', kwargs={'session_id': session_id}))
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (0, 0))
+        self.assertEqual(self.client.get(reverse('upload-session', kwargs={'session_id': session_id})).status_code, 404)
+
+    def test_session_fields_are_validated(self):
+        self.assertEqual(self.create_session(file_name='x' * 256).status_code, 400)
+        self.assertEqual(self.create_session(type='x' * 51).status_code, 400)
+        self.assertEqual(self.create_session(file_size='big').status_code, 400)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.storage_used, 0)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class StorageUsageTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(login='quota1', fullname='User', password='pass', storage_quota=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, *contents):
+        files = [SimpleUploadedFile(f'file{i}.txt', content, content_type='text/plain') for i, content in enumerate(contents)]
+        return self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}), {'file': files}, format='multipart'
+        )
+
+    def test_upload_and_delete_update_counters(self):
+        response = self.upload(b'abc', b'defg')
+        self.assertEqual(response.status_code, 201)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (7, 2))
+
+        file_id = response.data['uploaded_files'][0]['id']
+        self.client.delete(reverse('delete-file', kwargs={'user_id': self.user.id, 'file_id': file_id}))
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (4, 1))
+
+    def test_upload_over_quota_is_rejected(self):
+        self.upload(b'12345678')
+        response = self.upload(b'abc')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['uploaded_files'], [])
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (8, 1))
+        self.assertEqual(File.objects.filter(user=self.user).count(), 1)
+
+    def test_failed_file_releases_its_reservation(self):
+        prepare_blob = ingest.prepare_blob
+
+        def failing(content, content_type=''):
+            if content.name == 'file1.txt':
+                raise ValueError("сбой сжатия")
+            return prepare_blob(content, content_type)
+
+        with mock.patch.object(ingest, 'prepare_blob', failing):
+            response = self.upload(b'abc', b'defg')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(len(response.data['uploaded_files']), 1)
+        self.assertIn('file1.txt', response.data['errors'][0])
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (3, 1))
+
+    def test_batch_failure_releases_whole_reservation(self):
+        with mock.patch.object(ingest, 'acquire_blobs', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.upload(b'abc', b'defg')
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (0, 0))
+        self.assertFalse(File.objects.filter(user=self.user).exists())
+
+    def test_recalculate(self):
+        self.upload(b'abc')
+        CustomUser.objects.filter(id=self.user.id).update(storage_used=0, files_count=0)
+        recalculate(CustomUser.objects.filter(id=self.user.id))
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.storage_used, self.user.files_count), (3, 1))
+
+
+@unittest.skipUnless(Image, "Pillow не установлен")
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), PREVIEW_CACHE_DIR=tempfile.mkdtemp())
+class PreviewTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(login='preview1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, name, content, content_type):
+        response = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile(name, content, content_type=content_type)},
+            format='multipart',
+        )
+        return response.data['uploaded_files'][0]
+
+    def png(self, size=(2000, 1000)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_image_preview(self):
+        uploaded = self.upload('photo.png', self.png(), 'image/png')
+        self.assertIsNotNone(uploaded['preview_url'])
+        url = reverse('preview-file', kwargs={'file_id': uploaded['id']})
+
+        response = self.client.get(url, {'size': 'small'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as preview:
+            self.assertEqual(preview.size, (256, 128))
+
+        response = self.client.get(url, {'size': 'small'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_no_preview_for_other_types(self):
+        uploaded = self.upload('notes.txt', b'text', 'text/plain')
+        self.assertIsNone(uploaded['preview_url'])
+        response = self.client.get(reverse('preview-file', kwargs={'file_id': uploaded['id']}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_eviction_removes_least_recently_used(self):
+        old = self.upload('old.png', self.png((300, 300)), 'image/png')
+        new = self.upload('new.png', self.png((400, 300)), 'image/png')
+        old_file, new_file = File.objects.select_related('blob').filter(id__in=[old['id'], new['id']]).order_by('id')
+        get_preview(old_file, 'small').close()
+        get_preview(new_file, 'small').close()
+        old_path = preview_path(content_key(old_file), 'small')
+        new_path = preview_path(content_key(new_file), 'small')
+        os.utime(old_path, (1, 1))
+
+        evict_cache(max_size=os.path.getsize(new_path) * 2)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(new_path))
+
+    def test_preview_survives_eviction_by_another_process(self):
+        uploaded = self.upload('photo.png', self.png((300, 300)), 'image/png')
+        file_instance = File.objects.select_related('blob').get(id=uploaded['id'])
+        get_preview(file_instance, 'small').close()
+        with get_preview(file_instance, 'small') as preview:
+            evict_cache(max_size=0)
+            self.assertFalse(os.path.exists(preview_path(content_key(file_instance), 'small')))
+            with Image.open(preview) as image:
+                self.assertEqual(image.size, (256, 256))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FileDeliveryTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(login='delivery1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile('report.txt', b'delivered', content_type='text/plain')},
+            format='multipart',
+        )
+        self.file = File.objects.get(id=response.data['uploaded_files'][0]['id'])
+        self.url = reverse('download-file', kwargs={'file_id': self.file.id})
+
+    @override_settings(FILE_DELIVERY_BACKEND='django')
+    def test_django_serves_content(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'delivered')
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(FILE_DELIVERY_BACKEND='nginx', FILE_DELIVERY_NGINX_PREFIX='/protected-media/')
+    def test_nginx_gets_internal_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.file.url.name)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertIn('report.txt', response['Content-Disposition'])
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_DELIVERY_BACKEND='apache')
+    def test_apache_gets_sendfile_path(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], self.file.url.path)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(FILE_DELIVERY_BACKEND='django')
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-3/9')
+        self.assertEqual(b''.join(response.streaming_content), b'deli')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'red')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-30')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */9')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,4-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(b'Content-Range: bytes 0-1/9\r\n\r\nde\r\n', body)
+        self.assertIn(b'Content-Range: bytes 4-5/9\r\n\r\nve\r\n', body)
+
+    @override_settings(FILE_DELIVERY_BACKEND='django')
+    def test_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+        # Файл изменился с момента первого ответа: отдается целиком
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'delivered')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), FILE_DELIVERY_BACKEND='django')
+class DownloadStatsTests(TestCase):
+
+    def setUp(self):
+        # Скачивания, оставшиеся в памяти процесса от других тестов
+        _take_pending()
+        self.user = CustomUser.objects.create_user(login='stats1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.first, self.second = (
+            File.objects.create(
+                user=self.user, file_name=name, file_size=4, type='text/plain', url=ContentFile(b'data', name=name),
+            )
+            for name in ('a.txt', 'b.txt')
+        )
+
+    def stats(self):
+        return {
+            (stat.file_id, stat.date): stat.count
+            for stat in DownloadStat.objects.filter(file__user=self.user)
+        }
+
+    def test_flush_updates_counters_and_upserts_daily_stats(self):
+        now = timezone.now()
+        yesterday = now - timedelta(days=1)
+        today, day_before = timezone.localdate(now), timezone.localdate(yesterday)
+        record_download(self.first.id, when=yesterday)
+        record_download(self.first.id, when=now)
+        record_download(self.first.id, when=now)
+        record_download(self.second.id, when=now)
+        deleted = File.objects.create(
+            user=self.user, file_name='c.txt', file_size=4, type='text/plain', url=ContentFile(b'data', name='c.txt'),
+        )
+        record_download(deleted.id, when=now)
+        File.objects.filter(id=deleted.id).delete()
+
+        self.assertEqual(flush(), 4)
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.download_count, self.first.last_downloaded), (3, now))
+        self.assertEqual(self.stats(), {
+            (self.first.id, day_before): 1, (self.first.id, today): 2, (self.second.id, today): 1,
+        })
+
+        # Повторный сброс дописывает к существующим дневным строкам
+        record_download(self.first.id, when=now)
+        self.assertEqual(flush(), 1)
+        self.assertEqual(flush(), 0)
+        self.assertEqual(self.stats()[(self.first.id, today)], 3)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.download_count, 4)
+
+    def test_only_new_downloads_are_counted(self):
+        url = reverse('download-file', kwargs={'file_id': self.first.id})
+        etag = self.client.get(url)['ETag']
+        self.client.get(url, HTTP_RANGE='bytes=0-1')
+        # Докачка, ответ 304 и HEAD не считаются отдельными скачиваниями
+        self.client.get(url, HTTP_RANGE='bytes=2-3')
+        self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(self.client.head(url).status_code, 200)
+
+        link = ShareLink.objects.create(file=self.first, created_by=self.user, max_downloads=1)
+        shared_url = reverse('shared-download', kwargs={'token': link.token})
+        self.assertEqual(APIClient().head(shared_url).status_code, 200)
+        link.refresh_from_db()
+        self.assertEqual(link.download_count, 0)
+
+        self.assertEqual(flush(), 2)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.download_count, 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), FILE_DELIVERY_BACKEND='django')
+class AsyncViewsTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='async1', fullname='User', password='pass')
+        self.access = APIClient().post(
+            reverse('token-obtain'), {'login': 'async1', 'password': 'pass'}, format='json',
+        ).data['access']
+
+    async def upload_list_download(self, headers=None):
+        response = await self.async_client.post(
+            reverse('async-file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile('async.txt', b'async content', content_type='text/plain')},
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        file_id = response.json()['uploaded_files'][0]['id']
+
+        response = await self.async_client.get(reverse('async-file-list', kwargs={'user_id': self.user.id}), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [file_id])
+
+        response = await self.async_client.get(reverse('async-download-file', kwargs={'file_id': file_id}), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'async content')
+
+        response = await self.async_client.get(
+            reverse('async-download-file', kwargs={'file_id': file_id}), headers={**(headers or {}), 'Range': 'bytes=6-12'},
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'content')
+
+    async def test_session_auth(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        await self.upload_list_download()
+
+    async def test_jwt_auth(self):
+        await self.upload_list_download({'Authorization': f'Bearer {self.access}'})
+
+    async def test_csrf_is_checked_only_for_session(self):
+        client = AsyncClient(enforce_csrf_checks=True)
+        url = reverse('async-file-upload', kwargs={'user_id': self.user.id})
+        upload = lambda **kwargs: client.post(
+            url, {'file': SimpleUploadedFile('a.txt', b'csrf', content_type='text/plain')}, **kwargs,
+        )
+
+        response = await upload(headers={'Authorization': f'Bearer {self.access}'})
+        self.assertEqual(response.status_code, 201)
+
+        await sync_to_async(client.force_login)(self.user)
+        response = await upload()
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF', response.json()['detail'])
+
+        token = (await client.get(reverse('csrf_token'))).json()['csrfToken']
+        response = await upload(headers={'X-CSRFToken': token})
+        self.assertEqual(response.status_code, 201)
+
+    async def test_requires_authentication(self):
+        list_url = reverse('async-file-list', kwargs={'user_id': self.user.id})
+        self.assertEqual((await self.async_client.get(list_url)).status_code, 403)
+        response = await self.async_client.get(list_url, headers={'Authorization': 'Bearer invalid'})
+        self.assertEqual(response.status_code, 403)
+
+        other = await CustomUser.objects.acreate(login='async2', fullname='Other')
+        response = await self.async_client.get(
+            reverse('async-file-list', kwargs={'user_id': other.id}), headers={'Authorization': f'Bearer {self.access}'},
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), JOB_RETRY_DELAY=0)
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(login='jobs1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_delete_removes_blob_file_in_background(self):
+        response = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile('a.txt', b'background', content_type='text/plain')},
+            format='multipart',
+        )
+        file_instance = File.objects.get(id=response.data['uploaded_files'][0]['id'])
+        path = file_instance.url.path
+
+        self.client.delete(reverse('delete-file', kwargs={'user_id': self.user.id, 'file_id': file_instance.id}))
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(Job.objects.filter(kind='delete_blob').exists())
+
+        run_pending()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_reupload_before_cleanup_keeps_blob(self):
+        url = reverse('file-upload', kwargs={'user_id': self.user.id})
+        upload = lambda: self.client.post(
+            url, {'file': SimpleUploadedFile('a.txt', b'same', content_type='text/plain')}, format='multipart'
+        ).data['uploaded_files'][0]['id']
+
+        first = upload()
+        self.client.delete(reverse('delete-file', kwargs={'user_id': self.user.id, 'file_id': first}))
+        second = upload()
+        run_pending()
+
+        file_instance = File.objects.get(id=second)
+        self.assertTrue(os.path.exists(file_instance.url.path))
+        self.assertEqual(file_instance.blob.ref_count, 1)
+
+    def test_user_deletion_releases_blobs(self):
+        other = CustomUser.objects.create_user(login='jobs2', fullname='Other', password='pass')
+        url = reverse('file-upload', kwargs={'user_id': self.user.id})
+        self.client.post(url, {'file': SimpleUploadedFile('a.txt', b'shared', content_type='text/plain')}, format='multipart')
+        self.client.post(url, {'file': SimpleUploadedFile('b.txt', b'own', content_type='text/plain')}, format='multipart')
+        self.client.force_authenticate(other)
+        self.client.post(
+            reverse('file-upload', kwargs={'user_id': other.id}),
+            {'file': SimpleUploadedFile('a.txt', b'shared', content_type='text/plain')}, format='multipart',
+        )
+        shared = Blob.objects.get(sha256=hashlib.sha256(b'shared').hexdigest())
+        own = Blob.objects.get(sha256=hashlib.sha256(b'own').hexdigest())
+        own_path = default_storage.path(own.path)
+        self.assertEqual(shared.ref_count, 2)
+
+        # Удаление в обход API: файлы удаляются каскадом
+        self.user.delete()
+        shared.refresh_from_db()
+        own.refresh_from_db()
+        self.assertEqual((shared.ref_count, own.ref_count), (1, 0))
+
+        run_pending()
+        self.assertFalse(Blob.objects.filter(id=own.id).exists())
+        self.assertFalse(os.path.exists(own_path))
+        self.assertTrue(Blob.objects.filter(id=shared.id).exists())
+
+    def test_cleanup_removes_orphan_blob_files(self):
+        response = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile('a.txt', b'referenced', content_type='text/plain')},
+            format='multipart',
+        )
+        referenced = File.objects.get(id=response.data['uploaded_files'][0]['id']).url.path
+
+        def orphan(content, old=True):
+            path = default_storage.path(blob_path(hashlib.sha256(content).hexdigest()))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as target:
+                target.write(content)
+            if old:
+                os.utime(path, (1, 1))
+            return path
+
+        # Файлы остались от откатившейся загрузки; свежий может еще получить запись
+        stale = orphan(b'stale')
+        fresh = orphan(b'fresh', old=False)
+        leftover = os.path.join(os.path.dirname(stale), 'tmp1234.tmp')
+        with open(leftover, 'wb') as target:
+            target.write(b'partial')
+        os.utime(leftover, (1, 1))
+        os.utime(referenced, (1, 1))
+
+        enqueue('cleanup_orphans')
+        run_pending()
+        self.assertFalse(os.path.exists(stale))
+        self.assertFalse(os.path.exists(leftover))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(referenced))
+        self.assertEqual(Blob.objects.count(), 1)
+
+    def test_chunked_upload_is_hashed_by_worker(self):
+        data = b'chunked content'
+        session = self.client.post(
+            reverse('upload-session-create', kwargs={'user_id': self.user.id}),
+            {'file_name': 'big.bin', 'file_size': len(data)}, format='json',
+        ).data
+        url = reverse('upload-session', kwargs={'session_id': session['id']})
+        self.client.generic(
+            'PUT', url, data, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes 0-{len(data) - 1}/{len(data)}',
+            HTTP_X_CHUNK_SHA256=hashlib.sha256(data).hexdigest(),
+        )
+        response = self.client.post(reverse('upload-session-complete', kwargs={'session_id': session['id']}))
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(File.objects.get(id=response.data['id']).blob)
+
+        run_pending()
+        file_instance = File.objects.get(id=response.data['id'])
+        self.assertEqual(file_instance.blob.sha256, hashlib.sha256(data).hexdigest())
+        with file_instance.url.open('rb') as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_failed_job_is_retried_then_marked_failed(self):
+        calls = []
+
+        @task('test_failing')
+        def failing():
+            calls.append(1)
+            raise RuntimeError('boom')
+
+        self.addCleanup(TASKS.pop, 'test_failing')
+
+        enqueue('test_failing')
+        with override_settings(JOB_MAX_ATTEMPTS=3), self.assertLogs('storage', 'ERROR'):
+            run_pending()
+        job = Job.objects.get(kind='test_failing')
+        self.assertEqual((job.status, job.attempts, len(calls)), (Job.STATUS_FAILED, 3, 3))
+        self.assertIn('boom', job.last_error)
+
+    def test_stopped_worker_returns_unstarted_jobs(self):
+        @task('test_stop')
+        def stop():
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        self.addCleanup(TASKS.pop, 'test_stop')
+
+        stopping = enqueue('test_stop')
+        rest = [enqueue('test_stop'), enqueue('test_stop')]
+        call_command('run_worker', batch=3, once=True)
+
+        self.assertFalse(Job.objects.filter(id=stopping.id).exists())
+        for job in Job.objects.filter(id__in=[job.id for job in rest]):
+            self.assertEqual((job.status, job.attempts, job.locked_at), (Job.STATUS_PENDING, 0, None))
+
+
+class JobHeartbeatTests(TransactionTestCase):
+
+    @override_settings(JOB_HEARTBEAT_INTERVAL=0.05)
+    def test_running_job_keeps_its_lock_fresh(self):
+        seen = []
+
+        @task('test_long')
+        def long_job(job_id):
+            time.sleep(0.5)
+            seen.append(Job.objects.get(id=job_id).locked_at)
+
+        self.addCleanup(TASKS.pop, 'test_long')
+
+        job = enqueue('test_long', job_id=0)
+        Job.objects.filter(id=job.id).update(payload={'job_id': job.id})
+        claimed = claim_jobs(1)[0]
+        self.assertTrue(run_job(claimed))
+        self.assertGreater(seen[0], claimed.locked_at)
+
+
+class BenchmarkCommandTests(SimpleTestCase):
+
+    def test_bench_storage_smoke(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            # Команда поднимает собственную тестовую БД, поэтому запускается отдельным процессом
+            result = subprocess.run(
+                [
+                    sys.executable, 'manage.py', 'bench_storage', '--users', '2', '--files', '3', '--distinct', '2',
+                    '--requests', '4', '--concurrency', '2', '--upload-size', '1024', '--output', output,
+                ],
+                cwd=settings.BASE_DIR, env={**os.environ, 'DB_ENGINE': 'sqlite'},
+                capture_output=True, text=True, timeout=300,
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            with open(output) as fp:
+                report = json.load(fp)
+
+        self.assertEqual(report['parameters']['users'], 2)
+        for scenario in report['results']:
+            self.assertEqual((scenario['requests'], scenario['errors']), (4, 0), scenario['name'])
+            self.assertIn('rss_growth_kb', scenario)
+            self.assertIn('p99_ms', scenario)
+
+
+class RequestMetricsTests(TestCase):
+
+    def setUp(self):
+        registry.clear()
+        self.admin = CustomUser.objects.create_user(login='metrics1', fullname='Admin', password='pass', is_admin=True)
+        self.client = APIClient()
+        self.client.force_login(self.admin)
+
+    def test_request_is_counted_with_db_queries(self):
+        self.client.get(reverse('file-list', kwargs={'user_id': self.admin.id}))
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('http_requests_total{view="file-list",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="file-list",method="GET",le="+Inf"} 1', body)
+        queries = [line for line in body.splitlines() if line.startswith('db_queries_total{view="file-list"')]
+        self.assertEqual(len(queries), 1)
+        self.assertGreater(int(queries[0].rsplit(' ', 1)[1]), 0)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_require_admin_or_token(self):
+        client = APIClient()
+        self.assertEqual(client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_snapshots_of_finished_processes_are_folded_into_dead_file(self):
+        directory = tempfile.mkdtemp()
+        finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished.wait()
+        with override_settings(METRICS_DIR=directory):
+            with open(os.path.join(directory, f'{finished.pid}_old.json'), 'w') as fp:
+                json.dump([['http_requests_total', [['view', 'x'], ['method', 'GET'], ['status', '200']], 5]], fp)
+            key = ('http_requests_total', (('view', 'x'), ('method', 'GET'), ('status', '200')))
+
+            self.assertEqual(collect()[key], 5)
+            self.assertNotIn(f'{finished.pid}_old.json', os.listdir(directory))
+            self.assertIn('dead.json', os.listdir(directory))
+
+            # Завершение процесса: его снимок тоже уходит в dead.json, счетчик не уменьшается
+            worker = Registry()
+            worker.observe('x', 'GET', 200, 0.01, 0, 0, RequestStats(), False)
+            worker.flush()
+            self.assertEqual(collect()[key], 6)
+            worker._close(os.getpid())
+            self.assertNotIn(worker.file_name(), os.listdir(directory))
+            self.assertEqual(collect()[key], 6)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DownloadLinkTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='links1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile('report.txt', b'link content', content_type='text/plain')},
+            format='multipart',
+        )
+        self.file = File.objects.get(id=response.data['uploaded_files'][0]['id'])
+
+    def test_signed_link_from_list_is_served_without_db(self):
+        results = self.client.get(reverse('file-list', kwargs={'user_id': self.user.id})).data['results']
+        path = results[0]['download_url'].split('testserver', 1)[-1]
+
+        anonymous = APIClient()
+        with self.assertNumQueries(0):
+            response = anonymous.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'link content')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    def test_tampered_and_expired_links_are_rejected(self):
+        token = sign_download(self.file)
+        tampered = reverse('signed-download', kwargs={'token': token[:-1] + ('A' if token[-1] != 'A' else 'B')})
+        self.assertEqual(self.client.get(tampered).status_code, 403)
+
+        expired = reverse('signed-download', kwargs={'token': sign_download(self.file, ttl=-1)})
+        self.assertEqual(self.client.get(expired).status_code, 410)
+
+    def test_share_link_download_limit_and_revoke(self):
+        response = self.client.post(
+            reverse('file-share-links', kwargs={'file_id': self.file.id}), {'max_downloads': 2}, format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        token = response.data['token']
+        url = reverse('shared-download', kwargs={'token': token})
+
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get(url).status_code, 200)
+        # Докачка не расходует лимит
+        self.assertEqual(anonymous.get(url, HTTP_RANGE='bytes=5-').status_code, 206)
+        self.assertEqual(anonymous.get(url).status_code, 200)
+        self.assertEqual(anonymous.get(url).status_code, 410)
+        self.assertEqual(ShareLink.objects.get(token=token).download_count, 2)
+
+        other = CustomUser.objects.create_user(login='links2', fullname='Other', password='pass')
+        stranger = APIClient()
+        stranger.force_authenticate(other)
+        self.assertEqual(stranger.delete(reverse('share-link', kwargs={'token': token})).status_code, 404)
+        self.assertEqual(self.client.delete(reverse('share-link', kwargs={'token': token})).status_code, 204)
+        self.assertEqual(anonymous.get(url).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class UserFilesLayoutTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='layout1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_file(self, name, content):
+        return File.objects.create(
+            user=self.user, file_name=name, file_size=len(content), type='text/plain',
+            url=ContentFile(content, name=name),
+        )
+
+    def test_same_names_get_distinct_sharded_keys(self):
+        first = self.create_file('report.txt', b'first')
+        second = self.create_file('report.txt', b'second')
+
+        self.assertNotEqual(first.url.name, second.url.name)
+        for file_instance in (first, second):
+            self.assertRegex(file_instance.url.name, r'^user_files/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}$')
+            self.assertEqual(file_instance.download_name, 'report.txt')
+
+    def test_rename_changes_only_database(self):
+        file_instance = self.create_file('report.txt', b'content')
+        name = file_instance.url.name
+
+        response = self.client.patch(
+            reverse('update_file', kwargs={'file_id': file_instance.id}), {'new_name': 'summary'}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        file_instance.refresh_from_db()
+        self.assertEqual(file_instance.file_name, 'summary.txt')
+        self.assertEqual(file_instance.url.name, name)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_legacy_files_are_relocated_by_worker(self):
+        legacy_name = f'user_files/{self.user.id}/old.txt'
+        default_storage.save(legacy_name, ContentFile(b'legacy'))
+        file_instance = File.objects.create(
+            user=self.user, file_name='old.txt', file_size=6, type='text/plain', url=legacy_name,
+        )
+        old_url = FileSerializer().get_url(file_instance)
+        CustomUser.objects.filter(id=self.user.id).update(avatar=old_url)
+
+        call_command('relocate_user_files', stdout=io.StringIO())
+        run_pending()
+
+        file_instance.refresh_from_db()
+        self.assertFalse(LEGACY_USER_PATH.match(file_instance.url.name))
+        self.assertFalse(default_storage.exists(legacy_name))
+        with default_storage.open(file_instance.url.name) as stored:
+            self.assertEqual(stored.read(), b'legacy')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar, FileSerializer().get_url(file_instance))
+
+    def test_legacy_names_migration_fills_only_empty_names(self):
+        migration = importlib.import_module('storage.migrations.0009_legacy_file_names')
+        renamed = File.objects.create(
+            user=self.user, file_name='report.pdf', file_size=1, type='application/pdf',
+            url=f'user_files/{self.user.id}/report_AbC123x.pdf',
+        )
+        unnamed = File.objects.create(
+            user=self.user, file_name='x', file_size=1, type='text/plain', url=f'user_files/{self.user.id}/notes.txt',
+        )
+        File.objects.filter(id=unnamed.id).update(file_name='')
+
+        migration.fill_empty_names(django_apps, None)
+
+        renamed.refresh_from_db()
+        unnamed.refresh_from_db()
+        self.assertEqual(renamed.file_name, 'report.pdf')
+        self.assertEqual(unnamed.file_name, 'notes.txt')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FileSearchTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='search1', fullname='User', password='pass')
+        self.other = CustomUser.objects.create_user(login='search2', fullname='Other', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_file(self, user, name, comment='', file_type='text/plain'):
+        return File.objects.create(
+            user=user, file_name=name, file_size=4, type=file_type, comment=comment,
+            url=ContentFile(b'data', name=name),
+        )
+
+    def search(self, query, **params):
+        return self.client.get(reverse('file-search', kwargs={'user_id': self.user.id}), {'q': query, **params})
+
+    def test_search_is_ranked_and_scoped_to_user(self):
+        by_comment = self.create_file(self.user, 'notes.txt', comment='квартальный отчет')
+        by_name = self.create_file(self.user, 'отчет 2024.pdf', file_type='application/pdf')
+        self.create_file(self.user, 'photo.jpg', file_type='image/jpeg')
+        self.create_file(self.other, 'отчет.txt')
+
+        response = self.search('отчет')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['results']], [by_name.id, by_comment.id])
+
+        self.assertEqual(len(self.search('jpeg').data['results']), 1)
+        self.assertEqual(self.search('').status_code, 400)
+        other_url = reverse('file-search', kwargs={'user_id': self.other.id})
+        self.assertEqual(self.client.get(other_url, {'q': 'отчет'}).status_code, 403)
+
+    def test_search_pages_follow_cursor(self):
+        for i in range(5):
+            self.create_file(self.user, f'report{i}.txt')
+
+        seen = []
+        cursor = None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            data = self.search('report', **params).data
+            seen += [item['id'] for item in data['results']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(sorted(seen), sorted(File.objects.filter(user=self.user).values_list('id', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', "поиск по tsvector и триграммам есть только в PostgreSQL")
+    def test_postgresql_search_uses_vector_and_trigrams(self):
+        by_prefix = self.create_file(self.user, 'отчет 2024.pdf', file_type='application/pdf')
+        by_comment = self.create_file(self.user, 'scan.png', comment='договор аренды', file_type='image/png')
+        self.create_file(self.user, 'photo.jpg', file_type='image/jpeg')
+
+        self.assertEqual([item['id'] for item in self.search('отч').data['results']], [by_prefix.id])
+        self.assertEqual([item['id'] for item in self.search('аренд').data['results']], [by_comment.id])
+        # Подстрока внутри слова находится по ILIKE с триграммным индексом
+        self.assertEqual([item['id'] for item in self.search('чет 20').data['results']], [by_prefix.id])
+
+        # Генерируемая колонка обновляется вместе с комментарием
+        File.objects.filter(id=by_comment.id).update(comment='счет')
+        self.assertEqual(self.search('аренд').data['results'], [])
+        self.assertEqual([item['id'] for item in self.search('счет').data['results']], [by_comment.id])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FileChangesTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='changes1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('file-changes', kwargs={'user_id': self.user.id})
+
+    def make_changes(self):
+        uploaded = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': [
+                SimpleUploadedFile('a.txt', b'first', content_type='text/plain'),
+                SimpleUploadedFile('b.txt', b'second', content_type='text/plain'),
+            ]},
+            format='multipart',
+        ).data['uploaded_files']
+        first, second = (item['id'] for item in uploaded)
+        self.client.patch(
+            reverse('update_file', kwargs={'file_id': first}), {'new_name': 'renamed', 'comment': 'note'}, format='json',
+        )
+        self.client.delete(reverse('delete-file', kwargs={'user_id': self.user.id, 'file_id': second}))
+        return first, second
+
+    def test_changes_since_return_only_deltas(self):
+        self.assertEqual(self.client.get(self.url).data['next_since'], 0)
+        first, second = self.make_changes()
+
+        data = self.client.get(self.url, {'since': 0}).data
+        self.assertEqual(
+            [(change['seq'], change['kind'], change['file_id']) for change in data['changes']],
+            [(1, 'create', first), (2, 'create', second), (3, 'rename', first), (4, 'comment', first), (5, 'delete', second)],
+        )
+        self.assertEqual(data['changes'][2]['data'], {'file_name': 'renamed.txt'})
+        self.assertEqual(data['next_since'], 5)
+        self.assertFalse(data['has_more'])
+
+        data = self.client.get(self.url, {'since': 3, 'page_size': 1}).data
+        self.assertEqual([change['seq'] for change in data['changes']], [4])
+        self.assertTrue(data['has_more'])
+        self.assertEqual(self.client.get(self.url).data['next_since'], 5)
+        self.assertEqual(self.client.get(self.url, {'since': 5}).data['changes'], [])
+
+    def test_pruned_journal_requires_full_sync(self):
+        self.make_changes()
+        FileChange.objects.update(created_at=timezone.now() - timedelta(days=365))
+        prune_changes()
+
+        # Последняя запись пользователя остается, чтобы клиент узнал о пропуске
+        self.assertEqual(list(FileChange.objects.values_list('seq', flat=True)), [5])
+        self.assertEqual(self.client.get(self.url, {'since': 2}).status_code, 410)
+        self.assertEqual(self.client.get(self.url, {'since': 4}).status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='archive1', fullname='User', password='pass')
+        self.other = CustomUser.objects.create_user(login='archive2', fullname='Other', password='pass')
+        self.admin = CustomUser.objects.create_user(login='archive3', fullname='Admin', password='pass', is_admin=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_file(self, user, name, content, file_type):
+        return File.objects.create(
+            user=user, file_name=name, file_size=len(content), type=file_type,
+            url=ContentFile(content, name=name),
+        )
+
+    def read_archive(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_archive_of_selected_files(self):
+        text = self.create_file(self.user, 'notes.txt', b'hello ' * 1000, 'text/plain')
+        photo = self.create_file(self.user, 'photo.jpg', b'\xff\xd8jpeg', 'image/jpeg')
+        same_name = self.create_file(self.user, 'notes.txt', b'second', 'text/plain')
+
+        ids = f'{text.id},{photo.id},{same_name.id}'
+        archive = self.read_archive(self.client.get(reverse('download-archive'), {'ids': ids}))
+        self.assertEqual(archive.namelist(), ['notes.txt', 'photo.jpg', 'notes (2).txt'])
+        self.assertEqual(archive.read('notes.txt'), b'hello ' * 1000)
+        self.assertEqual(archive.read('notes (2).txt'), b'second')
+        self.assertEqual(archive.getinfo('notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo('photo.jpg').compress_type, zipfile.ZIP_STORED)
+        self.assertIsNone(archive.testzip())
+
+        response = self.client.post(reverse('download-archive'), {'ids': [photo.id]}, format='json')
+        self.assertEqual(self.read_archive(response).namelist(), ['photo.jpg'])
+
+    def test_archive_permissions(self):
+        own = self.create_file(self.user, 'own.txt', b'own', 'text/plain')
+        foreign = self.create_file(self.other, 'foreign.txt', b'foreign', 'text/plain')
+        url = reverse('download-archive')
+
+        self.assertEqual(self.client.get(url, {'ids': f'{own.id},{foreign.id}'}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'ids': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(url, {'user_id': self.other.id}).status_code, 403)
+
+        archive = self.read_archive(self.client.get(url, {'user_id': self.user.id}))
+        self.assertEqual(archive.namelist(), ['own.txt'])
+
+        self.client.force_authenticate(self.admin)
+        archive = self.read_archive(self.client.get(url, {'user_id': self.other.id}))
+        self.assertEqual(archive.read('foreign.txt'), b'foreign')
+
+
+@unittest.skipUnless(zstandard, "zstandard не установлен")
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), STORAGE_COMPRESSION=True)
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='compress1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, name, content, content_type):
+        response = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile(name, content, content_type=content_type)},
+            format='multipart',
+        )
+        return File.objects.select_related('blob').get(id=response.data['uploaded_files'][0]['id'])
+
+    def test_compressible_files_are_stored_compressed(self):
+        rows = b''.join(b'%d,user%d,2024-01-01,active\n' % (i, i % 50) for i in range(5000))
+        table = self.upload('table.csv', rows, 'text/csv')
+        self.assertTrue(table.blob.path.endswith('.zst'))
+        self.assertEqual(table.blob.size, len(rows))
+        self.assertLess(table.blob.stored_size * 5, len(rows))
+        self.assertEqual(os.path.getsize(default_storage.path(table.blob.path)), table.blob.stored_size)
+
+        # Несжимаемое содержимое и уже сжатые форматы хранятся как есть
+        noise = self.upload('noise.bin', os.urandom(64 * 1024), 'application/octet-stream')
+        photo = self.upload('photo.jpg', b'\xff\xd8' + rows, 'image/jpeg')
+        for file_instance in (noise, photo):
+            self.assertFalse(file_instance.blob.path.endswith('.zst'))
+            self.assertEqual(file_instance.blob.stored_size, file_instance.blob.size)
+
+        # Повторная загрузка находит сжатый блоб
+        again = self.upload('copy.csv', rows, 'text/csv')
+        self.assertEqual(again.blob_id, table.blob_id)
+
+    def test_download_negotiates_encoding(self):
+        rows = b'level=info message="request handled"\n' * 2000
+        file_instance = self.upload('app.log', rows, 'text/plain')
+        url = reverse('download-file', kwargs={'file_id': file_instance.id})
+
+        encoded = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, zstd')
+        self.assertEqual(encoded['Content-Encoding'], 'zstd')
+        self.assertIn('Accept-Encoding', encoded['Vary'])
+        body = b''.join(encoded.streaming_content)
+        self.assertLess(len(body), len(rows))
+        self.assertEqual(zstandard.ZstdDecompressor().decompress(body), rows)
+
+        plain = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, zstd;q=0')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(plain['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(plain.streaming_content), rows)
+        self.assertNotEqual(plain['ETag'], encoded['ETag'])
+
+        archive_url = reverse('download-archive')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(self.client.get(archive_url, {'ids': file_instance.id}).streaming_content)))
+        self.assertEqual(archive.read('app.log'), rows)
+
+    def test_url_of_compressed_file_is_permanent_and_decompressed(self):
+        rows = b'level=info message="request handled"\n' * 2000
+        file_instance = self.upload('app.log', rows, 'text/plain')
+        url = FileSerializer(file_instance).data['url']
+        self.assertTrue(url.endswith(f'/api/media/{file_instance.url.name}'))
+        # Ссылка не зависит от времени выдачи: по ней сравниваются аватары
+        self.assertEqual(FileSerializer(file_instance).data['url'], url)
+
+        client = APIClient()
+        path = url.split('testserver', 1)[-1]
+        response = client.get(path)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(rows))
+        self.assertEqual(b''.join(response.streaming_content), rows)
+
+        partial = client.get(path, HTTP_RANGE='bytes=40000-40099')
+        self.assertEqual(partial.status_code, 206)
+        self.assertEqual(partial['Content-Range'], f'bytes 40000-40099/{len(rows)}')
+        self.assertEqual(b''.join(partial.streaming_content), rows[40000:40100])
+        self.assertEqual(client.get(path, HTTP_RANGE=f'bytes={len(rows)}-').status_code, 416)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BulkOperationsTests(TestCase):
+
+    def setUp(self):
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='bulk1', fullname='User', password='pass')
+        self.other = CustomUser.objects.create_user(login='bulk2', fullname='Other', password='pass')
+        self.admin = CustomUser.objects.create_user(login='bulk3', fullname='Admin', password='pass', is_admin=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, user, *contents):
+        self.client.force_authenticate(user)
+        files = [SimpleUploadedFile(f'file{i}.txt', content, content_type='text/plain') for i, content in enumerate(contents)]
+        response = self.client.post(reverse('file-upload', kwargs={'user_id': user.id}), {'file': files}, format='multipart')
+        self.client.force_authenticate(self.user)
+        return [item['id'] for item in response.data['uploaded_files']]
+
+    def counters(self, user):
+        user.refresh_from_db()
+        return user.storage_used, user.files_count
+
+    def test_bulk_delete_is_set_based(self):
+        small = self.upload(self.user, b'a', b'bb')
+        large = self.upload(self.user, *[b'content %d' % i for i in range(8)] + [b'a'])
+        legacy = File.objects.create(user=self.user, file_name='old.txt', file_size=3, type='text/plain', url=ContentFile(b'old', name='old.txt'))
+        recalculate(CustomUser.objects.filter(id=self.user.id))
+        foreign = self.upload(self.other, b'foreign')
+
+        url = reverse('bulk-delete')
+        self.assertEqual(self.client.post(url, {'ids': small + foreign}, format='json').status_code, 404)
+        self.assertEqual(File.objects.filter(id__in=small + foreign).count(), 3)
+
+        # Число запросов не зависит от размера пакета
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.post(url, {'ids': small}, format='json')
+        self.assertEqual(response.data, {'deleted': 2})
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.post(url, {'ids': large + [legacy.id]}, format='json')
+        self.assertEqual(response.data, {'deleted': 10})
+        self.assertLessEqual(len(many), len(few) + 1)
+
+        self.assertEqual(self.counters(self.user), (0, 0))
+        self.assertFalse(File.objects.filter(user=self.user).exists())
+        self.assertEqual(FileChange.objects.filter(user=self.user, kind=FileChange.KIND_DELETE).count(), 12)
+
+        blob_paths = list(Blob.objects.exclude(files__user=self.other).values_list('path', flat=True))
+        run_pending()
+        self.assertFalse(Blob.objects.exclude(files__user=self.other).exists())
+        for name in blob_paths + [legacy.url.name]:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_bulk_move_and_comment(self):
+        ids = self.upload(self.user, b'one', b'three')
+        url = reverse('bulk-move')
+        self.assertEqual(self.client.post(url, {'ids': ids, 'user_id': self.other.id}, format='json').status_code, 403)
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(url, {'ids': ids, 'user_id': self.other.id}, format='json')
+        self.assertEqual(response.data, {'moved': 2})
+        self.assertEqual(self.counters(self.user), (0, 0))
+        self.assertEqual(self.counters(self.other), (8, 2))
+        self.assertEqual(File.objects.filter(user=self.other).count(), 2)
+        self.assertEqual(FileChange.objects.filter(user=self.other, kind=FileChange.KIND_CREATE).count(), 2)
+
+        self.other.storage_quota = 10
+        self.other.save()
+        extra = self.upload(self.user, b'0123456789')
+        self.client.force_authenticate(self.admin)
+        response = self.client.post(url, {'ids': extra, 'user_id': self.other.id}, format='json')
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(File.objects.get(id=extra[0]).user_id, self.user.id)
+
+        response = self.client.post(reverse('bulk-comment'), {'ids': ids, 'comment': 'архив'}, format='json')
+        self.assertEqual(response.data, {'updated': 2})
+        self.assertEqual(set(File.objects.filter(id__in=ids).values_list('comment', flat=True)), {'архив'})
+
+    def test_user_deletion_runs_in_background(self):
+        ids = self.upload(self.user, b'one', b'two')
+        shared = self.upload(self.other, b'one')
+        self.client.force_authenticate(self.admin)
+
+        response = self.client.delete(reverse('delete-user', kwargs={'user_id': self.user.id}))
+        self.assertEqual(response.status_code, 202)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(File.objects.filter(id__in=ids).count(), 2)
+
+        run_pending()
+        self.assertFalse(CustomUser.objects.filter(id=self.user.id).exists())
+        self.assertFalse(File.objects.filter(id__in=ids).exists())
+        # Содержимое, на которое ссылается другой пользователь, остается
+        blob = File.objects.get(id=shared[0]).blob
+        self.assertEqual(blob.ref_count, 1)
+        self.assertEqual(Blob.objects.count(), 1)
+
+    def test_deleted_user_keeps_links_and_leaves_no_files(self):
+        own = File.objects.get(id=self.upload(self.user, b'own')[0]).blob
+        link = ShareLink.objects.create(file_id=self.upload(self.other, b'theirs')[0], created_by=self.user)
+        self.client.force_authenticate(self.admin)
+        self.client.delete(reverse('delete-user', kwargs={'user_id': self.user.id}))
+
+        # Копия пользователя в кэше авторизации еще активна, но место под новые файлы не выделяется
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile('late.txt', b'late', content_type='text/plain')}, format='multipart',
+        )
+        self.assertIn('Пользователь отключен', response.data['errors'][0])
+        self.assertFalse(File.objects.filter(user=self.user, file_name__startswith='late').exists())
+
+        # Файлы, появившиеся после первого прохода, освобождаются перед удалением записи
+        delete_user_files = tasks.delete_user_files
+        calls = []
+
+        def skip_first_pass(user_id):
+            calls.append(user_id)
+            return delete_user_files(user_id) if len(calls) > 1 else 0
+
+        with mock.patch.object(tasks, 'delete_user_files', skip_first_pass):
+            run_pending()
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(CustomUser.objects.filter(id=self.user.id).exists())
+        self.assertFalse(Blob.objects.filter(id=own.id).exists())
+
+        link.refresh_from_db()
+        self.assertIsNone(link.created_by)
+        self.assertEqual(self.client.get(reverse('shared-download', kwargs={'token': link.token})).status_code, 200)
+
+
+SHARDS = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+
+
+# override_settings(STORAGES=...) в Django 4.2 теряет OPTIONS, поэтому параметры
+# бэкендов в тестах задаются настройками, которые они читают по умолчанию
+@override_settings(
+    STORAGES={'default': {'BACKEND': 'storage.backends.ShardedStorage'}},
+    STORAGE_SHARDS=SHARDS,
+    FILE_DELIVERY_BACKEND='nginx',
+)
+class ShardedStorageTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(login='shards1', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_files_are_spread_over_shards_and_served_by_shard(self):
+        files = [SimpleUploadedFile(f'f{i}.txt', f'content {i}'.encode(), content_type='text/plain') for i in range(16)]
+        uploaded = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}), {'file': files}, format='multipart'
+        ).data['uploaded_files']
+
+        used = set()
+        for item in uploaded:
+            name = File.objects.get(id=item['id']).url.name
+            shard = default_storage.shard(name)
+            self.assertTrue(os.path.exists(os.path.join(SHARDS[shard], name)))
+            used.add(shard)
+
+            response = self.client.get(reverse('download-file', kwargs={'file_id': item['id']}))
+            self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{shard}/{name}')
+
+            # /media/ видит только первый каталог: постоянная ссылка идет через API
+            self.assertTrue(item['url'].endswith(f'/api/media/{name}'))
+            response = APIClient().get(reverse('media-download', kwargs={'name': name}))
+            self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{shard}/{name}')
+        self.assertEqual(used, {0, 1})
+
+
+@unittest.skipUnless(mock_aws and BaseS3Storage, "moto или django-storages[s3] не установлены")
+@override_settings(
+    STORAGES={'default': {'BACKEND': 'storage.backends.S3Storage'}},
+    AWS_STORAGE_BUCKET_NAME='mycloud-test',
+    AWS_S3_REGION_NAME='us-east-1',
+    AWS_S3_ACCESS_KEY_ID='test',
+    AWS_S3_SECRET_ACCESS_KEY='test',
+    UPLOAD_STAGING_DIR=tempfile.mkdtemp(),
+)
+class S3StorageTests(TestCase):
+
+    def setUp(self):
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+        self.s3.create_bucket(Bucket='mycloud-test')
+
+        self.user = CustomUser.objects.create_user(login='s3user', fullname='User', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_upload_goes_to_bucket_and_download_redirects(self):
+        response = self.client.post(
+            reverse('file-upload', kwargs={'user_id': self.user.id}),
+            {'file': SimpleUploadedFile('a.txt', b'object data', content_type='text/plain')},
+            format='multipart',
+        )
+        file_instance = File.objects.get(id=response.data['uploaded_files'][0]['id'])
+        stored = self.s3.get_object(Bucket='mycloud-test', Key=file_instance.url.name)['Body'].read()
+        self.assertEqual(stored, b'object data')
+
+        response = self.client.get(reverse('download-file', kwargs={'file_id': file_instance.id}))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(file_instance.url.name, response['Location'])
+        self.assertIn('Signature=', response['Location'])
+
+        url = FileSerializer(file_instance).data['url']
+        self.assertIn('/api/media/', url)
+        response = APIClient().get(url.split('testserver', 1)[-1])
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(file_instance.url.name, response['Location'])
+
+    def test_chunked_upload_is_staged_then_uploaded_by_worker(self):
+        data = b'staged content'
+        session = self.client.post(
+            reverse('upload-session-create', kwargs={'user_id': self.user.id}),
+            {'file_name': 'big.bin', 'file_size': len(data)}, format='json',
+        ).data
+        self.client.generic(
+            'PUT', reverse('upload-session', kwargs={'session_id': session['id']}), data,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes 0-{len(data) - 1}/{len(data)}',
+            HTTP_X_CHUNK_SHA256=hashlib.sha256(data).hexdigest(),
+        )
+        file_id = self.client.post(reverse('upload-session-complete', kwargs={'session_id': session['id']})).data['id']
+        download_url = reverse('download-file', kwargs={'file_id': file_id})
+        self.assertEqual(self.client.get(download_url).status_code, 409)
+
+        run_pending()
+        file_instance = File.objects.get(id=file_id)
+        self.assertEqual(file_instance.blob.sha256, hashlib.sha256(data).hexdigest())
+        stored = self.s3.get_object(Bucket='mycloud-test', Key=file_instance.url.name)['Body'].read()
+        self.assertEqual(stored, data)
+        self.assertEqual(self.client.get(download_url).status_code, 302)
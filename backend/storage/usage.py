@@ -0,0 +1,76 @@
+"""
+Учет занятого пользователем места: счетчики storage_used/files_count
+хранятся в строке CustomUser и меняются одним условным UPDATE, без
+агрегации по таблице файлов. Место резервируется до записи байтов на диск
+и возвращается, если загрузка не удалась.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import F, Q, Sum, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from users import auth_cache
+
+User = get_user_model()
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def reserve(user_id, size, count=1):
+    """
+    Атомарно увеличивает счетчики, если после этого пользователь остается
+    в пределах квоты. Иначе бросает QuotaExceeded, ничего не меняя.
+    Отключенному пользователю место не выделяется: его копия в кэше авторизации
+    еще может быть активной, но новые файлы после удаления не появятся.
+    """
+    fits = Q(storage_quota__isnull=False, storage_used__lte=F('storage_quota') - size)
+    if settings.DEFAULT_STORAGE_QUOTA:
+        fits |= Q(storage_quota__isnull=True, storage_used__lte=settings.DEFAULT_STORAGE_QUOTA - size)
+    else:
+        fits |= Q(storage_quota__isnull=True)
+
+    updated = User.objects.filter(fits, pk=user_id, is_active=True).update(
+        storage_used=F('storage_used') + size,
+        files_count=F('files_count') + count,
+    )
+    if not updated:
+        if not User.objects.filter(pk=user_id, is_active=True).exists():
+            raise QuotaExceeded("Пользователь отключен")
+        raise QuotaExceeded("Превышена квота хранилища")
+    # UPDATE не отправляет post_save: копия пользователя в кэше этого процесса устарела
+    auth_cache.invalidate_user(user_id)
+
+
+def release(user_id, size, count=1):
+    User.objects.filter(pk=user_id).update(
+        storage_used=F('storage_used') - size,
+        files_count=F('files_count') - count,
+    )
+    auth_cache.invalidate_user(user_id)
+
+
+def recalculate(users=None):
+    """
+    Пересчитывает счетчики по фактическим данным: файлы пользователя плюс
+    незавершенные сессии загрузки, под которые место уже зарезервировано.
+    Возвращает количество обновленных пользователей.
+    """
+    from .models import File, UploadSession
+
+    def total(model, field, aggregate):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(user_id=OuterRef('pk'))
+                .order_by().values('user_id').annotate(total=aggregate(field)).values('total')
+            ),
+            Value(0),
+        )
+
+    users = User.objects.all() if users is None else users
+    auth_cache.clear()
+    return users.update(
+        storage_used=total(File, 'file_size', Sum) + total(UploadSession, 'file_size', Sum),
+        files_count=total(File, 'id', Count) + total(UploadSession, 'id', Count),
+    )
@@ -3,26 +3,56 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework import status, permissions
 from django.shortcuts import get_object_or_404
-from .models import File
-from .serializers import FileSerializer
+from .models import File, FileChange, ShareLink, UploadSession, user_directory_path
+from .serializers import FileChangeSerializer, FileSerializer, FILE_QUERY_FIELDS, ShareLinkSerializer
+from .pagination import FileCursorPagination, SearchPagination
+from .search import search_files
+from .filters import filter_files
+from .delivery import file_response, stored_file_response
+from .ingest import ingest_files, upload_response
+from .queue import enqueue
+from .usage import QuotaExceeded, release, reserve
+from .previews import PREVIEW_CONTENT_TYPE, PreviewUnavailable, content_key, get_preview
+from .downloads import is_new_download, record_download, requests_from_start
+from .chunked import ChunkBusy, ChunkError, open_for_chunk, parse_content_range, write_chunk
+from .backends import file_available, upload_staging_storage
+from .blobs import BLOB_DIR
+from .signing import LinkExpired, unsign_download
+from .changes import created, current_seq, record_changes
+from .archive import ArchiveError, iter_archive, select_files
+from .bulk import BulkError, bulk_comment, bulk_delete, bulk_move
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core import signing
+from django.db import transaction
+from django.db.models import F, Q
 import logging
-from django.http import FileResponse
 import os
+import posixpath
 from rest_framework.decorators import action
 from rest_framework import viewsets
-from django.http import Http404
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from users.models import CustomUser
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from datetime import timedelta
 
 logger = logging.getLogger('storage')
-logger.setLevel(logging.DEBUG)
 
 User = get_user_model()
 
+# Год: ответы превью неизменяемы
+PREVIEW_MAX_AGE = 365 * 24 * 60 * 60
+
+# Записей журнала изменений на странице
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 1000
+
 
 class FileUploadView(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -47,88 +77,143 @@ class FileUploadView(viewsets.ViewSet):
             except ObjectDoesNotExist:
                 return Response({"error": "Пользователь не найден"}, status=status.HTTP_404_NOT_FOUND)
 
-        max_file_size = 10 * 1024 * 1024  # 10 MB
-        uploaded_files = []
-        errors = []
-
-        for file in files:
-            if file.size > max_file_size:
-                errors.append(f"Файл {file.name} превышает допустимый лимит (10 МБ)")
-                continue
-
-            try:
-                file_instance = File.objects.create(
-                    user=target_user,
-                    file_name=file.name,
-                    file_size=file.size,
-                    type=file.content_type,
-                    url=file,
-                    comment=comment
-                )
-                uploaded_files.append(FileSerializer(file_instance).data)
-            except ValidationError as e:
-                errors.append(f"Ошибка при загрузке файла {file.name}: {str(e)}")
-                continue
-
-        response_data = {"uploaded_files": uploaded_files}
-        if errors:
-            response_data["errors"] = errors
-
-        # Возвращаем статус
-        status_code = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+        uploaded_files, errors = ingest_files(target_user, files, comment)
+        response_data, status_code = upload_response(uploaded_files, errors)
         return Response(response_data, status=status_code)
     
     # Метод для скачивания файла
     @action(detail=True, methods=['get'])
     def download_file(self, request, file_id=None, *args, **kwargs):
-        logger.info(f"Заголовки: {request.headers}")
-        logger.info(f"Пользователь: {request.user}")
-
-        logger.info(f"Пользователь: {request.user}, Аутентифицирован: {request.user.is_authenticated}")
+        files = File.objects.select_related('blob')
         if request.user.is_admin:
-            file_instance = get_object_or_404(File, id=file_id)
+            file_instance = get_object_or_404(files, id=file_id)
         else:
-            file_instance = get_object_or_404(File, id=file_id, user=request.user)
+            file_instance = get_object_or_404(files, id=file_id, user=request.user)
         
-        # Путь к файлу
-        file_path = file_instance.url.path
-        print(file_path)
-        if not os.path.exists(file_path):
+        # Файл из чанков при удаленном хранилище появится после фоновой задачи adopt_file
+        if not file_instance.url:
+            return Response({"error": "Файл еще обрабатывается"}, status=status.HTTP_409_CONFLICT)
+        if not file_available(file_instance.url.name):
             raise Http404("Файл не найден.")
         
-        # Обновляем поле last_downloaded
-        file_instance.last_downloaded = timezone.now()
-        file_instance.save()
-        
-        # Возвращаем файл для скачивания
-        response = FileResponse(open(file_path, 'rb'))
+        # Возвращаем файл для скачивания (байты может передать фронтовой веб-сервер)
+        response = file_response(request, file_instance)
+
+        # Учитываем скачивание в памяти, в БД оно попадет пакетом из фонового потока
+        if is_new_download(request, response):
+            record_download(file_instance.id)
         return response
 
+    # ZIP-архив файлов (ids) или всех файлов пользователя (user_id), собирается на лету
+    @action(detail=False, methods=['get', 'post'])
+    def download_archive(self, request, *args, **kwargs):
+        params = request.query_params if request.method == 'GET' else request.data
+        try:
+            files, archive_name = select_files(request.user, params)
+        except ArchiveError as e:
+            return Response({"error": str(e)}, status=e.status)
 
-    # Получение списка файлов
+        response = StreamingHttpResponse(iter_archive(files), content_type='application/zip')
+        response['Content-Disposition'] = content_disposition_header(True, archive_name)
+        return response
+
+    # Превью изображения или первой страницы PDF (?size=small|large)
+    @action(detail=True, methods=['get'])
+    def preview_file(self, request, file_id=None, *args, **kwargs):
+        files = File.objects.select_related('blob')
+        if request.user.is_admin:
+            file_instance = get_object_or_404(files, id=file_id)
+        else:
+            file_instance = get_object_or_404(files, id=file_id, user=request.user)
+
+        size = request.query_params.get('size', 'small')
+        # Содержимое файла не меняется, поэтому превью кэшируется браузером надолго
+        etag = '"%s_%s"' % (content_key(file_instance), size)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                preview = get_preview(file_instance, size)
+            except PreviewUnavailable as e:
+                return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+            # Только что построенное превью открыто под временным именем
+            response = FileResponse(preview, content_type=PREVIEW_CONTENT_TYPE, filename=f'preview_{size}.jpg')
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=PREVIEW_MAX_AGE, immutable=True)
+        return response
+
+
+    # Получение списка файлов (курсорная пагинация, фильтры и сортировка)
     @action(detail=False, methods=['get'])
     def get_list(self, request, user_id=None, *args, **kwargs):
         if not user_id:
             return Response({"error": "Параметр user_id обязателен."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Проверяем, что пользователь запрашивает свои файлы или является администратором
-        if request.user.is_admin:
+        if not request.user.is_admin and request.user.id != int(user_id):
+            return Response({"error": "Нет прав для просмотра файлов пользователя."}, status=status.HTTP_403_FORBIDDEN)
 
-            # Для администратора: возвращаем все файлы
-            files = File.objects.all()
-        elif request.user.id == int(user_id):
+        paginator = FileCursorPagination()
+        try:
+            files = filter_files(File.objects.filter(user_id=user_id).only(*FILE_QUERY_FIELDS), request.query_params)
+            page = paginator.paginate_queryset(files, request, view=self)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Для обычного пользователя: возвращаем только его файлы
-            files = File.objects.filter(user_id=user_id)
-        else:
+        serializer = FileSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    # Поиск по имени, комментарию и типу: результаты по релевантности, с курсором
+    @action(detail=False, methods=['get'])
+    def search(self, request, user_id=None, *args, **kwargs):
+        if not request.user.is_admin and request.user.id != int(user_id):
+            return Response({"error": "Нет прав для просмотра файлов пользователя."}, status=status.HTTP_403_FORBIDDEN)
+
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "Параметр q обязателен."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Если пользователь не админ и не запрашивает свои файлы
+        paginator = SearchPagination()
+        try:
+            files = filter_files(File.objects.filter(user_id=user_id).only(*FILE_QUERY_FIELDS), request.query_params)
+            page = paginator.paginate_queryset(search_files(files, query), request, view=self)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = FileSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    # Журнал изменений после since: клиенты синхронизации получают только дельту
+    @action(detail=False, methods=['get'])
+    def get_changes(self, request, user_id=None, *args, **kwargs):
+        if not request.user.is_admin and request.user.id != int(user_id):
             return Response({"error": "Нет прав для просмотра файлов пользователя."}, status=status.HTTP_403_FORBIDDEN)
 
-        serializer = FileSerializer(files, many=True)
-        logger.debug("Serialized data: %s", serializer.data)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    
+        since = request.query_params.get('since')
+        if since in (None, ''):
+            # Текущая позиция журнала: с нее клиент продолжает после загрузки полного списка
+            return Response({"changes": [], "next_since": current_seq(user_id) or 0, "has_more": False})
+        try:
+            since = int(since)
+            limit = min(int(request.query_params.get('page_size', CHANGES_PAGE_SIZE)), CHANGES_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({"error": "Параметры since и page_size должны быть числами."}, status=status.HTTP_400_BAD_REQUEST)
+        if since < 0 or limit < 1:
+            return Response({"error": "Недопустимое значение since или page_size."}, status=status.HTTP_400_BAD_REQUEST)
+
+        changes = list(FileChange.objects.filter(user_id=user_id, seq__gt=since).order_by('seq')[:limit + 1])
+        # Нумерация сплошная: пропуск означает, что нужные записи уже удалены уборкой
+        if changes and changes[0].seq != since + 1:
+            return Response(
+                {"error": "Журнал изменений устарел, нужна полная синхронизация."}, status=status.HTTP_410_GONE
+            )
+
+        page = changes[:limit]
+        return Response({
+            "changes": FileChangeSerializer(page, many=True).data,
+            "next_since": page[-1].seq if page else since,
+            "has_more": len(changes) > limit,
+        })
+
     # Удаление файла
     @action(detail=True, methods=['delete'])
     def delete_file(self, request, user_id=None, file_id=None, *args, **kwargs):
@@ -141,16 +226,36 @@ class FileUploadView(viewsets.ViewSet):
         else:
             return Response({"error": "Нет прав для удаления файла."}, status=status.HTTP_403_FORBIDDEN)
         
-         # Проверяем, является ли файл аватаром
-        user = get_object_or_404(CustomUser, id=user_id)
-        if user.avatar == file_instance.url:
-            user.avatar = None
-            user.save()
-        
-        # Удаление файла
-        file_instance.delete()
+        # Удаление записи; файл на диске и аватар обрабатываются фоновыми задачами
+        with transaction.atomic():
+            file_instance.delete()
+            # Аватар своего пользователя известен из запроса, чужой проверит задача
+            url = FileSerializer().get_url(file_instance)
+            if request.user.id != user_id or request.user.avatar == url:
+                enqueue('clear_avatar', user_id=user_id, url=url)
         return Response({"message": "Файл успешно удален"}, status=status.HTTP_204_NO_CONTENT)
 
+    # Групповые операции: {"ids": [...]} и параметры операции, весь пакет — одна транзакция
+    def run_bulk(self, request, operation, result_key):
+        try:
+            count = operation(request.user, request.data)
+        except BulkError as e:
+            return Response({"error": str(e)}, status=e.status)
+        return Response({result_key: count}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def delete_files(self, request, *args, **kwargs):
+        return self.run_bulk(request, bulk_delete, "deleted")
+
+    # Перенос файлов другому пользователю (user_id), только для администратора
+    @action(detail=False, methods=['post'])
+    def move_files(self, request, *args, **kwargs):
+        return self.run_bulk(request, bulk_move, "moved")
+
+    @action(detail=False, methods=['post'])
+    def comment_files(self, request, *args, **kwargs):
+        return self.run_bulk(request, bulk_comment, "updated")
+
     # Обновление имени файла или комментария
     @action(detail=True, methods=['patch'])
     def update_file(self, request, file_id=None, *args, **kwargs):
@@ -166,24 +271,317 @@ class FileUploadView(viewsets.ViewSet):
         if new_name == "":
             return Response({"error": "Новое имя файла не может быть пустым"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Путь к старому файлу
-        old_file_path = file_instance.url.path  # путь до файла в файловой системе
-
-        if new_name and os.path.exists(old_file_path):
-            file_extension = os.path.splitext(old_file_path)[1]  # получаем расширение файла
-            new_file_name = f"{new_name}{file_extension}"  # сохраняем расширение
-            new_file_path = os.path.join(os.path.dirname(old_file_path), new_file_name)
-
-            os.rename(old_file_path, new_file_path)  # переименовываем файл
-            file_instance.url.name = os.path.relpath(new_file_path, settings.MEDIA_ROOT)  # обновляем путь в базе
+        changes = []
+        # На диске файл лежит под ключом, не зависящим от имени: меняется только запись в базе
+        if new_name:
+            file_extension = os.path.splitext(file_instance.file_name)[1]
+            file_instance.file_name = f"{new_name}{file_extension}"
+            changes.append((file_instance.id, FileChange.KIND_RENAME, {'file_name': file_instance.file_name}))
 
-            if new_name:
-                file_instance.file_name = new_name
-            
-        if new_comment is not None:
+        if new_comment is not None and new_comment != file_instance.comment:
             file_instance.comment = new_comment
+            changes.append((file_instance.id, FileChange.KIND_COMMENT, {'comment': new_comment}))
 
-        file_instance.save()
+        with transaction.atomic():
+            file_instance.save()
+            record_changes(file_instance.user_id, changes)
 
         serializer = FileSerializer(file_instance)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class UploadSessionView(viewsets.ViewSet):
+    """
+    Возобновляемая загрузка больших файлов:
+    создание сессии -> PUT чанков с Content-Range и X-Chunk-SHA256 -> завершение.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_session(self, request, session_id):
+        if request.user.is_admin:
+            return get_object_or_404(UploadSession, id=session_id)
+        return get_object_or_404(UploadSession, id=session_id, user=request.user)
+
+    @staticmethod
+    def session_data(session):
+        return {
+            "id": str(session.id),
+            "file_name": session.file_name,
+            "file_size": session.file_size,
+            "offset": session.offset,
+        }
+
+    # Создание сессии загрузки
+    @action(detail=False, methods=['post'])
+    def create_session(self, request, user_id=None, *args, **kwargs):
+        file_name = request.data.get('file_name')
+        file_size = request.data.get('file_size')
+        file_type = str(request.data.get('type') or 'application/octet-stream')
+
+        if not file_name:
+            return Response({"error": "Имя файла не указано"}, status=status.HTTP_400_BAD_REQUEST)
+        file_name = str(file_name)
+        # Длины полей проверяются заранее: иначе PostgreSQL ответит DataError (500)
+        if len(file_name) > UploadSession._meta.get_field('file_name').max_length:
+            return Response({"error": "Слишком длинное имя файла"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(file_type) > UploadSession._meta.get_field('type').max_length:
+            return Response({"error": "Слишком длинный тип файла"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            file_size = int(file_size)
+        except (TypeError, ValueError):
+            return Response({"error": "Размер файла должен быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+        if file_size <= 0 or file_size > settings.UPLOAD_SESSION_MAX_SIZE:
+            return Response({"error": "Недопустимый размер файла"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Загружать можно себе, админ — любому пользователю
+        target_user = request.user
+        if user_id and int(user_id) != request.user.id:
+            if not request.user.is_admin:
+                return Response({"error": "Нет прав для загрузки файлов пользователю."}, status=status.HTTP_403_FORBIDDEN)
+            target_user = get_object_or_404(User, id=user_id)
+
+        # Место резервируется сразу, до приема первого чанка
+        try:
+            reserve(target_user.id, file_size)
+        except QuotaExceeded as e:
+            return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        session = UploadSession(
+            user=target_user,
+            file_name=file_name,
+            type=file_type,
+            comment=request.data.get('comment', ''),
+            file_size=file_size,
+        )
+        # Резервируем уникальное имя конечного файла, чанки будут писаться прямо в него
+        try:
+            session.path = upload_staging_storage().save(user_directory_path(session, file_name), ContentFile(b''))
+            session.save()
+        except BaseException:
+            release(target_user.id, file_size)
+            raise
+        return Response(self.session_data(session), status=status.HTTP_201_CREATED)
+
+    # Состояние сессии: смещение, с которого нужно продолжить загрузку
+    @action(detail=True, methods=['get'])
+    def get_session_status(self, request, session_id=None, *args, **kwargs):
+        session = self.get_session(request, session_id)
+        return Response(self.session_data(session), status=status.HTTP_200_OK)
+
+    # Запись чанка
+    @action(detail=True, methods=['put'])
+    def upload_chunk(self, request, session_id=None, *args, **kwargs):
+        checksum = request.headers.get('X-Chunk-SHA256')
+        if not checksum:
+            return Response({"error": "Заголовок X-Chunk-SHA256 обязателен"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start, length, total = parse_content_range(request.headers.get('Content-Range'))
+        except ChunkError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response({"error": "Чанк превышает допустимый размер"}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        # Без тела запроса (или без Content-Length) DRF не дает потока
+        if request.stream is None:
+            return Response({"error": "Тело запроса пустое"}, status=status.HTTP_400_BAD_REQUEST)
+
+        session = self.get_session(request, session_id)
+        if total != session.file_size:
+            return Response({"error": "Размер файла не совпадает с сессией"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Чанк принимается без транзакции: медленный клиент не держит соединение с БД
+        # и блокировку строки. Параллельные PUT исключает блокировка файла сессии
+        try:
+            with open_for_chunk(upload_staging_storage().path(session.path)) as destination:
+                session.refresh_from_db(fields=['offset'])
+                if start != session.offset:
+                    return Response(
+                        {"error": "Неверное смещение чанка", **self.session_data(session)},
+                        status=status.HTTP_409_CONFLICT,
+                    )
+                write_chunk(destination, start, request.stream, length, checksum)
+
+                # Смещение сдвигается, только если сессию не изменили и не отменили за время записи
+                updated = UploadSession.objects.filter(id=session.id, offset=start).update(
+                    offset=start + length, updated_at=timezone.now()
+                )
+                if not updated:
+                    destination.truncate(start)
+                    return Response({"error": "Сессия загрузки изменилась"}, status=status.HTTP_409_CONFLICT)
+        except ChunkBusy as e:
+            return Response({"error": str(e), **self.session_data(session)}, status=status.HTTP_409_CONFLICT)
+        except ChunkError as e:
+            return Response({"error": str(e), **self.session_data(session)}, status=status.HTTP_400_BAD_REQUEST)
+        except (UploadSession.DoesNotExist, FileNotFoundError):
+            raise Http404("Сессия загрузки не найдена.")
+
+        session.offset = start + length
+        return Response(self.session_data(session), status=status.HTTP_200_OK)
+
+    # Завершение загрузки: создаем запись File для собранного файла
+    @action(detail=True, methods=['post'])
+    def complete_session(self, request, session_id=None, *args, **kwargs):
+        with transaction.atomic():
+            session = self.get_session(request, session_id)
+            session = UploadSession.objects.select_for_update().get(id=session.id)
+
+            if session.offset != session.file_size:
+                return Response(
+                    {"error": "Файл загружен не полностью", **self.session_data(session)},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            # В локальном хранилище файл сразу доступен по своему пути; хэширование и перенос
+            # в хранилище блобов (с дедупликацией) выполнит фоновая задача adopt_file.
+            # В удаленное хранилище файл из локального каталога загрузит она же
+            staging = upload_staging_storage()
+            local = default_storage.is_local
+            file_instance = File.objects.create(
+                user_id=session.user_id,
+                file_name=session.file_name,
+                file_size=session.file_size,
+                type=session.type,
+                url=session.path if local else '',
+                comment=session.comment,
+            )
+            session.delete()
+            record_changes(file_instance.user_id, [created(file_instance)])
+            if local:
+                enqueue('adopt_file', file_id=file_instance.id)
+            else:
+                enqueue('adopt_file', file_id=file_instance.id, staged=staging.path(session.path))
+
+        return Response(FileSerializer(file_instance).data, status=status.HTTP_201_CREATED)
+
+    # Отмена загрузки
+    @action(detail=True, methods=['delete'])
+    def abort_session(self, request, session_id=None, *args, **kwargs):
+        session = self.get_session(request, session_id)
+        upload_staging_storage().delete(session.path)
+        with transaction.atomic():
+            session.delete()
+            release(session.user_id, session.file_size)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ShareLinkView(viewsets.ViewSet):
+    """Публичные ссылки на файл: создание, список и отзыв (владельцем файла или админом)."""
+    permission_classes = [IsAuthenticated]
+
+    def get_file(self, request, file_id):
+        if request.user.is_admin:
+            return get_object_or_404(File, id=file_id)
+        return get_object_or_404(File, id=file_id, user=request.user)
+
+    # Ссылки файла
+    @action(detail=True, methods=['get'])
+    def list_links(self, request, file_id=None, *args, **kwargs):
+        file_instance = self.get_file(request, file_id)
+        links = ShareLink.objects.filter(file=file_instance).order_by('-created_at')
+        return Response(ShareLinkSerializer(links, many=True).data)
+
+    # Создание ссылки: expires_in — срок в секундах, max_downloads — лимит скачиваний
+    @action(detail=True, methods=['post'])
+    def create_link(self, request, file_id=None, *args, **kwargs):
+        file_instance = self.get_file(request, file_id)
+        try:
+            expires_in = int(request.data.get('expires_in') or 0)
+            max_downloads = int(request.data.get('max_downloads') or 0)
+        except (TypeError, ValueError):
+            return Response({"error": "Срок и лимит скачиваний должны быть числами"}, status=status.HTTP_400_BAD_REQUEST)
+        if expires_in < 0 or max_downloads < 0:
+            return Response({"error": "Срок и лимит скачиваний не могут быть отрицательными"}, status=status.HTTP_400_BAD_REQUEST)
+
+        max_ttl = settings.SHARE_LINK_MAX_TTL
+        if max_ttl and (not expires_in or expires_in > max_ttl):
+            expires_in = max_ttl
+
+        link = ShareLink.objects.create(
+            file=file_instance,
+            created_by=request.user,
+            expires_at=timezone.now() + timedelta(seconds=expires_in) if expires_in else None,
+            max_downloads=max_downloads or None,
+        )
+        return Response(ShareLinkSerializer(link).data, status=status.HTTP_201_CREATED)
+
+    # Отзыв ссылки
+    @action(detail=True, methods=['delete'])
+    def revoke_link(self, request, token=None, *args, **kwargs):
+        links = ShareLink.objects.filter(token=token)
+        if not request.user.is_admin:
+            links = links.filter(file__user=request.user)
+        if not links.delete()[0]:
+            raise Http404("Ссылка не найдена.")
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# Скачивание по подписанной ссылке: проверяется только подпись, без сессии и БД
+def signed_download(request, token):
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({"error": "Метод не поддерживается"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        payload = unsign_download(token)
+    except LinkExpired:
+        return JsonResponse({"error": "Срок действия ссылки истек"}, status=status.HTTP_410_GONE)
+    except signing.BadSignature:
+        return JsonResponse({"error": "Недействительная ссылка"}, status=status.HTTP_403_FORBIDDEN)
+
+    # Файл могли удалить после выдачи ссылки
+    if not file_available(payload['n']):
+        raise Http404("Файл не найден.")
+
+    response = stored_file_response(
+        request, payload['n'], payload['f'], payload['t'], payload['e'], payload['m'], as_attachment=payload['a'],
+    )
+    if is_new_download(request, response):
+        record_download(payload['i'])
+    return response
+
+
+# Постоянная ссылка на содержимое (поле url), когда /media/ его не отдает: шарды, S3.
+# Как и /media/, доступна без авторизации по имени файла в хранилище
+def media_download(request, name):
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({"error": "Метод не поддерживается"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    files = File.objects.filter(url=name)
+    if name.startswith(BLOB_DIR + '/'):
+        # Поиск по уникальному хэшу блоба вместо неиндексированного url
+        files = files.filter(blob__sha256=posixpath.basename(name).split('.', 1)[0])
+    file_instance = files.order_by('id').first()
+    if file_instance is None or not file_available(name):
+        raise Http404("Файл не найден.")
+    return file_response(request, file_instance)
+
+
+# Скачивание по публичной ссылке (без авторизации)
+def shared_download(request, token):
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse({"error": "Метод не поддерживается"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    links = ShareLink.objects.filter(token=token).filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+    # Докачка и HEAD не расходуют лимит; новое скачивание занимает его условным UPDATE
+    counted = request.method == 'GET' and requests_from_start(request)
+    if counted:
+        taken = links.filter(
+            Q(max_downloads__isnull=True) | Q(download_count__lt=F('max_downloads'))
+        ).update(download_count=F('download_count') + 1)
+    link = links.filter(
+        Q(max_downloads__isnull=True) | Q(download_count__lte=F('max_downloads'))
+    ).select_related('file').first()
+
+    if link is None or (counted and not taken):
+        if ShareLink.objects.filter(token=token).exists():
+            return JsonResponse({"error": "Срок действия ссылки истек или лимит скачиваний исчерпан"}, status=status.HTTP_410_GONE)
+        raise Http404("Ссылка не найдена.")
+
+    file_instance = link.file
+    if not file_instance.url:
+        return JsonResponse({"error": "Файл еще обрабатывается"}, status=status.HTTP_409_CONFLICT)
+    if not file_available(file_instance.url.name):
+        raise Http404("Файл не найден.")
+
+    response = file_response(request, file_instance, as_attachment=True)
+    if is_new_download(request, response):
+        record_download(file_instance.id)
+    return response
@@ -8,6 +8,7 @@ class UsersConfig(AppConfig):
 
     def ready(self):
         post_migrate.connect(create_superuser, sender=self)
+        import users.signals
 
 def create_superuser(sender, **kwargs):
     """
@@ -0,0 +1,65 @@
+"""
+Кэш аутентифицированных пользователей в памяти процесса.
+
+Пользователь из сессии кэшируется по id на AUTH_USER_CACHE_TTL секунд,
+поэтому на прогретом кэше запрос не читает CustomUser из БД. Каждый запрос
+получает свою копию объекта. Изменение или удаление пользователя сбрасывает
+кэш текущего процесса сразу (сигналы), остальных — по истечении TTL.
+"""
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY, get_user
+from django.utils.crypto import constant_time_compare
+
+# user_id -> (момент истечения, пользователь)
+_users = {}
+_lock = threading.Lock()
+
+
+def get_cached(user_id):
+    entry = _users.get(user_id)
+    if entry is None:
+        return None
+    expires_at, user = entry
+    if expires_at < time.monotonic():
+        _users.pop(user_id, None)
+        return None
+    return copy.deepcopy(user)
+
+
+def put(user):
+    ttl = settings.AUTH_USER_CACHE_TTL
+    if ttl <= 0:
+        return
+    with _lock:
+        _users[str(user.pk)] = (time.monotonic() + ttl, copy.deepcopy(user))
+
+
+def invalidate_user(user_id):
+    _users.pop(str(user_id), None)
+
+
+def clear(*args, **kwargs):
+    _users.clear()
+
+
+def get_cached_user(request):
+    """
+    Аналог django.contrib.auth.get_user с кэшем. Хэш сессии сверяется и для
+    пользователя из кэша, поэтому смена пароля по-прежнему завершает сессии.
+    """
+    session = request.session
+    user_id = session.get(SESSION_KEY)
+    if user_id is not None:
+        user = get_cached(str(user_id))
+        session_hash = session.get(HASH_SESSION_KEY)
+        if user is not None and session_hash and constant_time_compare(session_hash, user.get_session_auth_hash()):
+            return user
+
+    user = get_user(request)
+    if user.is_authenticated:
+        put(user)
+    return user
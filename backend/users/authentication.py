@@ -0,0 +1,42 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from . import auth_cache
+from .tokens import is_access_token_revoked
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    Аутентификация по access-токену без обращения к БД на прогретом кэше:
+    подпись проверяется локально, пользователь берется из кэша процесса
+    (тот же, что и для сессий), отзыв токена — из общего кэша.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_access_token_revoked(token):
+            raise InvalidToken(_("Token is blacklisted"))
+        return token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = auth_cache.get_cached(str(user_id))
+        if user is None:
+            # Базовая реализация проверяет is_active и смену пароля
+            user = super().get_user(validated_token)
+            auth_cache.put(user)
+            return user
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.17 on 2026-10-18 12:39
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_storage_usage(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    File = apps.get_model('storage', 'File')
+    UploadSession = apps.get_model('storage', 'UploadSession')
+
+    def total(model, field, aggregate):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(user_id=OuterRef('pk'))
+                .order_by().values('user_id').annotate(total=aggregate(field)).values('total')
+            ),
+            Value(0),
+        )
+
+    CustomUser.objects.update(
+        storage_used=total(File, 'file_size', Sum) + total(UploadSession, 'file_size', Sum),
+        files_count=total(File, 'id', Count) + total(UploadSession, 'id', Count),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('storage', '0006_download_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='files_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='storage_quota',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='storage_used',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_storage_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Поиск пользователей идет через istartswith, который в PostgreSQL
+# превращается в UPPER(col::text) LIKE UPPER('...%'). Такой запрос использует
+# только функциональный индекс с text_pattern_ops, которого нет в ORM для
+# других СУБД, поэтому индексы создаются только на PostgreSQL.
+SEARCH_FIELDS = ('login', 'fullname', 'email')
+
+
+def index_name(field):
+    return f'users_customuser_{field}_prefix_idx'
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name(field)} '
+            f'ON users_customuser ((UPPER({field}::text)) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index_name(field)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_storage_usage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
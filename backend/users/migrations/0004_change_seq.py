@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
 from django.utils.timezone import now
@@ -40,6 +41,13 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(default=now)
     others = models.JSONField(default=dict, blank=True, null=True)
+    # Денормализованный учет занятого места (см. storage/usage.py).
+    # storage_quota = None — действует DEFAULT_STORAGE_QUOTA из настроек
+    storage_used = models.BigIntegerField(default=0)
+    files_count = models.IntegerField(default=0)
+    storage_quota = models.BigIntegerField(blank=True, null=True)
+    # Номер последней записи в журнале изменений файлов (см. storage/changes.py)
+    change_seq = models.BigIntegerField(default=0)
 
     objects = CustomUserManager()
 
@@ -48,3 +56,10 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
 
     def __str__(self):
         return self.login
+
+    @property
+    def effective_quota(self):
+        """Лимит в байтах; None — без ограничения."""
+        if self.storage_quota is not None:
+            return self.storage_quota
+        return settings.DEFAULT_STORAGE_QUOTA or None
@@ -0,0 +1,7 @@
+from storage.pagination import KeysetPagination
+
+
+class UserCursorPagination(KeysetPagination):
+    ordering_fields = ('id', 'login', 'fullname', 'date_joined', 'storage_used')
+    default_ordering = 'id'
+    results_key = 'users'
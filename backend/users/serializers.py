@@ -1,13 +1,26 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import (
+    TokenBlacklistSerializer,
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
 from .models import CustomUser
-from storage.views import FileSerializer
+from .tokens import CachedRefreshToken
 
 class UserSerializer(serializers.ModelSerializer):
-    files = FileSerializer(many=True, read_only=True)
+    # Файлы не вкладываются: список отдается постранично через /api/files/<user_id>/.
+    # Счетчики денормализованы в строке пользователя — агрегация по файлам не нужна
+    storage_used = serializers.IntegerField(read_only=True)
+    files_count = serializers.IntegerField(read_only=True)
+    storage_quota = serializers.IntegerField(source='effective_quota', read_only=True)
 
     class Meta:
         model = CustomUser
-        fields = ['id', 'login', 'fullname', 'email', 'password', 'avatar', 'is_admin', 'files']
+        fields = [
+            'id', 'login', 'fullname', 'email', 'password', 'avatar', 'is_admin',
+            'storage_used', 'files_count', 'storage_quota',
+        ]
+        extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
         password = validated_data.pop('password', None)
@@ -30,3 +43,16 @@ class UserSerializer(serializers.ModelSerializer):
 class UserLoginSerializer(serializers.Serializer):
     login = serializers.CharField(max_length=150)
     password = serializers.CharField(max_length=128, write_only=True)
+
+
+# Токены с проверкой черного списка через кэш (см. users/tokens.py)
+class CachedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = CachedRefreshToken
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
+
+
+class CachedTokenBlacklistSerializer(TokenBlacklistSerializer):
+    token_class = CachedRefreshToken
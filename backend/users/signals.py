@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth_cache import invalidate_user
+from .models import CustomUser
+
+
+# Изменение или удаление пользователя (в том числе через UpdateUserView
+# и DeleteUserView) сбрасывает его копию в кэше аутентификации
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
@@ -1,3 +1,169 @@
-from django.test import TestCase
+import base64
+import tempfile
 
-# Create your tests here.
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from storage.models import File
+
+from . import auth_cache
+from .models import CustomUser
+
+
+class GetUsersViewTests(TestCase):
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user(login='admin1', fullname='Admin', password='pass', is_admin=True)
+        for login, fullname in (('anna', 'Anna Petrova'), ('boris', 'Boris Ivanov'), ('andrey', 'Andrey Sidorov')):
+            CustomUser.objects.create_user(login=login, fullname=fullname, email=f'{login}@test.ru', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_pagination(self):
+        url = reverse('get-users')
+        logins = []
+        params = {'page_size': 2, 'ordering': 'login'}
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            logins += [user['login'] for user in response.data['users']]
+            if not response.data['next_cursor']:
+                break
+            params['cursor'] = response.data['next_cursor']
+        self.assertEqual(logins, sorted(CustomUser.objects.values_list('login', flat=True)))
+
+    def test_search_by_prefix(self):
+        response = self.client.get(reverse('get-users'), {'search': 'AN'})
+        self.assertEqual({user['login'] for user in response.data['users']}, {'anna', 'andrey'})
+
+        response = self.client.get(reverse('get-users'), {'search': 'Ivan'})
+        self.assertEqual(response.data['users'], [])
+
+        response = self.client.get(reverse('get-users'), {'search': 'boris@'})
+        self.assertEqual([user['login'] for user in response.data['users']], ['boris'])
+
+    def test_lean_payload(self):
+        response = self.client.get(reverse('check-auth'))
+        user = response.data['user']
+        self.assertNotIn('files', user)
+        self.assertNotIn('password', user)
+        self.assertEqual((user['storage_used'], user['files_count']), (0, 0))
+
+    def test_not_admin(self):
+        self.client.force_authenticate(CustomUser.objects.get(login='anna'))
+        self.assertEqual(self.client.get(reverse('get-users')).status_code, 403)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class CachedAuthTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        auth_cache.clear()
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='cached1', fullname='Cached', password='pass')
+        self.file = File.objects.create(
+            user=self.user, file_name='a.txt', file_size=4, type='text/plain', url=ContentFile(b'data', name='a.txt')
+        )
+        self.client = APIClient()
+        self.client.login(login='cached1', password='pass')
+
+    def test_warm_requests_skip_session_and_user_queries(self):
+        list_url = reverse('file-list', kwargs={'user_id': self.user.id})
+        download_url = reverse('download-file', kwargs={'file_id': self.file.id})
+        self.client.get(list_url)
+
+        # Только сами файлы: сессия в кэше, пользователь в кэше процесса
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(list_url).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(download_url).status_code, 200)
+
+    def test_update_invalidates_cached_user(self):
+        self.client.get(reverse('check-auth'))
+        self.client.patch(reverse('update-user'), {'fullname': 'Renamed'}, format='json')
+        response = self.client.get(reverse('check-auth'))
+        self.assertEqual(response.data['user']['fullname'], 'Renamed')
+
+    def test_counters_are_not_served_or_saved_stale(self):
+        self.client.get(reverse('check-auth'))
+        # Счетчики меняют UPDATE-ы без сигналов, в том числе в других процессах
+        CustomUser.objects.filter(id=self.user.id).update(storage_used=100, files_count=5)
+
+        user = self.client.get(reverse('check-auth')).data['user']
+        self.assertEqual((user['storage_used'], user['files_count']), (100, 5))
+
+        response = self.client.patch(reverse('update-user'), {'fullname': 'Renamed'}, format='json')
+        self.assertEqual(response.data['user']['files_count'], 5)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.fullname, self.user.storage_used, self.user.files_count), ('Renamed', 100, 5))
+
+    def test_deleted_user_is_logged_out(self):
+        self.client.get(reverse('check-auth'))
+        CustomUser.objects.get(id=self.user.id).delete()
+        self.assertEqual(self.client.get(reverse('check-auth')).status_code, 403)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class JWTAuthTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        auth_cache.clear()
+        Site.objects.clear_cache()
+        self.user = CustomUser.objects.create_user(login='token1', fullname='Token', password='pass')
+        self.client = APIClient()
+        response = self.client.post(reverse('token-obtain'), {'login': 'token1', 'password': 'pass'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.tokens = response.data
+
+    def authorize(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_access_token_without_db_lookup(self):
+        self.authorize(self.tokens['access'])
+        url = reverse('file-list', kwargs={'user_id': self.user.id})
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        # Только список файлов: токен проверяется локально, пользователь — из кэша
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_refresh_rotation_blacklists_old_token(self):
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('refresh', response.data)
+
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_logout_revokes_tokens(self):
+        self.authorize(self.tokens['access'])
+        response = self.client.post(reverse('logout'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # Первым стоит SessionAuthentication, поэтому отказ — 403, а не 401
+        self.assertEqual(self.client.get(reverse('check-auth')).status_code, 403)
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_password_change_invalidates_access_token(self):
+        self.authorize(self.tokens['access'])
+        self.client.get(reverse('check-auth'))
+        self.user.set_password('new-pass')
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('check-auth')).status_code, 403)
+
+    def test_basic_auth_is_disabled_by_default(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'token1:pass').decode())
+        self.assertEqual(self.client.get(reverse('check-auth')).status_code, 403)
@@ -0,0 +1,60 @@
+"""
+JWT-токены с проверками через общий кэш вместо запросов к БД:
+черный список refresh-токенов и отзыв access-токенов при выходе.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
+
+BLACKLISTED = 'blacklisted'
+VALID = 'valid'
+
+
+def _remaining(token):
+    # Запись в кэше не нужна дольше, чем живет сам токен
+    left = datetime_from_epoch(token['exp']) - aware_utcnow()
+    return max(int(left.total_seconds()), 1)
+
+
+def _blacklist_key(jti):
+    return f'jwt:blacklist:{jti}'
+
+
+def _revoked_key(jti):
+    return f'jwt:revoked:{jti}'
+
+
+class CachedRefreshToken(RefreshToken):
+    """
+    Refresh-токен, проверяющий черный список через кэш. БД читается только
+    при промахе; результат хранится не дольше JWT_BLACKLIST_CACHE_TTL.
+    """
+
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        key = _blacklist_key(jti)
+        state = cache.get(key)
+        if state is None:
+            state = BLACKLISTED if BlacklistedToken.objects.filter(token__jti=jti).exists() else VALID
+            cache.set(key, state, timeout=min(_remaining(self), settings.JWT_BLACKLIST_CACHE_TTL))
+        if state == BLACKLISTED:
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        result = super().blacklist()
+        cache.set(_blacklist_key(self.payload[api_settings.JTI_CLAIM]), BLACKLISTED, timeout=_remaining(self))
+        return result
+
+
+def revoke_access_token(token):
+    """Отзывает access-токен до истечения его срока (выход из системы)."""
+    cache.set(_revoked_key(token[api_settings.JTI_CLAIM]), True, timeout=_remaining(token))
+
+
+def is_access_token_revoked(token):
+    return bool(cache.get(_revoked_key(token[api_settings.JTI_CLAIM])))
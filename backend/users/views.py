@@ -5,10 +5,16 @@ from django.contrib.auth import authenticate, login, logout
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.contrib.auth import get_user_model
 from .serializers import UserSerializer
+from .pagination import UserCursorPagination
+from .tokens import CachedRefreshToken, revoke_access_token
+from storage.queue import enqueue
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+from django.db import transaction
+from django.db.models import Q
 from django.middleware.csrf import get_token
 from django.http import JsonResponse
 import logging
-import json
 from django.contrib.auth import update_session_auth_hash
 # from users.models import CustomUser as User
 
@@ -16,6 +22,10 @@ logger = logging.getLogger('users')
 
 User = get_user_model()
 
+# Поля, которые меняются UPDATE-ами без сигналов (счетчики места, аватар из фоновых задач):
+# у пользователя из кэша аутентификации они могут устареть, поэтому перед отдачей перечитываются
+VOLATILE_FIELDS = ['storage_used', 'files_count', 'avatar']
+
 def get_csrf_token(request):
     return JsonResponse({"csrfToken": get_token(request)})
 
@@ -28,13 +38,13 @@ class RegisterView(APIView):
         if serializer.is_valid():
             user = serializer.save()
             login(request, user)  # ВАЖНО: создаем сессию
-            logger.info(f"User registered: {user.login}")
+            logger.info("User registered: %s", user.login)
             return Response({
                 "message": "Registration successful",
                 "user": UserSerializer(user).data,
             }, status=status.HTTP_201_CREATED)
 
-        logger.warning(f"Registration failed: {serializer.errors}")
+        logger.warning("Registration failed: %s", serializer.errors)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # Логин через сессию
@@ -44,14 +54,12 @@ class LoginView(APIView):
     def post(self, request):
         login_data = request.data.get("login")
         password = request.data.get("password")
-        logger.info(f"test: {password}")
 
         if not login_data or not password:
             return Response({"message": "Login and password are required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        logger.info(f"Login attempt for: {login_data}")
+        logger.debug("Login attempt for: %s", login_data)
         user = authenticate(request, login=login_data, password=password)
-        logger.info(f"test: {user}")
 
         if request.session.get('_auth_user_id'):
             logout(request)
@@ -76,7 +84,7 @@ class LoginView(APIView):
         
         logout(request)
 
-        logger.info(f"Authentication failed for: {login_data}")
+        logger.info("Authentication failed for: %s", login_data)
         return Response({"message": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
 # Проверка сессии (получение текущего пользователя)
@@ -84,7 +92,9 @@ class CheckAuthView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        return Response({"message": "Authenticated", "user": UserSerializer(request.user).data}, status=status.HTTP_200_OK)
+        user = request.user
+        user.refresh_from_db(fields=VOLATILE_FIELDS)
+        return Response({"message": "Authenticated", "user": UserSerializer(user).data}, status=status.HTTP_200_OK)
 
 # Обновление полей пользователя
 class UpdateUserView(APIView):
@@ -94,18 +104,12 @@ class UpdateUserView(APIView):
         user = request.user
         data = request.data
 
-        logger.info(f"Received cookies: {json.dumps(request.COOKIES)}")
-
-        logger.info(f"User {user.fullname} attempting to update user data.")
-
-        # Логируем, кто является текущим пользователем
-        logger.info(f"Current user: {user.fullname}, is admin: {user.is_admin}")
+        logger.debug("User %s (admin: %s) attempting to update user data.", user.id, user.is_admin)
 
         target_user_id = data.get('id', None)
         target_user = user
 
         # Если пользователь администратор, он может обновить данные другого пользователя
-        logger.error(f"не админ: {user.is_admin}")
         if user.is_admin and target_user_id:
             try:
                 target_user = User.objects.get(id=target_user_id)
@@ -122,14 +126,11 @@ class UpdateUserView(APIView):
         if not updated_fields:
             return Response({"error": "No valid fields provided for update."}, status=status.HTTP_400_BAD_REQUEST)
 
-        logger.info(f"Before update: user {target_user.fullname}, session_key: {request.session.session_key}")
         # Обновляем поля
         for field, value in updated_fields.items():
             # Если обновляется пароль, можно добавить дополнительную проверку
             if 'password' in updated_fields:
-                logger.info(f"Received raw password for user {target_user.fullname}: {value}")
                 target_user.set_password(updated_fields['password'])  # Хэшируем пароль
-                logger.info(f"Hashed password for user {target_user.fullname}: {target_user.password}")
                 update_session_auth_hash(request, target_user)
             else:
                 setattr(target_user, field, value)
@@ -138,9 +139,11 @@ class UpdateUserView(APIView):
 
         
 
-        target_user.save()
+        # Только измененные поля: полное сохранение записало бы устаревшие счетчики из кэша
+        target_user.save(update_fields=sorted(updated_fields))
+        target_user.refresh_from_db(fields=[field for field in VOLATILE_FIELDS if field not in updated_fields])
 
-        logger.info(f"Before update: user {target_user.fullname}, session_key: {request.session.session_key}")
+        logger.info("User %s updated fields: %s", target_user.id, sorted(updated_fields))
         serializer = UserSerializer(target_user)
         return Response({"user": serializer.data}, status=status.HTTP_200_OK)
 
@@ -152,10 +155,18 @@ class LogoutView(APIView):
     def post(self, request):
         try:
             request.session.flush()  # Удаление сессии
+            # Клиент с JWT: отзываем текущий access-токен и, если передан, refresh-токен
+            if isinstance(request.auth, AccessToken):
+                revoke_access_token(request.auth)
+            if request.data.get('refresh'):
+                try:
+                    CachedRefreshToken(request.data['refresh']).blacklist()
+                except TokenError:
+                    pass
             logger.info("User logged out.")
             return Response({"message": "Logout successful."}, status=status.HTTP_200_OK)
         except Exception as e:
-            logger.error(f"Logout failed: {e}")
+            logger.exception("Logout failed: %s", e)
             return Response({"message": "Logout failed"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 # Удаление пользователя
@@ -168,11 +179,17 @@ class DeleteUserView(APIView):
         
         try:
             target_user = User.objects.get(id=user_id)
-            target_user.delete()
-            return Response({"message": "Пользователь удалён"}, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({"error": "Пользователь не найден"}, status=status.HTTP_404_NOT_FOUND)
 
+        # Пользователь сразу теряет доступ, а файлы и сама запись удаляются фоновой задачей
+        with transaction.atomic():
+            target_user.is_active = False
+            target_user.save(update_fields=['is_active'])
+            enqueue('delete_user', user_id=target_user.id)
+        logger.info("User %s scheduled for deletion", target_user.id)
+        return Response({"message": "Пользователь будет удалён"}, status=status.HTTP_202_ACCEPTED)
+
 # Получение списка пользователей
 class GetUsersView(APIView):
     permission_classes = [IsAuthenticated]
@@ -181,10 +198,18 @@ class GetUsersView(APIView):
         if not request.user.is_admin:
             return Response({"error": "Нет прав для просмотра пользователей"}, status=status.HTTP_403_FORBIDDEN)
         
+        paginator = UserCursorPagination()
+        users = User.objects.all()
+        # Поиск по началу логина, имени или email (префиксные индексы, см. миграцию 0003)
+        search = request.query_params.get('search', '').strip()
+        if search:
+            users = users.filter(
+                Q(login__istartswith=search) | Q(fullname__istartswith=search) | Q(email__istartswith=search)
+            )
+
         try:
-            users = User.objects.all()
-            serializer = UserSerializer(users, many=True)
-            return Response({"users": serializer.data}, status=status.HTTP_200_OK)
-        except Exception as e:
-            logger.error(f"Ошибка при получении пользователей: {e}")
-            return Response({"error": "Не удалось получить список пользователей"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            page = paginator.paginate_queryset(users, request, view=self)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = UserSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
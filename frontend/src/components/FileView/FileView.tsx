@@ -56,7 +56,7 @@ export const FileView: React.FC<FileViewProps> = ({ file, onClose }) => {
 
   // Загрузка файла
   const handleDownload = () => {
-    dispatch(downloadFile({ fileId: file.id, fileName: file.file_name }))
+    dispatch(downloadFile({ fileId: file.id, fileName: file.file_name, downloadUrl: file.download_url }))
     .unwrap()
     .then(() => {
         console.log('Файл успешно скачан');
@@ -71,7 +71,8 @@ export const FileView: React.FC<FileViewProps> = ({ file, onClose }) => {
   return (
   	<div className='file_view'>
       <h2>Редактирование файла: {tempFileName}</h2>
-      {isImage && <img src={file.url} alt='фото' />}
+      {/* Показываем превью вместо оригинала, если сервер умеет его строить */}
+      {isImage && <img src={file.preview_url ? `${file.preview_url}?size=large` : file.url} alt='фото' />}
       <table className='file__table'>
         <tbody>
           <tr className='file__field'>
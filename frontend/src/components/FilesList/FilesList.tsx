@@ -15,6 +15,7 @@ export const FilesList: React.FC<FilesListProps> = ({ user }) => {
   const navigate = useNavigate();
   const dispatch = useAppDispatch();
   const files = useAppSelector((state) => state.files.files);
+  const nextCursor = useAppSelector((state) => state.files.nextCursor);
   const [selectedFile, setSelectedFile] = useState<CustomFile | null>(null);
 
   // Переход к редактированию файла
@@ -110,6 +111,11 @@ export const FilesList: React.FC<FilesListProps> = ({ user }) => {
           ) : (
             <p>Нет доступных файлов</p>
           )}
+          {nextCursor && (
+            <button className="btn" onClick={() => dispatch(fetchFiles({ userId: user.id, cursor: nextCursor }))}>
+              Показать ещё
+            </button>
+          )}
           <button className="btn back" onClick={handleProfile}>Профиль</button>
         </>
       )}
@@ -20,6 +20,7 @@ export const AdminUserList: React.FC = () => {
   const navigate = useNavigate();
   const dispatch = useAppDispatch();
   const users = useAppSelector((state) => state.auth.users);
+  const usersNextCursor = useAppSelector((state) => state.auth.usersNextCursor);
   const currentUser = useAppSelector((state) => state.auth.currentUser);
   const [editedUsers, setEditedUsers] = useState<{ [key: number]: Partial<User> }>({});
   const [selectedUser, setSelectedUser] = useState<User | null>(null);
@@ -325,6 +326,11 @@ export const AdminUserList: React.FC = () => {
           ) : (
             <p>Пользователи не найдены.</p>
           )}
+          {usersNextCursor && (
+            <button className="btn" onClick={() => dispatch(fetchUsers({ cursor: usersNextCursor }))}>
+              Показать ещё
+            </button>
+          )}
         </>
       )}
     </section>
@@ -1,10 +1,11 @@
 import { createSlice, createAsyncThunk } from '@reduxjs/toolkit';
 import { getApiClientWithCsrf, apiClient } from '../utils/axios';
-import { User } from '../types/types';
+import { User, UsersPage } from '../types/types';
 
 interface AuthState {
   currentUser: User | null;
   users: User[];
+  usersNextCursor: string | null;
   loading: boolean;
   error: string | null;
 };
@@ -12,6 +13,7 @@ interface AuthState {
 const initialState: AuthState = {
   currentUser: null,
   users: [],
+  usersNextCursor: null,
   loading: false,
   error: null,
 };
@@ -34,14 +36,21 @@ export const registerUser = createAsyncThunk<
   }
 );
 
-// Получение списка пользователей
-export const fetchUsers = createAsyncThunk<User[], void, { rejectValue: string }>(
+// Получение страницы списка пользователей (без cursor — первой)
+export const fetchUsers = createAsyncThunk<
+  { users: User[]; nextCursor: string | null; append: boolean },
+  { search?: string; cursor?: string | null } | void,
+  { rejectValue: string }
+>(
   'auth/fetchUsers',
-  async (_, { rejectWithValue }) => {
+  async (params, { rejectWithValue }) => {
     try {
       const client = await getApiClientWithCsrf();
-      const response = await client.get('users/');
-      return response.data.users;
+      // Следующая страница загружается по next_cursor кнопкой «Показать ещё»
+      const response: { data: UsersPage } = await client.get('users/', {
+        params: { search: params?.search || undefined, cursor: params?.cursor || undefined },
+      });
+      return { users: response.data.users, nextCursor: response.data.next_cursor, append: Boolean(params?.cursor) };
     } catch (error: any) {
       return rejectWithValue(error.response?.data?.message || 'Ошибка при загрузке пользователей');
     }
@@ -122,6 +131,7 @@ const authSlice = createSlice({
     clearAuth: (state) => {
       state.currentUser = null;
       state.users = [];
+      state.usersNextCursor = null;
       state.error = null;
     },
   },
@@ -169,7 +179,9 @@ const authSlice = createSlice({
         state.loading = true;
       })
       .addCase(fetchUsers.fulfilled, (state, action) => {
-        state.users = action.payload;
+        const { users, nextCursor, append } = action.payload;
+        state.users = append ? [...state.users, ...users] : users;
+        state.usersNextCursor = nextCursor;
         state.loading = false;
       })
       .addCase(fetchUsers.rejected, (state, action) => {
@@ -1,30 +1,35 @@
 import { createSlice, createAsyncThunk } from '@reduxjs/toolkit';
 import { getApiClientWithCsrf, getCsrfToken } from '../utils/axios';
-import { File, UploadResponse } from '../types/types';
+import { File, FilesPage, UploadResponse } from '../types/types';
 
 interface FileState {
   files: File[];
+  nextCursor: string | null;
   loading: boolean;
   error: string | null;
 }
 
 const initialState: FileState = {
   files: [],
+  nextCursor: null,
   loading: false,
   error: null,
 };
 
-// Получение списка файлов пользователя
+// Получение страницы списка файлов пользователя (без cursor — первой, новые файлы сверху)
 export const fetchFiles = createAsyncThunk<
-  File[],
-  { userId: number },
+  { files: File[]; nextCursor: string | null; append: boolean },
+  { userId: number; cursor?: string | null },
   { rejectValue: string }
->('files/fetchFiles', async ({ userId }, { rejectWithValue }) => {
+>('files/fetchFiles', async ({ userId, cursor }, { rejectWithValue }) => {
   try {
     await getCsrfToken();
     const client = await getApiClientWithCsrf();
-    const response = await client.get(`/files/${userId}/`);
-    return response.data;
+    // Следующая страница загружается по next_cursor кнопкой «Показать ещё»
+    const response: { data: FilesPage } = await client.get(`/files/${userId}/`, {
+      params: cursor ? { cursor } : {},
+    });
+    return { files: response.data.results, nextCursor: response.data.next_cursor, append: Boolean(cursor) };
   } catch (error: any) {
     console.error('Error in fetchFiles:', error);
     return rejectWithValue(
@@ -109,9 +114,16 @@ export const updateFileComment = createAsyncThunk<
 // Скачивание файла
 export const downloadFile = createAsyncThunk<
   void,
-  { fileId: number, fileName?: string },
+  { fileId: number, fileName?: string, downloadUrl?: string | null },
   { rejectValue: string }
->('files/downloadFile', async ({ fileId, fileName }, { rejectWithValue }) => {
+>('files/downloadFile', async ({ fileId, fileName, downloadUrl }, { rejectWithValue }) => {
+  // Подписанная ссылка: браузер скачивает файл сам, без загрузки в память
+  if (downloadUrl) {
+    const link = document.createElement('a');
+    link.href = downloadUrl;
+    link.click();
+    return;
+  }
   try {
     const client = await getApiClientWithCsrf();
     const response = await client.get(`/files/${fileId}/download/`, {
@@ -156,6 +168,7 @@ const fileSlice = createSlice({
   reducers: {
     resetState: (state) => {
       state.files = [];
+      state.nextCursor = null;
       state.loading = false;
       state.error = null;
     },
@@ -166,7 +179,9 @@ const fileSlice = createSlice({
       // Получение файлов
       .addCase(fetchFiles.pending, handlePending)
       .addCase(fetchFiles.fulfilled, (state, action) => {
-        state.files = action.payload;
+        const { files, nextCursor, append } = action.payload;
+        state.files = append ? [...state.files, ...files] : files;
+        state.nextCursor = nextCursor;
         state.loading = false;
       })
       .addCase(fetchFiles.rejected, handleRejected)
@@ -174,7 +189,7 @@ const fileSlice = createSlice({
 			// Загрузка файла
       .addCase(uploadFile.pending, handlePending)
       .addCase(uploadFile.fulfilled, (state, action) => {
-        state.files.push(...action.payload.uploaded_files);
+        state.files.unshift(...action.payload.uploaded_files);
         state.loading = false;
       })
       .addCase(uploadFile.rejected, handleRejected)
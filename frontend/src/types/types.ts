@@ -7,6 +7,9 @@ export interface User {
   all_users?: User[];
   avatar?: string;
   files?: File[] | null;
+  storage_used?: number;
+  files_count?: number;
+  storage_quota?: number | null;
 }
 
 export interface File {
@@ -19,6 +22,8 @@ export interface File {
   last_downloaded?: string;
   user_id: number;
   comment?: string;
+  preview_url?: string | null;
+  download_url?: string | null;
 }
 
 export interface UploadedFile {
@@ -29,6 +34,16 @@ export interface UploadedFile {
   type: string;
 }
 
+export interface UsersPage {
+  users: User[];
+  next_cursor: string | null;
+}
+
+export interface FilesPage {
+  results: File[];
+  next_cursor: string | null;
+}
+
 export interface UploadResponse {
   uploaded_files: File[];
 }